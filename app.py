@@ -3,9 +3,14 @@ import logging
 from duck import DuckDBAnalyzer
 from logging_decorator import log_function
 
-from query_functions import generate_device_health_report, generate_fleet_health_report, sensor_anomaly_detection
+from query_functions import (generate_device_health_report, generate_fleet_health_report, generate_level_kpi_report,
+                             sensor_anomaly_detection)
 from proactive.query_functions_ds import generate_mechanical_failure_report
-from data_types import dtype_mapping_device, dtype_mapping_sensor, date_cols
+from sharding import run_sharded_pipeline, shard_root
+from checkpoints import CheckpointStore
+from leaderboard import update_leaderboard
+from mesh_join import generate_mesh_report
+from data_types import dtype_mapping_device, dtype_mapping_sensor, date_cols, quality_rules_device, quality_rules_sensor
 
 class Colors:
     GREEN = '\033[92m'
@@ -17,46 +22,128 @@ class Colors:
 
 logger = logging.getLogger(__name__)
 
-if __name__ == "__main__":
-    @log_function
-    def main():
-        logger.info("Starting ATMS Data Analysis Application")
-        #######################################################################
-        # First i'll load the data from the csv files into duckDB for analyze ##
-        #######################################################################
-
-        START_DATE = '2023-01-01'
-        END_DATE = '2023-12-31'
-
-        time_in_level_device_desc = "data/time_in_level_device_desc.csv"
-        time_in_level_device_data = "data/time_in_level_device.csv"
-
-        time_in_level_sensor_desc = "data/time_in_level_sensor_desc.csv"
-        time_in_level_sensor_data = "data/time_in_level_sensor.csv"
-
-        analyzer = DuckDBAnalyzer()
-
-        logger.info("Registering device data...")
-        analyzer.register_dataframe( 'time_in_level_device',
-            time_in_level_device_desc, time_in_level_device_data, 
-            dtype_mapping_device, date_cols)
-        
-        logger.info("Registering sensor data...")
-        analyzer.register_dataframe( 'time_in_level_sensor',
-            time_in_level_sensor_desc, time_in_level_sensor_data, 
-            dtype_mapping_sensor, date_cols)
-        #######################################################################
-        # Now that the data is loaded, we can create the necessary tables and perform the analysis to detect anomalies in temperature states. ##
-        #######################################################################
-
-        # logger.info("Performing comprehensive fleet health analysis...")
-        # generate_fleet_health_report(analyzer, START_DATE, END_DATE)
+# Default run configuration (see run_pipeline)
+START_DATE = '2023-01-01'
+END_DATE = '2023-12-31'
+
+# Optional persistent store, Hive-partitioned by year/month.
+# Reports then only read the month partitions of the requested range.
+PARTITION_STORE = None  # e.g. "store/"
+# Sharded mode (needs PARTITION_STORE): per-vehicle stages run in N worker processes over a
+# store split into N vehicle buckets (its own root, see sharding.shard_root). Same outputs,
+# but checkpoints then only cover ingest: the sharded report stages always recompute.
+SHARDS = None  # e.g. os.cpu_count()
+
+# Optional stage checkpoints: reruns skip ingest/features/model stages whose inputs are unchanged
+CHECKPOINTS = None  # e.g. "checkpoints/"
+
+# Reports run on top of device health and mechanical failures (see run_pipeline's reports)
+OPTIONAL_REPORTS = {
+    'fleet_health': False,          # output/report_sensor_availability_*.csv
+    'anomaly_detection': False,     # output/anomalies_from_sensors.csv, ranked in the leaderboard
+    'level_kpi': False,             # output/kpi_*.csv
+    'mesh': False,                  # output/mesh_vehicle_daily.csv
+}
+
+# Execution limits, so several pipelines can share a host and big window
+# queries spill to disk instead of running out of memory.
+DUCKDB_SETTINGS = {
+    'database': ':memory:',         # or a file path for an on-disk database
+    'threads': None,                # None = all cores
+    'memory_limit': None,           # e.g. '4GB'
+    'temp_directory': 'tmp/duckdb_spill',
+    'preserve_insertion_order': False,
+}
+
+
+@log_function
+def run_pipeline(start_date=START_DATE, end_date=END_DATE, partition_store=PARTITION_STORE, shards=SHARDS,
+                 checkpoints_root=CHECKPOINTS, duckdb_settings=None, reports=None):
+    """
+    The whole analysis over data/ of the working directory, reports written to output/.
+    duckdb_settings overrides DUCKDB_SETTINGS (see batch_runner.py for several fleets per host),
+    reports overrides OPTIONAL_REPORTS.
+    """
+    reports = {**OPTIONAL_REPORTS, **(reports or {})}
+    logger.info("Starting ATMS Data Analysis Application")
+    #######################################################################
+    # First i'll load the data from the csv files into duckDB for analyze ##
+    #######################################################################
+
+    time_in_level_device_desc = "data/time_in_level_device_desc.csv"
+    time_in_level_device_data = "data/time_in_level_device.csv"
+
+    time_in_level_sensor_desc = "data/time_in_level_sensor_desc.csv"
+    time_in_level_sensor_data = "data/time_in_level_sensor.csv"
+
+    analyzer = DuckDBAnalyzer(**{**DUCKDB_SETTINGS, **(duckdb_settings or {})})
+    checkpoints = CheckpointStore(checkpoints_root) if checkpoints_root else None
+
+    if shards and not partition_store:
+        raise ValueError("Sharded mode needs a partition_store to split the vehicles into buckets")
+
+    # With a partitioned store the tables are read from it, pruned to the report range;
+    # the CSV is only parsed (and its changed months rewritten) when the store is out of date.
+    register = analyzer.register_dataframe
+    if partition_store:
+        def register(name, path_header, path_data, dtype_mapping, date_columns, quality_rules, checkpoints):
+            root = shard_root(partition_store, name, shards) if shards else f"{partition_store}{name}"
+            return analyzer.register_stored(name, root, path_header, path_data, dtype_mapping, date_columns,
+                                            quality_rules, checkpoints, start_date, end_date, vehicle_buckets=shards)
+
+    logger.info("Registering device data...")
+    quality_device = register( 'time_in_level_device',
+        time_in_level_device_desc, time_in_level_device_data, 
+        dtype_mapping_device, date_cols, quality_rules_device, checkpoints)
+    
+    logger.info("Registering sensor data...")
+    quality_sensor = register( 'time_in_level_sensor',
+        time_in_level_sensor_desc, time_in_level_sensor_data, 
+        dtype_mapping_sensor, date_cols, quality_rules_sensor, checkpoints)
+
+    # Rows failing the ingest checks stay in the *_quarantine tables, not in the reports
+    quality_device.to_csv("output/data_quality_device.csv", index=False)
+    quality_sensor.to_csv("output/data_quality_sensor.csv", index=False)
+
+    #######################################################################
+    # Now that the data is loaded, we can create the necessary tables and perform the analysis to detect anomalies in temperature states. ##
+    #######################################################################
+
+    if shards:
+        if checkpoints:
+            logger.warning("Sharded mode: checkpoints only cover ingest, the report stages are recomputed")
+        logger.info(f"Running sharded pipeline over {shards} vehicle shards...")
+        sensor_risk_df, hub_risk_df, anomalies_df = run_sharded_pipeline(
+            partition_store, start_date, end_date, shards, fleet_health=reports['fleet_health'],
+            anomaly_detection=reports['anomaly_detection'])
+        if anomalies_df is not None:
+            update_leaderboard(anomalies_df)
+    else:
+        if reports['fleet_health']:
+            logger.info("Performing comprehensive fleet health analysis...")
+            generate_fleet_health_report(analyzer, start_date, end_date)
         logger.info("Performing comprehensive device health analysis...")
-        generate_device_health_report(analyzer, START_DATE, END_DATE)
-        # logger.info("Performing comprehensive anomaly detection...")
-        # sensor_anomaly_detection(analyzer, START_DATE, END_DATE)
+        generate_device_health_report(analyzer, start_date, end_date)
+        if reports['anomaly_detection']:
+            logger.info("Performing comprehensive anomaly detection...")
+            update_leaderboard(sensor_anomaly_detection(analyzer, start_date, end_date, checkpoints=checkpoints))
 
         logger.info("Performing comprehensive mechanical failure analysis...")
-        generate_mechanical_failure_report(analyzer, START_DATE, END_DATE)
-    
-    main()
\ No newline at end of file
+        sensor_risk_df, hub_risk_df = generate_mechanical_failure_report(analyzer, start_date, end_date,
+                                                                         checkpoints=checkpoints)
+
+    # Fleet-wide single-pass reports run on this connection in both modes
+    if reports['level_kpi']:
+        logger.info("Computing level distribution KPIs...")
+        generate_level_kpi_report(analyzer, start_date, end_date)
+    if reports['mesh']:
+        logger.info("Aligning sensors to hubs per vehicle-day (mesh reporting)...")
+        generate_mesh_report(analyzer, start_date, end_date)
+
+    # Keep the riskiest wheels/hubs per day indexed for instant top-K queries (output/risk_leaderboard.parquet)
+    update_leaderboard(sensor_risk_df, hub_risk_df)
+    analyzer.close()
+
+
+if __name__ == "__main__":
+    run_pipeline()
@@ -0,0 +1,170 @@
+import logging
+from datetime import datetime
+
+from logging_decorator import log_function
+
+logger = logging.getLogger(__name__)
+
+# Stratified sample: every (vehicle, month) keeps SAMPLE_FRACTION of its rows, at least SAMPLE_MIN_ROWS
+SAMPLE_FRACTION = 0.05
+SAMPLE_MIN_ROWS = 20
+SAMPLE_DATE_COLUMN = 'report_start_at'
+# Rows are drawn by the hash of this column, the same rows are drawn on every rebuild
+SAMPLE_KEY = 'id'
+CONFIDENCE_Z = 1.96  # 95% normal interval
+SAMPLES_TABLE = 'approx_samples'
+
+
+def sample_table(name):
+    return f"{name}__sample"
+
+
+def _sample_is_current(analyzer, name, fraction, min_rows):
+    row = analyzer.conn.execute(f"SELECT source_fingerprint, fraction, min_rows FROM {SAMPLES_TABLE} WHERE name = ?",
+                                [name]).fetchone()
+    source = analyzer.fingerprints.get(name)
+    return source is not None and row == (source, fraction, min_rows)
+
+
+@log_function
+def build_sample(analyzer, name, fraction=SAMPLE_FRACTION, min_rows=SAMPLE_MIN_ROWS, force=False):
+    """
+    Persist a stratified sample of a registered table as <name>__sample: per vehicle and
+    month, `fraction` of the rows (at least min_rows, or the whole stratum when smaller),
+    with the stratum, its population and the weight population/sampled of every row.
+    The sample lives in the analyzer's database, so with an on-disk database it is reused
+    across sessions until the table's inputs (analyzer.fingerprints) change.
+    """
+    analyzer.conn.execute(f"""--sql
+CREATE TABLE IF NOT EXISTS {SAMPLES_TABLE} (
+    name VARCHAR PRIMARY KEY, source_fingerprint VARCHAR, fraction DOUBLE, min_rows INTEGER,
+    sample_rows BIGINT, population_rows BIGINT, created_at TIMESTAMP)
+    """)
+    if not force and _sample_is_current(analyzer, name, fraction, min_rows):
+        return sample_table(name)
+
+    table = sample_table(name)
+    analyzer.conn.execute(f"""--sql
+CREATE OR REPLACE TABLE {table} AS
+WITH ranked AS (
+    SELECT
+        *,
+        vehicle_id::VARCHAR || '/' || strftime({SAMPLE_DATE_COLUMN}, '%Y-%m') AS stratum,
+        COUNT(*) OVER (PARTITION BY vehicle_id, date_trunc('month', {SAMPLE_DATE_COLUMN})) AS population,
+        ROW_NUMBER() OVER (PARTITION BY vehicle_id, date_trunc('month', {SAMPLE_DATE_COLUMN})
+                           ORDER BY hash({SAMPLE_KEY})) AS draw
+    FROM {name}
+),
+sampled AS (
+    SELECT * EXCLUDE (draw), LEAST(population, GREATEST({min_rows}, CEIL(population * {fraction}))) AS sampled
+    FROM ranked
+    WHERE draw <= GREATEST({min_rows}, CEIL(population * {fraction}))
+)
+SELECT * EXCLUDE (sampled), population / sampled AS weight
+FROM sampled
+    """)
+    sample_rows, population_rows = analyzer.conn.execute(
+        f"SELECT COUNT(*), (SELECT COUNT(*) FROM {name}) FROM {table}").fetchone()
+    analyzer.conn.execute(f"INSERT OR REPLACE INTO {SAMPLES_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          [name, analyzer.fingerprints.get(name), fraction, min_rows,
+                           sample_rows, population_rows, datetime.now()])
+    logger.info(f"Sample of '{name}': {sample_rows} of {population_rows} rows")
+    return table
+
+
+def _group_select(group_by):
+    return (', '.join(group_by) + ', ') if group_by else ''
+
+
+@log_function
+def estimate(analyzer, name, expr='1', aggregate='sum', where=None, group_by=None):
+    """
+    Estimate SUM(expr), COUNT(*) or AVG(expr) of the rows of name matching where, per group_by
+    columns, from its stratified sample (built on first use). Returns the estimate, its
+    standard error, a CONFIDENCE_Z interval and the sample rows used.
+    - sum/count: stratified expansion estimator, variance from the within-stratum spread
+    - avg: ratio of the estimated sum and count, variance by linearization
+    expr, where and group_by are SQL over the table's columns.
+    """
+    if aggregate not in ('sum', 'count', 'avg'):
+        raise ValueError(f"Unknown aggregate '{aggregate}', expected 'sum', 'count' or 'avg'")
+    if aggregate == 'count':
+        expr = '1'
+    table = build_sample(analyzer, name)
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by or [])
+    groups = _group_select(group_by)
+    join_groups = f"GROUP BY {', '.join(group_by)}" if group_by else ""
+
+    # Rows outside the domain count as y = 0 in their stratum: the per-cell sums only
+    # cover matching rows, the stratum sample size includes all of them.
+    stratum_variance = ("population * population * (1 - sampled / population)"
+                        " * ({syy} - {sy} * {sy} / sampled) / NULLIF(sampled - 1, 0) / sampled")
+    if aggregate == 'avg':
+        # Residuals y - R of the matching rows, R the estimated mean of the group
+        estimate_sql = "SUM(population * sy / sampled) / NULLIF(SUM(population * c / sampled), 0)"
+        variance_sql = (f"SUM({stratum_variance.format(sy='(sy - r * c)', syy='(syy - 2 * r * sy + r * r * c)')})"
+                        " / NULLIF(POW(SUM(population * c / sampled), 2), 0)")
+    else:
+        estimate_sql = "SUM(population * sy / sampled)"
+        variance_sql = f"SUM({stratum_variance.format(sy='sy', syy='syy')})"
+
+    df = analyzer.query(f"""--sql
+WITH strata AS (
+    SELECT stratum, COUNT(*)::DOUBLE AS sampled, ANY_VALUE(population)::DOUBLE AS population
+    FROM {table}
+    GROUP BY stratum
+),
+cells AS (
+    SELECT {groups}stratum, SUM(({expr})::DOUBLE) AS sy, SUM(POW(({expr})::DOUBLE, 2)) AS syy, COUNT(*) AS c
+    FROM {table}
+    WHERE {where or 'true'} AND ({expr}) IS NOT NULL
+    GROUP BY ALL
+),
+joined AS (
+    SELECT *, SUM(population * sy / sampled) OVER g / NULLIF(SUM(population * c / sampled) OVER g, 0) AS r
+    FROM cells JOIN strata USING (stratum)
+    WINDOW g AS ({f"PARTITION BY {', '.join(group_by)}" if group_by else ''})
+)
+SELECT
+    {groups}{estimate_sql} AS estimate,
+    SQRT(GREATEST({variance_sql}, 0)) AS std_error,
+    SUM(c) AS sample_rows
+FROM joined
+{join_groups}
+ORDER BY ALL
+    """)
+    df['ci_low'] = df['estimate'] - CONFIDENCE_Z * df['std_error']
+    df['ci_high'] = df['estimate'] + CONFIDENCE_Z * df['std_error']
+    return df
+
+
+@log_function
+def approx_distinct(analyzer, name, column, where=None, group_by=None):
+    """
+    Distinct count of column with a HyperLogLog sketch (approx_count_distinct) over the
+    whole table: no hash table of the values, a few percent of error, no interval reported.
+    """
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by or [])
+    groups = _group_select(group_by)
+    return analyzer.query(f"""--sql
+SELECT {groups}approx_count_distinct({column}) AS approx_distinct
+FROM {name}
+WHERE {where or 'true'}
+{"GROUP BY ALL" if group_by else ""}
+ORDER BY ALL
+    """)
+
+
+@log_function
+def approx_quantiles(analyzer, name, column, quantiles=(0.5, 0.9, 0.99), where=None, group_by=None):
+    """Quantiles of column from a T-Digest sketch (approx_quantile) over the whole table, one column per quantile"""
+    group_by = [group_by] if isinstance(group_by, str) else list(group_by or [])
+    groups = _group_select(group_by)
+    columns = ', '.join(f'approx_quantile({column}, {q}) AS "p{q * 100:g}"' for q in quantiles)
+    return analyzer.query(f"""--sql
+SELECT {groups}{columns}
+FROM {name}
+WHERE {where or 'true'}
+{"GROUP BY ALL" if group_by else ""}
+ORDER BY ALL
+    """)
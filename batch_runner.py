@@ -0,0 +1,163 @@
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from logging_decorator import log_function
+
+logger = logging.getLogger(__name__)
+
+# Default DuckDB memory limit of every tenant pipeline, override per root with memory_limits.
+# Only DuckDB is held to it: the pandas/sklearn stages and their joblib workers are not capped.
+TENANT_MEMORY_LIMIT = '4GB'
+TIMING_REPORT_PATH = 'batch_timing.csv'
+# Log of each fleet, written in its root instead of the batch's shared app_logs.log
+TENANT_LOG_FILE = 'app_logs.log'
+# Environment capping the processes/threads of joblib (n_jobs=-1) and of the BLAS/OpenMP pools
+CPU_LIMIT_VARIABLES = ['LOKY_MAX_CPU_COUNT', 'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']
+
+
+def _warm_worker():
+    """Pool initializer: pay the heavy imports (DuckDB, pandas, sklearn) once per worker, not per fleet"""
+    import duckdb  # noqa: F401
+    import sklearn.ensemble  # noqa: F401
+
+
+def _set_cpu_limits(threads):
+    """
+    Set CPU_LIMIT_VARIABLES in this process, so the workers spawned next inherit them before
+    they import NumPy (the BLAS pools read them once, at load). Returns the previous values.
+    """
+    previous = {variable: os.environ.get(variable) for variable in CPU_LIMIT_VARIABLES}
+    os.environ.update({variable: str(threads) for variable in CPU_LIMIT_VARIABLES})
+    return previous
+
+
+def _restore_environment(previous):
+    for variable, value in previous.items():
+        if value is None:
+            os.environ.pop(variable, None)
+        else:
+            os.environ[variable] = value
+
+
+def _log_to_root(root):
+    """Swap the root logger's file handlers for one writing to the fleet's own log, returns a restore callback"""
+    root_logger = logging.getLogger()
+    shared = [handler for handler in root_logger.handlers if isinstance(handler, logging.FileHandler)]
+    tenant_handler = logging.FileHandler(os.path.join(root, TENANT_LOG_FILE))
+    if shared:
+        tenant_handler.setFormatter(shared[0].formatter)
+    for handler in shared:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(tenant_handler)
+
+    def restore():
+        root_logger.removeHandler(tenant_handler)
+        tenant_handler.close()
+        for handler in shared:
+            root_logger.addHandler(handler)
+    return restore
+
+
+def _dataset_size(root):
+    """Bytes of a tenant's data/ folder, used to start the biggest fleets first"""
+    total = 0
+    for folder, _, files in os.walk(os.path.join(root, 'data')):
+        total += sum(os.path.getsize(os.path.join(folder, f)) for f in files)
+    return total
+
+
+def _run_tenant(root, memory_limit, threads, pipeline_options):
+    """
+    Worker: run the whole pipeline of one fleet inside its root, so its data/, output/,
+    checkpoints, DuckDB spill folder and log all stay under that root.
+    Failures are reported, not raised: one broken fleet does not stop the batch.
+    """
+    from app import run_pipeline
+
+    started, cpu_started = time.time(), time.process_time()
+    cwd = os.getcwd()
+    status, error = 'ok', None
+    restore_log = _log_to_root(root)
+    try:
+        os.chdir(root)
+        os.makedirs('output', exist_ok=True)
+        run_pipeline(duckdb_settings={'memory_limit': memory_limit, 'threads': threads}, **pipeline_options)
+    except Exception as e:
+        status, error = 'failed', repr(e)
+    finally:
+        os.chdir(cwd)
+        restore_log()
+    return {
+        'tenant': os.path.basename(os.path.normpath(root)),
+        'root': root,
+        'status': status,
+        'error': error,
+        'worker_pid': os.getpid(),
+        'wall_seconds': time.time() - started,
+        'cpu_seconds': time.process_time() - cpu_started,
+        'memory_limit': memory_limit,
+    }
+
+
+@log_function
+def run_batch(roots, max_workers=None, memory_limit=TENANT_MEMORY_LIMIT, memory_limits=None,
+              timing_report_path=TIMING_REPORT_PATH, **pipeline_options):
+    """
+    Run the pipeline (app.run_pipeline) for several fleets, each root holding its own data/
+    and receiving its own output/. One warm pool of max_workers processes is shared by
+    every fleet, the biggest datasets are scheduled first and each fleet gets
+    cores / max_workers of the cores, for DuckDB threads as for joblib and BLAS workers,
+    so the fleets together keep every core busy without oversubscribing it.
+    memory_limits maps a root to its own DuckDB memory limit; the pandas/sklearn stages
+    are not bound by it, leave headroom for them when sizing the limits.
+    pipeline_options are passed on to run_pipeline (start_date, end_date, ...).
+    Returns the timing report (also written to timing_report_path), one row per fleet;
+    cpu_seconds covers every thread of the fleet's worker, not the joblib processes it starts.
+    """
+    if not roots:
+        raise ValueError("run_batch needs at least one fleet root")
+    cores = os.cpu_count() or 1
+    max_workers = max_workers or min(len(roots), cores)
+    threads = max(1, cores // max_workers)
+    memory_limits = memory_limits or {}
+    roots = sorted(roots, key=_dataset_size, reverse=True)
+
+    started = time.time()
+    rows = []
+    previous_environment = _set_cpu_limits(threads)
+    try:
+        # spawn: never fork a process that holds DuckDB threads
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_warm_worker) as pool:
+            futures = [pool.submit(_run_tenant, os.path.abspath(root), memory_limits.get(root, memory_limit),
+                                   threads, pipeline_options)
+                       for root in roots]
+            for future in as_completed(futures):
+                row = future.result()
+                logger.info(f"Fleet '{row['tenant']}' {row['status']} in {row['wall_seconds']:.1f}s")
+                rows.append(row)
+    finally:
+        _restore_environment(previous_environment)
+    wall_seconds = time.time() - started
+
+    report = pd.DataFrame(rows).sort_values('tenant').reset_index(drop=True)
+    report.to_csv(timing_report_path, index=False)
+    cpu_seconds = report['cpu_seconds'].sum()
+    logger.info(f"Batch of {len(report)} fleets on {max_workers} workers x {threads} threads: "
+                f"{wall_seconds:.1f}s wall, {report['wall_seconds'].sum():.1f}s of fleet runs, "
+                f"{cpu_seconds:.1f}s CPU ({cpu_seconds / (wall_seconds * cores):.0%} of the host), "
+                f"{(report['status'] != 'ok').sum()} failed")
+    return report
+
+
+if __name__ == "__main__":
+    # python batch_runner.py fleets/a fleets/b ...
+    if len(sys.argv) < 2:
+        sys.exit("usage: python batch_runner.py FLEET_ROOT [FLEET_ROOT ...]")
+    run_batch(sys.argv[1:])
@@ -0,0 +1,143 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+
+import duckdb
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_ROOT = 'checkpoints/'
+MANIFEST_FILE = 'manifest.json'
+
+
+def file_signature(*paths):
+    """Path, size and modification time of each file: change detection without reading contents"""
+    return [[os.path.abspath(p), os.path.getsize(p), os.stat(p).st_mtime_ns] for p in paths]
+
+
+def fingerprint(stage, upstream, *config):
+    """
+    Fingerprint of a stage from its upstream inputs (file signature or fingerprints
+    of the previous stages) and its configuration. Chained stages change whenever
+    anything upstream does. An unknown upstream (None) gives None: not checkpointable.
+    """
+    if upstream is None:
+        return None
+    payload = json.dumps([stage, upstream, list(config)], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def table_fingerprint(analyzer, stage, tables, *config):
+    """Fingerprint of a stage reading registered tables (see DuckDBAnalyzer.fingerprints)"""
+    upstream = [analyzer.fingerprints.get(table) for table in tables]
+    return fingerprint(stage, None if None in upstream else upstream, *config)
+
+
+def run_stage(checkpoints, stage, stage_fingerprint, compute, outputs=None):
+    """Run compute() through the checkpoint store when there is one and the inputs are known"""
+    if checkpoints is None or stage_fingerprint is None:
+        return compute()
+    return checkpoints.run(stage, stage_fingerprint, compute, outputs)
+
+
+class CheckpointStore:
+    """
+    Stage-level checkpoints on disk: <root>/<stage>/<frame>.parquet plus a manifest
+    holding the stage fingerprint. A rerun loads every stage whose fingerprint is
+    unchanged and recomputes from the first one that differs.
+    """
+
+    def __init__(self, root=CHECKPOINT_ROOT):
+        self.root = root
+        self.conn = duckdb.connect()
+
+    def _stage_dir(self, stage):
+        return os.path.join(self.root, stage)
+
+    def _manifest(self, stage):
+        path = os.path.join(self._stage_dir(stage), MANIFEST_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def path(self, stage, frame):
+        return os.path.join(self._stage_dir(stage), f"{frame}.parquet")
+
+    def is_valid(self, stage, stage_fingerprint):
+        """Checkpoint exists, matches the fingerprint and its output files are untouched"""
+        manifest = self._manifest(stage)
+        if stage_fingerprint is None or manifest is None or manifest['fingerprint'] != stage_fingerprint:
+            return False
+        outputs = manifest.get('outputs', [])
+        if not all(os.path.exists(path) for path, _, _ in outputs):
+            return False
+        return file_signature(*[path for path, _, _ in outputs]) == outputs
+
+    def load(self, stage, stage_fingerprint):
+        """Frames of a valid checkpoint as DataFrames, None when it is missing or stale"""
+        if not self.is_valid(stage, stage_fingerprint):
+            return None
+        frames = {name: self.conn.execute(f"SELECT * FROM read_parquet('{self.path(stage, name)}')").df()
+                  for name in self._manifest(stage)['frames']}
+        logger.info(f"Checkpoint '{stage}' is up to date, loaded {len(frames)} frames")
+        return frames
+
+    def save(self, stage, stage_fingerprint, frames, conn=None, outputs=None):
+        """
+        Persist the frames of a stage: DataFrames, or names of relations in conn
+        (copied straight from DuckDB). outputs lists files written by the stage,
+        the checkpoint is only valid while they stay unchanged.
+        Written next to the old checkpoint and swapped in, so a failing run
+        never leaves a half-written stage behind.
+        """
+        stage_dir = self._stage_dir(stage)
+        tmp_dir = f"{stage_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        for name, frame in frames.items():
+            path = os.path.join(tmp_dir, f"{name}.parquet")
+            if isinstance(frame, str):
+                conn.execute(f"COPY {frame} TO '{path}' (FORMAT PARQUET)")
+            else:
+                self.conn.register('checkpoint_frame', frame)
+                self.conn.execute(f"COPY checkpoint_frame TO '{path}' (FORMAT PARQUET)")
+                self.conn.unregister('checkpoint_frame')
+
+        manifest = {
+            'stage': stage,
+            'fingerprint': stage_fingerprint,
+            'frames': list(frames),
+            'outputs': file_signature(*(outputs or [])),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        shutil.rmtree(stage_dir, ignore_errors=True)
+        os.replace(tmp_dir, stage_dir)
+        logger.info(f"Checkpoint '{stage}' saved ({len(frames)} frames)")
+
+    def run(self, stage, stage_fingerprint, compute, outputs=None):
+        """
+        Load the stage when its checkpoint is valid, otherwise compute() it (a dict
+        of DataFrames) and save it. outputs may be a callable returning the written
+        files, for stages that only know them after running.
+        """
+        frames = self.load(stage, stage_fingerprint)
+        if frames is None:
+            frames = compute()
+            self.save(stage, stage_fingerprint, frames,
+                      outputs=outputs() if callable(outputs) else outputs)
+        return frames
+
+    def clear(self, stage=None):
+        """Remove one stage's checkpoint, or every checkpoint"""
+        targets = [self._stage_dir(stage)] if stage else glob.glob(os.path.join(self.root, '*'))
+        for target in targets:
+            shutil.rmtree(target, ignore_errors=True)
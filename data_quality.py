@@ -0,0 +1,61 @@
+import logging
+
+from dense_keys import with_dense_keys
+from logging_decorator import log_function
+
+logger = logging.getLogger(__name__)
+
+
+def _reasons_expression(rules):
+    """One list expression holding the codes of every rule the row fails"""
+    checks = ',\n        '.join(f"CASE WHEN {condition} THEN '{code}' END" for code, condition in rules)
+    return f"list_filter([\n        {checks}\n    ], reason -> reason IS NOT NULL)"
+
+
+@log_function
+def apply_quality_gate(analyzer, name, rules, source=None, relation=None):
+    """
+    Validate a registered table (relation, by default name itself) against row-level
+    and cross-column rules in a single vectorized pass, then split it:
+    - <name>: only the rows passing every rule with their dense keys (dense_keys.py),
+      materialized so downstream queries don't re-check anything
+    - <name>_quarantine: failing rows plus a dq_reasons list of reason codes
+    Returns quality metrics per source file (rows, quarantined rows, count per reason).
+    """
+    checked = f"{name}_checked"
+    analyzer.conn.execute(f"""--sql
+CREATE OR REPLACE TEMP TABLE {checked} AS
+SELECT
+    *,
+    {_reasons_expression(rules)} AS dq_reasons
+FROM {relation or name}
+    """)
+
+    analyzer.conn.execute(f"""--sql
+CREATE OR REPLACE TABLE {name}_quarantine AS
+SELECT * FROM {checked} WHERE len(dq_reasons) > 0
+    """)
+    analyzer.replace_relation(name, with_dense_keys(
+        analyzer, f"(SELECT * EXCLUDE (dq_reasons) FROM {checked} WHERE len(dq_reasons) = 0)"))
+
+    columns = [row[0] for row in analyzer.conn.execute(f"DESCRIBE {checked}").fetchall()]
+    source_expr = 'source_file' if 'source_file' in columns else f"'{source or name}'"
+    reason_counts = ', '.join(
+        f"COUNT(*) FILTER (WHERE list_contains(dq_reasons, '{code}')) AS {code.lower()}" for code, _ in rules)
+
+    metrics = analyzer.query(f"""--sql
+SELECT
+    {source_expr} AS source_file,
+    COUNT(*) AS total_rows,
+    COUNT(*) FILTER (WHERE len(dq_reasons) > 0) AS quarantined_rows,
+    ROUND(COUNT(*) FILTER (WHERE len(dq_reasons) > 0)::FLOAT / COUNT(*), 6) AS quarantined_ratio,
+    {reason_counts}
+FROM {checked}
+GROUP BY 1
+ORDER BY 1
+    """)
+    analyzer.conn.execute(f"DROP TABLE {checked}")
+
+    quarantined = int(metrics['quarantined_rows'].sum())
+    logger.info(f"Quality gate on '{name}': {quarantined} of {int(metrics['total_rows'].sum())} rows quarantined")
+    return metrics
@@ -92,3 +92,52 @@ dtype_mapping_sensor = {
 }
 
 date_cols = ['report_start_at', 'updated_at']
+
+# pandas dtypes above -> DuckDB column types, for the multi-file DuckDB CSV reader
+DUCKDB_TYPES = {
+    'Int64': 'BIGINT',
+    'Int32': 'INTEGER',
+    'Int16': 'SMALLINT',
+    'Int8': 'TINYINT',
+    'float64': 'DOUBLE',
+    'float32': 'FLOAT',
+    'boolean': 'BOOLEAN',
+    'string': 'VARCHAR',
+}
+
+
+def duckdb_types(dtype_mapping=None, date_columns=None):
+    """DuckDB type per column of a dtype mapping, date columns as TIMESTAMP"""
+    types = {column: DUCKDB_TYPES[str(dtype)] for column, dtype in (dtype_mapping or {}).items()}
+    types.update({column: 'TIMESTAMP' for column in (date_columns or [])})
+    return types
+
+# --- Data quality rules ---
+# (reason_code, SQL condition that FAILS the row), evaluated together in one pass at ingest.
+# Rows failing any rule are moved to <table>_quarantine with their reason codes.
+SECONDS_PER_DAY = 86400
+TEMPERATURE_RANGE = (-50, 150)
+PRESSURE_RANGE = (0, 200)
+
+def _level_dur_sum(family):
+    levels = [f'optimal_{family}_dur'] + [f'level_{n}_{side}_{family}_dur' for side in ('high', 'low') for n in (1, 2, 3)]
+    return ' + '.join(f'COALESCE({col}, 0)' for col in levels)
+
+quality_rules_device = [
+    ('MISSING_KEY', "id IS NULL OR vehicle_id IS NULL OR report_start_at IS NULL"),
+    ('NEGATIVE_DURATION', "transmitting_dur < 0 OR not_transmitting_dur < 0"),
+    ('DAY_OVERFLOW', f"transmitting_dur + not_transmitting_dur > {SECONDS_PER_DAY}"),
+]
+
+quality_rules_sensor = [
+    ('MISSING_KEY', "id IS NULL OR sensor_id IS NULL OR vehicle_id IS NULL OR report_start_at IS NULL"),
+    ('NEGATIVE_DURATION', "transmitting_dur < 0 OR not_transmitting_dur < 0"),
+    ('DAY_OVERFLOW', f"transmitting_dur + not_transmitting_dur > {SECONDS_PER_DAY}"),
+    *[(f'LEVEL_DUR_OVERFLOW_{family.upper()}', f"{_level_dur_sum(family)} > {SECONDS_PER_DAY}")
+      for family in ('temperature', 'cold_pressure', 'hot_pressure')],
+    ('TEMPERATURE_OUT_OF_RANGE', f"temperature_avg NOT BETWEEN {TEMPERATURE_RANGE[0]} AND {TEMPERATURE_RANGE[1]}"),
+    ('PRESSURE_OUT_OF_RANGE', f"cold_pressure_avg NOT BETWEEN {PRESSURE_RANGE[0]} AND {PRESSURE_RANGE[1]} "
+                              f"OR hot_pressure_avg NOT BETWEEN {PRESSURE_RANGE[0]} AND {PRESSURE_RANGE[1]}"),
+    *[(f'STATS_ORDER_{family.upper()}', f"{family}_min > {family}_avg OR {family}_avg > {family}_max")
+      for family in ('temperature', 'cold_pressure', 'hot_pressure')],
+]
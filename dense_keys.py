@@ -0,0 +1,148 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Raw id column -> dense surrogate key column added at ingest
+KEY_COLUMNS = {
+    'vehicle_id': 'vehicle_key',
+    'device_id': 'device_key',
+    'sensor_id': 'sensor_key',
+}
+# Key of NULL ids (e.g. vehicles without a hub); real ids get 1..n
+NULL_KEY = 0
+# Folder of the persisted dictionaries, next to the table roots of a partitioned store
+DICTIONARY_FOLDER = '_keys'
+
+
+def dictionary_table(column):
+    return f"key_dictionary_{column}"
+
+
+def _create_dictionary(analyzer, table):
+    analyzer.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (raw_id BIGINT PRIMARY KEY, key UINTEGER NOT NULL)")
+
+
+def _table_columns(analyzer, name):
+    return analyzer.conn.execute(f"SELECT * FROM {name} LIMIT 0").fetchdf().columns.tolist()
+
+
+def id_columns(analyzer, name):
+    """Raw id columns of a relation that get a dense key"""
+    return [column for column in _table_columns(analyzer, name) if column in KEY_COLUMNS]
+
+
+def key_columns(analyzer, name):
+    """Dense key columns already present on a relation"""
+    return [column for column in _table_columns(analyzer, name) if column in KEY_COLUMNS.values()]
+
+
+def without_keys(analyzer, name):
+    """Relation name without its dense key columns, as persisted (keys are derived again on load)"""
+    keys = key_columns(analyzer, name)
+    return f"(SELECT * EXCLUDE ({', '.join(keys)}) FROM {name})" if keys else name
+
+
+def extend_dictionaries(analyzer, name, columns):
+    """
+    Add the ids of a relation that are not mapped yet to the dictionaries.
+    Dictionaries are shared by every table (device_id and vehicle_id appear in both)
+    and only ever grow, so keys stay stable across later loads of the same session/database.
+    """
+    for column in columns:
+        table = dictionary_table(column)
+        _create_dictionary(analyzer, table)
+        analyzer.conn.execute(f"""--sql
+INSERT INTO {table}
+SELECT
+    raw_id,
+    (SELECT COALESCE(MAX(key), {NULL_KEY}) FROM {table}) + ROW_NUMBER() OVER (ORDER BY raw_id) AS key
+FROM (
+    SELECT DISTINCT {column} AS raw_id FROM {name} WHERE {column} IS NOT NULL
+    EXCEPT
+    SELECT raw_id FROM {table}
+)
+        """)
+
+
+def dense_key_select(source, columns):
+    """SELECT over source adding one non-null UINTEGER key per id column"""
+    keys = ',\n    '.join(f"COALESCE(d{i}.key, {NULL_KEY})::UINTEGER AS {KEY_COLUMNS[column]}"
+                          for i, column in enumerate(columns))
+    joins = '\n'.join(f"LEFT JOIN {dictionary_table(column)} d{i} ON t.{column} = d{i}.raw_id"
+                      for i, column in enumerate(columns))
+    return f"""--sql
+SELECT
+    t.*,
+    {keys}
+FROM {source} t
+{joins}
+    """
+
+
+def with_dense_keys(analyzer, source):
+    """
+    SELECT over source (a relation, table function or parenthesized query) adding a dense,
+    non-null UINTEGER key per id column (vehicle_key, device_key, sensor_key): cheaper to
+    hash and sort than the sparse nullable ids, and usable as array indexes in the NumPy paths.
+    The dictionaries are extended with the new ids of source first. Meant for the CTAS that
+    materializes a table anyway (quality gate, load, checkpoint restore): no extra copy.
+    """
+    columns = id_columns(analyzer, source)
+    extend_dictionaries(analyzer, source, columns)
+    return dense_key_select(source, columns)
+
+
+def add_dense_keys(analyzer, name, source):
+    """
+    Register name as a view over source adding the dense keys by joining the dictionaries
+    on every scan. Only for partitioned stores written before the keys were persisted in them.
+    """
+    select = with_dense_keys(analyzer, source)
+    analyzer._drop_relation(name)
+    analyzer.conn.execute(f"CREATE VIEW {name} AS {select}")
+    logger.warning(f"'{name}': store without dense keys, they are joined at query time until it is rewritten")
+
+
+def store_dictionary_folder(root):
+    """Dictionaries of a store, shared by all its table roots so a key means the same id in each"""
+    return os.path.join(os.path.dirname(os.path.normpath(root)), DICTIONARY_FOLDER)
+
+
+def save_dictionaries(analyzer, folder):
+    """Persist the session's dictionaries next to the keys written with them (swapped in atomically)"""
+    os.makedirs(folder, exist_ok=True)
+    for column in KEY_COLUMNS:
+        table = dictionary_table(column)
+        if not analyzer.conn.execute(
+                "SELECT 1 FROM duckdb_tables() WHERE table_name = ? AND NOT temporary", [table]).fetchone():
+            continue
+        path = os.path.join(folder, f"{table}.parquet")
+        analyzer.conn.execute(f"COPY (SELECT * FROM {table} ORDER BY key) TO '{path}.tmp' (FORMAT PARQUET)")
+        os.replace(f"{path}.tmp", path)
+
+
+def load_dictionaries(analyzer, folder):
+    """
+    Merge persisted dictionaries into the session, before any key is derived from them.
+    An id or key the session already maps differently is an error: keys would not match the store.
+    """
+    for column in KEY_COLUMNS:
+        table = dictionary_table(column)
+        path = os.path.join(folder, f"{table}.parquet")
+        if not os.path.exists(path):
+            continue
+        _create_dictionary(analyzer, table)
+        conflicts = analyzer.conn.execute(f"""--sql
+SELECT COUNT(*)
+FROM read_parquet('{path}') f
+JOIN {table} d ON f.raw_id = d.raw_id OR f.key = d.key
+WHERE f.raw_id IS DISTINCT FROM d.raw_id OR f.key IS DISTINCT FROM d.key
+        """).fetchone()[0]
+        if conflicts:
+            raise ValueError(f"Dictionary '{path}' conflicts with the keys of this session ({conflicts} ids)")
+        analyzer.conn.execute(f"""--sql
+INSERT INTO {table}
+SELECT raw_id, key FROM read_parquet('{path}')
+WHERE raw_id NOT IN (SELECT raw_id FROM {table})
+        """)
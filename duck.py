@@ -1,6 +1,19 @@
+import glob
+import os
+import shutil
+
 import duckdb
 import pandas as pd
 from logging_decorator import log_function
+from checkpoints import file_signature, fingerprint
+from data_types import duckdb_types
+from data_quality import apply_quality_gate
+from dense_keys import (add_dense_keys, key_columns, load_dictionaries, save_dictionaries, store_dictionary_folder,
+                        with_dense_keys, without_keys)
+import approximate
+from roster import update_roster
+from partitions import (PARTITION_COLUMNS, QUALITY_FILE, QUARANTINE_FILE, VEHICLE_BUCKET_COLUMN, month_key,
+                        partition_dir, partition_files, read_store_manifest, write_store_manifest)
 
 # Load the data into a pandas DataFrame and return it
 @log_function
@@ -22,20 +35,335 @@ def load_data(file_header, file_data, dtype_mapping=None, date_columns=None):
     )
     return dataframe
 
+# Files picked up when a directory is given as data path (plain, gzip or zstd CSV)
+DATA_FILE_PATTERNS = ['*.csv', '*.csv.gz', '*.csv.zst']
+
+
+def resolve_data_files(path_data):
+    """Data files behind a path, glob pattern, directory or list of them, sorted"""
+    paths = path_data if isinstance(path_data, (list, tuple)) else [path_data]
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in DATA_FILE_PATTERNS:
+                files.extend(glob.glob(os.path.join(path, '**', pattern), recursive=True))
+        elif any(char in path for char in '*?['):
+            files.extend(glob.glob(path, recursive=True))
+        else:
+            files.append(path)
+    files = sorted(set(files))
+    if not files:
+        raise FileNotFoundError(f"No data files found for {path_data}")
+    return files
+
+
+def _check_headers(conn, file_header, files):
+    """Every file's header must have the columns of the _desc.csv file, in order"""
+    columns = pd.read_csv(file_header, sep='|')['column_name'].tolist()
+    for f in files:
+        header = conn.execute("SELECT * FROM read_csv($file, header=false, all_varchar=true) LIMIT 1",
+                              {'file': f}).fetchone()
+        header = [str(value).strip() for value in header or []]
+        if len(header) != len(columns):
+            raise ValueError(f"{f}: {len(header)} columns, {file_header} describes {len(columns)}")
+        if header != columns:
+            raise ValueError(f"{f}: header {header} does not match {file_header}")
+    return columns
+
+
+@log_function
+def load_data_files(conn, name, file_header, files, dtype_mapping=None, date_columns=None):
+    """
+    Load many CSV files (plain or gzip/zstd compressed) into table name with DuckDB's
+    reader: files are read and decompressed in parallel, without intermediate copies.
+    Headers are checked against the _desc.csv file and each row keeps its file in source_file.
+    The paths are bound as a parameter, never pasted into the SQL.
+    """
+    columns = _check_headers(conn, file_header, files)
+    types = {column: dtype for column, dtype in duckdb_types(dtype_mapping, date_columns).items() if column in columns}
+    type_spec = ', '.join(f"'{column}': '{dtype}'" for column, dtype in types.items())
+    type_option = f"types={{{type_spec}}}, " if types else ""
+    conn.execute(f"""--sql
+CREATE TABLE {name} AS
+SELECT * EXCLUDE (filename), filename AS source_file
+FROM read_csv($files, header=true, delim=',', names=[{', '.join(f"'{c}'" for c in columns)}],
+              {type_option}filename=true)
+    """, {'files': list(files)})
+
+
+def ingest_fingerprint(name, path_header, files, dtype_mapping=None, date_columns=None, quality_rules=None):
+    """Fingerprint of a table loaded from CSV: its files (path, size, mtime), types and quality rules"""
+    return fingerprint(f"ingest_{name}", file_signature(path_header, *files), dtype_mapping, date_columns,
+                       quality_rules)
+
+
 class DuckDBAnalyzer:
-    def __init__(self):
-        self.conn = duckdb.connect(':memory:')
+    def __init__(self, database=':memory:', threads=None, memory_limit=None,
+                 temp_directory=None, preserve_insertion_order=None):
+        """
+        Open the DuckDB connection with optional execution limits.
+        - database: ':memory:' or a file path for an on-disk database
+        - threads: worker threads for this connection (default: all cores)
+        - memory_limit: e.g. '4GB', operators spill to temp_directory above it
+        - temp_directory: where spilled intermediates are written
+        - preserve_insertion_order: False lets large scans/windows stream without keeping row order
+        """
+        settings = {
+            'threads': threads,
+            'memory_limit': memory_limit,
+            'temp_directory': temp_directory,
+            'preserve_insertion_order': preserve_insertion_order,
+        }
+        config = {key: value for key, value in settings.items() if value is not None}
+        if temp_directory:
+            os.makedirs(temp_directory, exist_ok=True)
+
+        self.conn = duckdb.connect(database, config=config)
+        # Fingerprint of the inputs behind every registered table, for stage checkpoints
+        self.fingerprints = {}
     
     @log_function
-    def register_dataframe(self, name, path_header, path_data, dtype_mapping=None, date_columns=None):
-        """Register DataFrame as a view/table without copying"""
-        df = load_data(path_header, path_data, dtype_mapping, date_columns)
-        self.conn.register(name, df)
-        print(f"Registered DataFrame '{name}'")
+    def register_dataframe(self, name, path_header, path_data, dtype_mapping=None, date_columns=None,
+                           quality_rules=None, checkpoints=None):
+        """
+        Register DataFrame as a view/table without copying.
+        path_data may also be a glob, a directory or a list of (optionally gzip/zstd
+        compressed) files, loaded in parallel by DuckDB. Either way every row keeps its
+        file in a source_file column.
+        With quality_rules (see data_types.py) the rows are validated at ingest:
+        failing rows go to <name>_quarantine and the quality metrics are returned.
+        With a CheckpointStore the validated tables are restored from parquet
+        instead of parsing the CSV again, as long as the files and rules are unchanged.
+        Dense *_key columns are added for every id column (see dense_keys.py), in the copy
+        that materializes the table, and the sensor/hub roster is updated (see roster.py).
+        """
+        files = resolve_data_files(path_data)
+        stage = f"ingest_{name}"
+        self.fingerprints[name] = ingest_fingerprint(name, path_header, files, dtype_mapping, date_columns,
+                                                     quality_rules)
+        tables = [name, f"{name}_quarantine"] if quality_rules else [name]
+
+        if checkpoints and checkpoints.is_valid(stage, self.fingerprints[name]):
+            for table in tables:
+                self._drop_relation(table)
+                parquet = f"read_parquet('{checkpoints.path(stage, table)}')"
+                # The checkpoint keeps the raw ids, the keys are derived in the restoring copy
+                select = with_dense_keys(self, parquet) if table == name else f"SELECT * FROM {parquet}"
+                self.conn.execute(f"CREATE TABLE {table} AS {select}")
+            print(f"Restored '{name}' from checkpoint")
+            update_roster(self, name)
+            if quality_rules:
+                return self.conn.execute(f"SELECT * FROM read_parquet('{checkpoints.path(stage, 'quality')}')").fetchdf()
+            return None
+
+        # Loaded rows, read once more by the quality gate or the dense key view over them
+        raw = f"{name}__raw"
+        self._drop_relation(name)
+        self._drop_relation(raw)
+        if files == [path_data] and path_data.endswith('.csv'):
+            df = load_data(path_header, path_data, dtype_mapping, date_columns)
+            # Same schema as the DuckDB loader below
+            df['source_file'] = path_data
+            self.conn.register(raw, df)
+            print(f"Registered DataFrame '{name}'")
+        else:
+            load_data_files(self.conn, raw, path_header, files, dtype_mapping, date_columns)
+            print(f"Loaded {len(files)} files into '{name}'")
+
+        metrics = None
+        if quality_rules:
+            metrics = apply_quality_gate(self, name, quality_rules, source=path_data, relation=raw)
+        else:
+            self.replace_relation(name, with_dense_keys(self, raw))
+        self._drop_relation(raw)
+        if checkpoints:
+            frames = {table: table for table in tables}
+            frames[name] = without_keys(self, name)
+            if quality_rules:
+                frames['quality'] = metrics
+            checkpoints.save(stage, self.fingerprints[name], frames, conn=self.conn)
+        update_roster(self, name)
+        return metrics
+
+    def _drop_relation(self, name):
+        """Remove whatever currently answers to name: registered DataFrame, view or table"""
+        self.conn.unregister(name)
+        kind = self.conn.execute(f"""
+SELECT 'VIEW' FROM duckdb_views() WHERE view_name = '{name}' AND NOT internal AND NOT temporary
+UNION ALL
+SELECT 'TABLE' FROM duckdb_tables() WHERE table_name = '{name}' AND NOT temporary
+        """).fetchone()
+        if kind:
+            self.conn.execute(f"DROP {kind[0]} {name}")
+
+    def replace_relation(self, name, select_sql):
+        """Materialize select_sql as table name, replacing the previous relation of that name"""
+        self.conn.execute(f"CREATE OR REPLACE TABLE {name}__new AS {select_sql}")
+        self._drop_relation(name)
+        self.conn.execute(f"ALTER TABLE {name}__new RENAME TO {name}")
     
+    @log_function
+    def export_partitioned(self, name, root, date_column='report_start_at', vehicle_buckets=None, append=False,
+                           source_fingerprint=None):
+        """
+        Persist a registered table as Hive-partitioned Parquet by year/month of date_column.
+        With vehicle_buckets every month is split again by vehicle_id % vehicle_buckets.
+        Only months that are new or whose rows changed (row hash in the store manifest) are
+        rewritten, so compacted or archived months of unchanged history are left alone.
+        Months absent from the table are kept: the store holds the history, a load may not.
+        The dense keys are written with the rows, their dictionaries next to the table roots
+        (see dense_keys.store_dictionary_folder), so reading the store needs no join.
+        source_fingerprint records the inputs the store was written from (see register_stored).
+        append=True adds files to existing partitions (compact them later with compact_partition).
+        """
+        layout = int(vehicle_buckets or 0)
+        manifest = read_store_manifest(root) or {'layout': layout, 'months': {}}
+        if manifest['layout'] != layout:
+            raise ValueError(f"Store '{root}' has vehicle_buckets={manifest['layout'] or None}, "
+                             f"cannot write vehicle_buckets={vehicle_buckets} into it")
+
+        partition_by = list(PARTITION_COLUMNS)
+        bucket_expr = ""
+        if vehicle_buckets:
+            partition_by.append(VEHICLE_BUCKET_COLUMN)
+            bucket_expr = f", (vehicle_id % {layout}) AS {VEHICLE_BUCKET_COLUMN}"
+
+        source = name
+        month_hashes = {
+            month_key(year, month): f"{rows}:{row_hash}"
+            for year, month, rows, row_hash in self.conn.execute(f"""--sql
+SELECT YEAR(t.{date_column}), MONTH(t.{date_column}), COUNT(*), SUM(hash(t))
+FROM {source} t
+WHERE t.{date_column} IS NOT NULL
+GROUP BY ALL
+            """).fetchall()
+        }
+
+        if append:
+            # Appended rows are not in the manifest hashes: the next full export rewrites those months
+            changed = list(month_hashes)
+            month_hashes = dict.fromkeys(month_hashes)
+            manifest['source_fingerprint'] = None
+        else:
+            changed = [key for key, value in month_hashes.items() if manifest['months'].get(key) != value]
+            manifest['source_fingerprint'] = source_fingerprint
+            for key in changed:
+                shutil.rmtree(partition_dir(root, *map(int, key.split('-'))), ignore_errors=True)
+
+        os.makedirs(root, exist_ok=True)
+        if changed:
+            month_list = ', '.join(f"'{key}'" for key in changed)
+            self.conn.execute(f"""--sql
+COPY (
+    SELECT *, YEAR({date_column}) AS year, MONTH({date_column}) AS month{bucket_expr}
+    FROM {source}
+    WHERE strftime({date_column}, '%Y-%m') IN ({month_list})
+) TO '{root}' (FORMAT PARQUET, PARTITION_BY ({', '.join(partition_by)}), {"APPEND" if append else "OVERWRITE_OR_IGNORE"})
+            """)
+        manifest['months'].update(month_hashes)
+        manifest['dense_keys'] = bool(key_columns(self, name))
+        save_dictionaries(self, store_dictionary_folder(root))
+        write_store_manifest(root, manifest)
+        print(f"Exported '{name}' to partitioned store '{root}': {len(changed)} of {len(month_hashes)} months written")
+
+    @log_function
+    def register_stored(self, name, root, path_header, path_data, dtype_mapping=None, date_columns=None,
+                        quality_rules=None, checkpoints=None, start_date=None, end_date=None, vehicle_buckets=None):
+        """
+        Register name from its partitioned store, pruned to [start_date, end_date].
+        The CSV is only parsed when the store was written from other files (size/mtime),
+        types or rules; its changed months are then rewritten (see export_partitioned).
+        A current store is registered as is, with its quarantine table and quality metrics.
+        Returns the quality metrics, like register_dataframe.
+        """
+        source = ingest_fingerprint(name, path_header, resolve_data_files(path_data), dtype_mapping, date_columns,
+                                    quality_rules)
+        # Keys derived by a new ingest must extend the ones already written in the store
+        load_dictionaries(self, store_dictionary_folder(root))
+        manifest = read_store_manifest(root)
+        quarantine, quality = os.path.join(root, QUARANTINE_FILE), os.path.join(root, QUALITY_FILE)
+        metrics = None
+        if (manifest and manifest.get('source_fingerprint') == source and
+                manifest['layout'] == int(vehicle_buckets or 0) and manifest.get('dense_keys')):
+            print(f"Store '{root}' is up to date, '{name}' not ingested again")
+            if quality_rules:
+                self._drop_relation(f"{name}_quarantine")
+                self.conn.execute(f"CREATE TABLE {name}_quarantine AS SELECT * FROM read_parquet('{quarantine}')")
+                metrics = self.query(f"SELECT * FROM read_parquet('{quality}')")
+        else:
+            metrics = self.register_dataframe(name, path_header, path_data, dtype_mapping, date_columns,
+                                              quality_rules, checkpoints)
+            os.makedirs(root, exist_ok=True)
+            if quality_rules:
+                self.conn.execute(f"COPY {name}_quarantine TO '{quarantine}' (FORMAT PARQUET)")
+                self.conn.register('store_quality', metrics)
+                self.conn.execute(f"COPY store_quality TO '{quality}' (FORMAT PARQUET)")
+                self.conn.unregister('store_quality')
+            self.export_partitioned(name, root, vehicle_buckets=vehicle_buckets, source_fingerprint=source)
+        self.register_partitioned(name, root, start_date, end_date)
+        return metrics
+
+    @log_function
+    def register_partitioned(self, name, root, start_date=None, end_date=None, vehicle_bucket=None,
+                             allow_empty=False):
+        """
+        Register a view over a partitioned store, reading only the month partitions
+        that overlap [start_date, end_date] (partition pruning), and only one
+        vehicle bucket when vehicle_bucket is given.
+        With allow_empty an empty selection gives an empty view with the store's schema.
+        The dense *_key columns are read from the files (see export_partitioned).
+        The roster is updated from every month of the store (of the vehicle bucket), not the
+        pruned view: a day's installed baseline must not depend on the range requested.
+        """
+        files = partition_files(root, start_date, end_date, vehicle_bucket)
+        where = ""
+        if not files and allow_empty:
+            files, where = partition_files(root)[:1], "WHERE false"
+        if not files:
+            raise FileNotFoundError(f"No partitions found in '{root}' for {start_date} to {end_date}")
+
+        file_list = ', '.join(f"'{f}'" for f in files)
+        self.fingerprints[name] = fingerprint(f"partitioned_{name}", file_signature(*files), where)
+        load_dictionaries(self, store_dictionary_folder(root))
+        self._drop_relation(name)
+        self._drop_relation(f"{name}__files")
+        self.conn.execute(f"""--sql
+CREATE VIEW {name} AS
+SELECT * EXCLUDE ({', '.join(PARTITION_COLUMNS)})
+FROM read_parquet([{file_list}], hive_partitioning=true, union_by_name=true)
+{where}
+        """)
+        if not key_columns(self, name):
+            self.conn.execute(f"ALTER VIEW {name} RENAME TO {name}__files")
+            add_dense_keys(self, name, source=f"{name}__files")
+        history = partition_files(root, vehicle_bucket=vehicle_bucket)
+        if history:
+            history_list = ', '.join(f"'{f}'" for f in history)
+            update_roster(self, name, source=f"read_parquet([{history_list}], union_by_name=true)",
+                          source_fingerprint=fingerprint(f"roster_{name}", file_signature(*history)))
+        print(f"Registered partitioned view '{name}' over {len(files)} files")
+
     @log_function
     def query(self, sql):
         return self.conn.execute(sql).fetchdf()
+
+    # Approximate mode for exploration (see approximate.py); reports keep using the exact query()
+    def build_sample(self, name, fraction=approximate.SAMPLE_FRACTION, min_rows=approximate.SAMPLE_MIN_ROWS,
+                     force=False):
+        """Persistent stratified (vehicle, month) sample of a table, rebuilt only when its inputs change"""
+        return approximate.build_sample(self, name, fraction, min_rows, force)
+
+    def estimate(self, name, expr='1', aggregate='sum', where=None, group_by=None):
+        """SUM/COUNT/AVG estimated from the sample, with standard error and confidence interval"""
+        return approximate.estimate(self, name, expr, aggregate, where, group_by)
+
+    def approx_distinct(self, name, column, where=None, group_by=None):
+        """Distinct count from a HyperLogLog sketch"""
+        return approximate.approx_distinct(self, name, column, where, group_by)
+
+    def approx_quantiles(self, name, column, quantiles=(0.5, 0.9, 0.99), where=None, group_by=None):
+        """Quantiles from a T-Digest sketch"""
+        return approximate.approx_quantiles(self, name, column, quantiles, where, group_by)
     
     def close(self):
         self.conn.close()
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# None writes every report output as a single CSV. 'month' or 'day' splits the dated
+# outputs into <output>/<name>_<period>.csv and only rewrites the periods that changed.
+EXPORT_PARTITION = None
+PARTITION_FORMATS = {'month': '%Y-%m', 'day': '%Y-%m-%d'}
+MANIFEST_FILE = 'manifest.json'
+UNDATED_PARTITION = 'undated'
+
+
+def content_hash(df):
+    """Hash of a frame's columns and rows, independent of the row order"""
+    rows = np.sort(pd.util.hash_pandas_object(df, index=False).to_numpy())
+    digest = hashlib.sha256('|'.join(map(str, df.columns)).encode())
+    digest.update(rows.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _partition_folder(path):
+    return os.path.splitext(path)[0]
+
+
+def _read_manifest(folder):
+    path = os.path.join(folder, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_atomic(path, write):
+    """Write through a temp file swapped in with os.replace, readers never see a partial file"""
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def export_partitioned_csv(df, path, date_column='report_date', partition='month'):
+    """
+    Write df as one CSV per period of date_column under <path without .csv>/, next to a
+    manifest holding each partition's file, row count and content hash. Partitions whose
+    rows are unchanged are not rewritten. df is taken as the recomputed range, its first
+    to its last period: partitions inside it that df no longer has are removed (as are the
+    undated rows when df has none), periods outside it are left as they are, so a daily
+    refresh only touches the periods it recomputed. The manifest is swapped in after the
+    partition files, so it only ever lists complete files.
+    Returns the number of partitions written.
+    """
+    folder = _partition_folder(path)
+    name = os.path.basename(folder)
+    os.makedirs(folder, exist_ok=True)
+
+    manifest = _read_manifest(folder)
+    if manifest is None or manifest['partition'] != partition:
+        for entry in (manifest or {}).get('partitions', {}).values():
+            stale = os.path.join(folder, entry['file'])
+            if os.path.exists(stale):
+                os.remove(stale)
+        manifest = {'partition': partition, 'columns': list(df.columns), 'partitions': {}}
+
+    keys = pd.to_datetime(df[date_column]).dt.strftime(PARTITION_FORMATS[partition]).fillna(UNDATED_PARTITION)
+    present = set(keys.unique())
+    dated = sorted(present - {UNDATED_PARTITION})
+    removed = [key for key in manifest['partitions'] if key not in present and
+               (key == UNDATED_PARTITION or (dated and dated[0] <= key <= dated[-1]))]
+    for key in removed:
+        stale = os.path.join(folder, manifest['partitions'].pop(key)['file'])
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    written = 0
+    for key, part in df.groupby(keys.to_numpy(), sort=True):
+        part_hash = content_hash(part)
+        entry = manifest['partitions'].get(key)
+        file_name = f"{name}_{key}.csv"
+        if entry and entry['hash'] == part_hash and os.path.exists(os.path.join(folder, file_name)):
+            continue
+        _write_atomic(os.path.join(folder, file_name), lambda tmp: part.to_csv(tmp, index=False))
+        manifest['partitions'][key] = {'file': file_name, 'rows': len(part), 'hash': part_hash}
+        written += 1
+
+    if written or removed or manifest['columns'] != list(df.columns):
+        manifest['columns'] = list(df.columns)
+        manifest['partitions'] = dict(sorted(manifest['partitions'].items()))
+        def dump_manifest(tmp):
+            with open(tmp, 'w') as f:
+                json.dump(manifest, f, indent=2)
+        _write_atomic(os.path.join(folder, MANIFEST_FILE), dump_manifest)
+
+    logger.info(f"Export '{name}': {written} of {len(present)} partitions rewritten, {len(removed)} removed")
+    return written
+
+
+def write_output(df, path, date_column='report_date', partition=None):
+    """
+    Write a report output: a single CSV, or date partitions rewritten only when their
+    content changed (partition or EXPORT_PARTITION set and df has date_column).
+    The output of the other mode is removed, so an output only ever exists in one form.
+    """
+    partition = partition or EXPORT_PARTITION
+    folder = _partition_folder(path)
+    if partition and date_column in df.columns:
+        if os.path.exists(path):
+            os.remove(path)
+        export_partitioned_csv(df, path, date_column, partition)
+    else:
+        if _read_manifest(folder) is not None:
+            shutil.rmtree(folder)
+        df.to_csv(path, index=False)
+
+
+def output_files(path):
+    """
+    Files currently holding an output, in the form write_output last wrote it: the
+    manifest and its partitions, or the single CSV
+    """
+    folder = _partition_folder(path)
+    manifest = _read_manifest(folder)
+    if manifest is not None and not os.path.exists(path):
+        return [os.path.join(folder, MANIFEST_FILE)] + [os.path.join(folder, entry['file'])
+                                                        for entry in manifest['partitions'].values()]
+    return [path]
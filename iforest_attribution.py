@@ -0,0 +1,100 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy import sparse
+
+from logging_decorator import log_function
+from shared_data import SharedData, attach
+
+logger = logging.getLogger(__name__)
+
+EULER_GAMMA = 0.5772156649015329
+TOP_K = 3
+CHUNK_ROWS = 200_000
+
+
+def average_path_length(n):
+    """
+    c(n): average path length of an unsuccessful BST search among n points, the
+    expected remaining depth of a point in an isolation tree node holding n samples.
+    """
+    n = np.asarray(n, dtype='float64')
+    c = np.zeros_like(n)
+    c[n == 2] = 1.0
+    big = n > 2
+    c[big] = 2.0 * (np.log(n[big] - 1.0) + EULER_GAMMA) - 2.0 * (n[big] - 1.0) / n[big]
+    return c
+
+
+def _tree_gains(tree, features, n_features):
+    """
+    Sparse (nodes x features) matrix of one tree: entering a child of a split on feature f
+    credits f with c(n_parent) - 1 - c(n_child), how much shorter than expected the path
+    became by taking that edge (negative when it is longer). Summed along a path this
+    telescopes to c(n_root) - h(x): the features' share of the isolation depth saved.
+    features maps the tree's own column indexes to the forest's (estimators_features_).
+    """
+    t = tree.tree_
+    parents = np.flatnonzero(t.children_left >= 0)
+    expected = average_path_length(t.n_node_samples)
+    children = np.concatenate([t.children_left[parents], t.children_right[parents]])
+    parents = np.concatenate([parents, parents])
+    gains = expected[parents] - 1.0 - expected[children]
+    return sparse.csr_matrix((gains, (children, features[t.feature[parents]])),
+                             shape=(t.node_count, n_features))
+
+
+def path_contributions(iso_forest, X):
+    """
+    Per row and feature, the mean over the trees of the isolation depth saved by splits on
+    that feature. Rows add up to c(max_samples) - E[h(x)]: the larger the sum, the shorter
+    the paths and the lower (more anomalous) the forest's score. Every tree is traversed
+    for the whole batch at once (decision_path) and credited with one sparse product.
+    """
+    X = np.asarray(X, dtype='float32')  # the forest splits on float32 values
+    contributions = np.zeros(X.shape, dtype='float64')
+    for tree, features in zip(iso_forest.estimators_, iso_forest.estimators_features_):
+        path = tree.decision_path(X[:, features])
+        contributions += (path @ _tree_gains(tree, features, X.shape[1])).toarray()
+    return contributions / len(iso_forest.estimators_)
+
+
+def _contributions_chunk(iso_forest, X, start, stop):
+    """path_contributions of rows start:stop of X (an array or a SharedData handle)"""
+    return path_contributions(iso_forest, attach(X)[start:stop])
+
+
+def top_features(contributions, feature_names, k=TOP_K):
+    """Names and contributions of the k largest contributors of every row as columns"""
+    k = min(k, contributions.shape[1])
+    order = np.argsort(-contributions, axis=1, kind='stable')[:, :k]
+    names = np.asarray(feature_names)[order]
+    values = np.take_along_axis(contributions, order, axis=1)
+    columns = {}
+    for i in range(k):
+        columns[f'ml_top_feature_{i + 1}'] = names[:, i]
+        columns[f'ml_top_contribution_{i + 1}'] = values[:, i]
+    return pd.DataFrame(columns)
+
+
+@log_function
+def explain_anomalies(iso_forest, X, feature_names, k=TOP_K, chunk_rows=CHUNK_ROWS, n_jobs=-1):
+    """
+    Top-k feature attribution of the rows of X (already scaled like the training data),
+    in chunks on n_jobs workers attached to one shared copy of X when there are several.
+    Returns one row per row of X.
+    """
+    X = np.asarray(X, dtype='float32')
+    bounds = [(start, min(start + chunk_rows, len(X))) for start in range(0, len(X), chunk_rows)]
+    if len(bounds) > 1:
+        with SharedData() as shared:
+            X_shared = shared.publish('attribution_features', X)
+            parts = Parallel(n_jobs=n_jobs)(delayed(_contributions_chunk)(iso_forest, X_shared, start, stop)
+                                            for start, stop in bounds)
+    else:
+        parts = [_contributions_chunk(iso_forest, X, start, stop) for start, stop in bounds]
+    contributions = np.concatenate(parts) if parts else np.empty((0, len(feature_names)))
+    logger.info(f"Attributed {len(contributions)} rows over {len(iso_forest.estimators_)} trees")
+    return top_features(contributions, feature_names, k)
@@ -0,0 +1,137 @@
+import logging
+import os
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from logging_decorator import log_function
+
+logger = logging.getLogger(__name__)
+
+# Score column -> True when lower values are riskier (Isolation Forest scores)
+SCORES = {'risk_score': False, 'ml_anomaly_score': True}
+FLEET_GROUP = 'fleet'
+# Candidates kept per score, day and group: the largest k a query can ask for
+DEFAULT_CAPACITY = 200
+LEADERBOARD_PATH = 'output/risk_leaderboard.parquet'
+COLUMNS = ['score_name', 'report_date', 'vehicle_group', 'asset_type', 'asset_id', 'vehicle_id', 'score']
+
+
+class RiskLeaderboard:
+    """
+    Partial index of the riskiest assets: for every score, day and vehicle group only
+    the top `capacity` rows are kept. Adding a scored day only ranks that day's rows;
+    a top-k query over a day or a rolling window merges the small per-day lists
+    instead of sorting the full report. Each asset keeps only its worst row per day
+    and group (duplicate reports of an asset-day take a single slot), so an asset
+    among the k worst of a window is always among the k worst of its worst day:
+    the merged answer is exact for any k <= capacity.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, vehicle_groups=None):
+        """vehicle_groups: optional {vehicle_id: group} mapping, indexed next to the fleet-wide lists"""
+        self.capacity = capacity
+        self.vehicle_groups = vehicle_groups
+        self.index = pd.DataFrame(columns=COLUMNS)
+
+    def __len__(self):
+        return len(self.index)
+
+    def _candidates(self, df, score_name, asset_type, asset_column):
+        """Top `capacity` assets of every (day, group) of one scored frame, at their worst score"""
+        rows = pd.DataFrame({
+            'score_name': score_name,
+            'report_date': pd.to_datetime(df['report_date']).to_numpy(),
+            'asset_type': asset_type,
+            'asset_id': df[asset_column].to_numpy(dtype='float64', na_value=np.nan),
+            'vehicle_id': df['vehicle_id'].to_numpy(dtype='float64', na_value=np.nan),
+            'score': df[score_name].to_numpy(dtype='float64', na_value=np.nan),
+        }).dropna(subset=['asset_id', 'score']).astype({'asset_id': 'int64', 'vehicle_id': 'Int64'})
+
+        grouped = [rows.assign(vehicle_group=FLEET_GROUP)]
+        if self.vehicle_groups is not None:
+            groups = rows['vehicle_id'].map(self.vehicle_groups)
+            grouped.append(rows.assign(vehicle_group=groups.astype('string')).dropna(subset=['vehicle_group']))
+        rows = pd.concat(grouped, ignore_index=True)
+
+        rows = rows.sort_values(['report_date', 'vehicle_group', 'score'], ascending=[True, True, SCORES[score_name]],
+                                kind='stable')
+        rows = rows.drop_duplicates(['report_date', 'vehicle_group', 'asset_id'], keep='first')
+        rank = rows.groupby(['report_date', 'vehicle_group'], sort=False).cumcount()
+        return rows[rank.to_numpy() < self.capacity][COLUMNS]
+
+    def update(self, df, asset_type, asset_column, score_names=None):
+        """
+        Index the scored rows of df (report_date, vehicle_id, asset_column and score columns).
+        Days already indexed for the same score and asset type are replaced, so re-scoring a day is safe.
+        """
+        score_names = [name for name in (score_names or SCORES) if name in df.columns]
+        for score_name in score_names:
+            candidates = self._candidates(df, score_name, asset_type, asset_column)
+            days = pd.to_datetime(df['report_date']).unique()
+            stale = ((self.index['score_name'] == score_name) & (self.index['asset_type'] == asset_type)
+                     & self.index['report_date'].isin(days))
+            self.index = pd.concat([self.index[~stale], candidates], ignore_index=True) if len(self.index) else candidates
+        logger.info(f"Leaderboard updated with {len(df)} {asset_type} rows ({len(self)} candidates kept)")
+        return self
+
+    def top_k(self, k=50, score_name='risk_score', end_date=None, window_days=1, vehicle_group=FLEET_GROUP,
+              asset_type=None):
+        """
+        The k riskiest assets over the window_days days ending at end_date (default: last indexed day),
+        each asset ranked by its worst score of the window.
+        """
+        if k > self.capacity:
+            raise ValueError(f"k={k} is larger than the leaderboard capacity ({self.capacity})")
+        rows = self.index[(self.index['score_name'] == score_name) & (self.index['vehicle_group'] == vehicle_group)]
+        if asset_type:
+            rows = rows[rows['asset_type'] == asset_type]
+        if rows.empty:
+            return rows.reset_index(drop=True)
+
+        end = pd.Timestamp(end_date) if end_date is not None else rows['report_date'].max()
+        start = end - pd.Timedelta(days=window_days - 1)
+        rows = rows[(rows['report_date'] >= start) & (rows['report_date'] <= end)]
+
+        ascending = SCORES[score_name]
+        rows = rows.sort_values('score', ascending=ascending, kind='stable')
+        rows = rows.drop_duplicates(['asset_type', 'asset_id'], keep='first').head(k)
+        return rows.reset_index(drop=True)
+
+    def save(self, path=LEADERBOARD_PATH):
+        """Persist the index as parquet (written to a temp file and swapped in)"""
+        tmp_path = f"{path}.tmp"
+        conn = duckdb.connect()
+        conn.register('leaderboard', self.index.assign(capacity=self.capacity))
+        conn.execute(f"COPY leaderboard TO '{tmp_path}' (FORMAT PARQUET)")
+        conn.close()
+        os.replace(tmp_path, path)
+        logger.info(f"Leaderboard saved to {path} ({len(self)} candidates)")
+
+    @classmethod
+    def load(cls, path=LEADERBOARD_PATH, vehicle_groups=None):
+        conn = duckdb.connect()
+        index = conn.execute(f"SELECT * FROM read_parquet('{path}')").df()
+        conn.close()
+        capacity = int(index['capacity'].iloc[0]) if len(index) else DEFAULT_CAPACITY
+        board = cls(capacity, vehicle_groups)
+        board.index = index[COLUMNS]
+        return board
+
+
+@log_function
+def update_leaderboard(sensor_df=None, device_df=None, path=LEADERBOARD_PATH, capacity=DEFAULT_CAPACITY,
+                       vehicle_groups=None):
+    """
+    Load (or start) the persisted leaderboard, index newly scored sensor and hub
+    rows (report outputs holding risk_score and/or ml_anomaly_score) and save it.
+    """
+    board = (RiskLeaderboard.load(path, vehicle_groups) if os.path.exists(path)
+             else RiskLeaderboard(capacity, vehicle_groups))
+    if sensor_df is not None:
+        board.update(sensor_df, 'sensor', 'sensor_id')
+    if device_df is not None:
+        board.update(device_df, 'hub', 'device_id')
+    board.save(path)
+    return board
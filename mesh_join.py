@@ -0,0 +1,107 @@
+import logging
+
+import pandas as pd
+
+from exporter import write_output
+from logging_decorator import log_function
+
+logger = logging.getLogger(__name__)
+
+# A sensor day without a hub report is matched to the vehicle's last hub day at most this many days before
+ASOF_TOLERANCE_DAYS = 1
+# Trailing calendar days of the sensor/hub transmission correlation
+CORRELATION_WINDOW_DAYS = 14
+
+
+def _daily_sides_query(start_date, end_date, tolerance_days):
+    """
+    Both sides reduced to one row per vehicle-day before joining, so the join is 1:1
+    instead of every sensor row times every hub row of the vehicle.
+    The hub side starts tolerance_days earlier for the as-of match of the first days.
+    """
+    hub_start = (pd.Timestamp(start_date) - pd.Timedelta(days=tolerance_days)).date()
+    return f"""--sql
+CREATE OR REPLACE TEMP TABLE mesh_sensor_days AS
+SELECT
+    vehicle_key,
+    ANY_VALUE(vehicle_id) AS vehicle_id,
+    report_start_at::DATE AS report_date,
+    COUNT(DISTINCT sensor_id) AS reporting_sensors,
+    COUNT(DISTINCT sensor_id) FILTER (WHERE transmitting_dur > 0) AS transmitting_sensors,
+    AVG(transmitting_dur) AS sensor_transmitting_avg,
+    MIN(transmitting_dur) AS sensor_transmitting_min
+FROM time_in_level_sensor
+WHERE report_start_at BETWEEN '{start_date}' AND '{end_date}'
+GROUP BY vehicle_key, report_date;
+
+CREATE OR REPLACE TEMP TABLE mesh_hub_days AS
+SELECT
+    vehicle_key,
+    report_start_at::DATE AS report_date,
+    COUNT(device_id) AS hub_count,
+    SUM(transmitting_dur) FILTER (WHERE device_id IS NOT NULL) AS hub_transmitting_dur,
+    MAX(transmitting_dur / NULLIF(transmitting_dur + not_transmitting_dur, 0))
+        FILTER (WHERE device_id IS NOT NULL) AS best_hub_efficiency
+FROM time_in_level_device
+WHERE report_start_at BETWEEN '{hub_start}' AND '{end_date}'
+GROUP BY vehicle_key, report_date;
+    """
+
+
+@log_function
+def align_sensors_to_hubs(analyzer, start_date, end_date, tolerance_days=ASOF_TOLERANCE_DAYS,
+                          window_days=CORRELATION_WINDOW_DAYS):
+    """
+    Mesh reporting view: every vehicle-day with sensor reports, aligned to the vehicle's hubs.
+    - equi-join on (vehicle, day) when the hubs reported that day, otherwise an as-of match
+      to the last hub day within tolerance_days (hub_lag_days says how far back it went)
+    - sensors_without_hub: sensors transmitting while no hub was transmitting (mesh reporting)
+    - transmission_corr: rolling correlation of sensor vs hub transmitting time over
+      window_days, near 0 when they are decoupled
+    Output has one row per vehicle-day with sensor data: linear in the input rows.
+    """
+    analyzer.query(_daily_sides_query(start_date, end_date, tolerance_days))
+    df = analyzer.query(f"""--sql
+WITH aligned AS (
+    SELECT
+        s.*,
+        s.report_date - h.report_date AS hub_lag_days,
+        h.hub_count,
+        h.hub_transmitting_dur,
+        h.best_hub_efficiency
+    FROM mesh_sensor_days s
+    ASOF LEFT JOIN mesh_hub_days h
+        ON s.vehicle_key = h.vehicle_key AND s.report_date >= h.report_date
+),
+matched AS (
+    SELECT
+        * REPLACE (
+            CASE WHEN hub_lag_days <= {tolerance_days} THEN hub_lag_days END AS hub_lag_days,
+            CASE WHEN hub_lag_days <= {tolerance_days} THEN hub_count ELSE 0 END AS hub_count,
+            CASE WHEN hub_lag_days <= {tolerance_days} THEN hub_transmitting_dur END AS hub_transmitting_dur,
+            CASE WHEN hub_lag_days <= {tolerance_days} THEN best_hub_efficiency END AS best_hub_efficiency
+        )
+    FROM aligned
+)
+SELECT
+    * EXCLUDE (vehicle_key),
+    transmitting_sensors > 0 AND COALESCE(hub_transmitting_dur, 0) = 0 AS sensors_without_hub,
+    sensor_transmitting_avg / NULLIF(hub_transmitting_dur, 0) AS sensor_hub_transmission_ratio,
+    CORR(sensor_transmitting_avg, hub_transmitting_dur) OVER (
+        PARTITION BY vehicle_key ORDER BY report_date
+        RANGE BETWEEN INTERVAL {window_days - 1} DAYS PRECEDING AND CURRENT ROW
+    ) AS transmission_corr
+FROM matched
+ORDER BY vehicle_id, report_date;
+    """)
+    analyzer.query("DROP TABLE mesh_sensor_days; DROP TABLE mesh_hub_days;")
+
+    logger.info(f"Aligned {len(df)} vehicle-days, {int(df['sensors_without_hub'].sum())} with sensors but no hub")
+    return df
+
+
+def generate_mesh_report(analyzer, start_date, end_date, output_path='output/mesh_vehicle_daily.csv'):
+    """Export the sensor/hub alignment per vehicle-day for the mesh reporting analysis."""
+    df = align_sensors_to_hubs(analyzer, start_date, end_date)
+    write_output(df, output_path)
+    return df
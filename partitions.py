@@ -0,0 +1,115 @@
+import glob
+import json
+import logging
+import os
+import shutil
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Hive layout: <root>/year=YYYY/month=M[/vehicle_bucket=B]/<file>.parquet
+PARTITION_COLUMNS = ['year', 'month']
+VEHICLE_BUCKET_COLUMN = 'vehicle_bucket'
+# Store manifest next to the partitions: ingest fingerprint, layout and a row hash per month
+STORE_MANIFEST = '_store.json'
+# Quarantined rows and quality metrics of the last ingest, restored when the store is reused
+QUARANTINE_FILE = '_quarantine.parquet'
+QUALITY_FILE = '_quality.parquet'
+
+
+def month_partitions(start_date, end_date):
+    """Return the (year, month) pairs that overlap the [start_date, end_date] range"""
+    months = pd.period_range(pd.Timestamp(start_date).to_period('M'),
+                             pd.Timestamp(end_date).to_period('M'), freq='M')
+    return [(p.year, p.month) for p in months]
+
+
+def partition_dir(root, year, month):
+    return os.path.join(root, f"year={year}", f"month={month}")
+
+
+def month_key(year, month):
+    return f"{year}-{month:02d}"
+
+
+def read_store_manifest(root):
+    """Manifest of a store written by DuckDBAnalyzer.export_partitioned, None when there is none"""
+    path = os.path.join(root, STORE_MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_store_manifest(root, manifest):
+    """Swap the manifest in after the partition files, so it only describes complete months"""
+    path = os.path.join(root, STORE_MANIFEST)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+
+def list_partitions(root):
+    """List the (year, month) pairs that exist on disk, oldest first"""
+    found = []
+    for path in glob.glob(os.path.join(root, 'year=*', 'month=*')):
+        month_dir = os.path.basename(path)
+        year_dir = os.path.basename(os.path.dirname(path))
+        found.append((int(year_dir.split('=')[1]), int(month_dir.split('=')[1])))
+    return sorted(found)
+
+
+def partition_files(root, start_date=None, end_date=None, vehicle_bucket=None):
+    """
+    Partition pruning: resolve the parquet files needed for a date range by
+    walking only the month directories that overlap it.
+    Without a range every partition is returned; vehicle_bucket narrows to one bucket.
+    """
+    if start_date is None or end_date is None:
+        months = list_partitions(root)
+    else:
+        months = month_partitions(start_date, end_date)
+
+    leaf = '**' if vehicle_bucket is None else f"{VEHICLE_BUCKET_COLUMN}={vehicle_bucket}"
+    files = []
+    for year, month in months:
+        files.extend(sorted(glob.glob(os.path.join(partition_dir(root, year, month), leaf, '*.parquet'),
+                                      recursive=True)))
+    return files
+
+
+def compact_partition(conn, root, year, month):
+    """
+    Rewrite every leaf directory of a month partition as a single parquet file.
+    Appended loads leave one file per run, this merges them back.
+    """
+    leaf_dirs = {os.path.dirname(f) for f in partition_files(root, f"{year}-{month:02d}-01", f"{year}-{month:02d}-01")}
+    for leaf in sorted(leaf_dirs):
+        files = sorted(glob.glob(os.path.join(leaf, '*.parquet')))
+        if len(files) <= 1:
+            continue
+        tmp_path = os.path.join(leaf, 'compacted.parquet.tmp')
+        file_list = ', '.join(f"'{f}'" for f in files)
+        conn.execute(f"COPY (SELECT * FROM read_parquet([{file_list}], hive_partitioning=false)) "
+                     f"TO '{tmp_path}' (FORMAT PARQUET)")
+        for f in files:
+            os.remove(f)
+        os.replace(tmp_path, os.path.join(leaf, 'data_0.parquet'))
+        logger.info(f"Compacted {len(files)} files in {leaf}")
+
+
+def archive_partitions(root, before_date, archive_root):
+    """Move every month partition older than before_date's month under archive_root"""
+    cutoff = pd.Timestamp(before_date).to_period('M')
+    moved = []
+    for year, month in list_partitions(root):
+        if pd.Period(year=year, month=month, freq='M') >= cutoff:
+            continue
+        target = partition_dir(archive_root, year, month)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.move(partition_dir(root, year, month), target)
+        moved.append((year, month))
+
+    logger.info(f"Archived {len(moved)} partitions older than {cutoff} to {archive_root}")
+    return moved
@@ -0,0 +1,60 @@
+# wheel_position 1..n numbered axle by axle: positions 1-2 are the first axle, 3-4 the second, ...
+WHEELS_PER_AXLE = 2
+# Short name -> sensor metric compared against the other wheels of the vehicle
+PEER_METRICS = {'temp': 'temperature_avg', 'cold': 'cold_pressure_avg'}
+
+
+def peer_feature_columns():
+    """Peer columns added by peer_features_query"""
+    return [f"{short}_{suffix}" for short in PEER_METRICS
+            for suffix in ('vs_vehicle_median', 'vs_axle_median', 'peer_z')]
+
+
+def peer_features_query(source):
+    """
+    SELECT over source (daily sensor rows with vehicle_key, report_date and wheel_position)
+    adding, for every PEER_METRICS metric, the deviation from the median of the vehicle's
+    wheels that day and of its axle, and a leave-one-out z-score against the other wheels.
+    A weather or load change moves every wheel of the vehicle, a failing wheel moves alone:
+    only the latter gives large peer deviations.
+    The windows only partition by vehicle-day (no ORDER BY): one grouped pass, no second scan.
+    peer_z is NULL with fewer than 3 reporting wheels or identical peers.
+    """
+    sums = ',\n            '.join(
+        f"MEDIAN({column}) OVER vehicle_day AS {short}_vehicle_median,\n            "
+        f"MEDIAN({column}) OVER axle_day AS {short}_axle_median,\n            "
+        f"COUNT({column}) OVER vehicle_day AS {short}_peer_n,\n            "
+        f"SUM({column}) OVER vehicle_day AS {short}_peer_sum,\n            "
+        f"SUM({column} * {column}) OVER vehicle_day AS {short}_peer_sumsq"
+        for short, column in PEER_METRICS.items())
+    # Mean and sample variance of the other wheels: the vehicle-day sums minus the row itself
+    deviations = ',\n    '.join(
+        f"{column} - {short}_vehicle_median AS {short}_vs_vehicle_median,\n    "
+        f"{column} - {short}_axle_median AS {short}_vs_axle_median,\n    "
+        f"CASE WHEN {short}_peer_n >= 3 THEN ({column} - {short}_others_mean) / NULLIF(SQRT(GREATEST(\n"
+        f"        ({short}_peer_sumsq - {column} * {column} - ({short}_peer_n - 1) * {short}_others_mean * {short}_others_mean)\n"
+        f"        / ({short}_peer_n - 2), 0)), 0) END AS {short}_peer_z"
+        for short, column in PEER_METRICS.items())
+    helpers = ', '.join(f"{short}_{suffix}" for short in PEER_METRICS
+                        for suffix in ('vehicle_median', 'axle_median', 'peer_n', 'peer_sum', 'peer_sumsq', 'others_mean'))
+    others_mean = ',\n        '.join(
+        f"({short}_peer_sum - {column}) / NULLIF({short}_peer_n - 1, 0) AS {short}_others_mean"
+        for short, column in PEER_METRICS.items())
+    return f"""--sql
+SELECT
+    * EXCLUDE ({helpers}),
+    {deviations}
+FROM (
+    SELECT
+        *,
+        {others_mean}
+    FROM (
+        SELECT
+            *,
+            {sums}
+        FROM (SELECT *, (wheel_position - 1) // {WHEELS_PER_AXLE} AS axle FROM {source})
+        WINDOW vehicle_day AS (PARTITION BY vehicle_key, report_date),
+               axle_day AS (PARTITION BY vehicle_key, report_date, axle)
+    )
+)
+    """
@@ -0,0 +1,150 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def _as_float(series):
+    """Nullable/extension column -> contiguous float64 array with NaN for NULL"""
+    return series.to_numpy(dtype='float64', na_value=np.nan)
+
+
+def _window_bounds(group_start, group_codes, day, window_days, window_mode):
+    """
+    First row and one past the last row of each row's trailing window.
+    - rows: the last window_days rows of its sensor, up to the row itself
+    - range: the rows of its sensor dated within the last window_days days, found by
+      binary search on a (sensor, day) key, so gaps cost nothing extra. As a SQL RANGE
+      frame, the window ends after the row's last same-day peer (duplicate reports).
+    """
+    idx = np.arange(len(group_start))
+    if window_mode == 'rows':
+        return np.maximum(group_start, idx - (window_days - 1)), idx + 1
+
+    stride = (np.nanmax(day) if len(day) else 0) + window_days + 1
+    key = group_codes * stride + day
+    return (np.searchsorted(key, key - (window_days - 1), side='left'),
+            np.searchsorted(key, key, side='right'))
+
+
+def _rolling_sum(values, bounds):
+    """Sum of values[start:end] for every row's (start, end) window, from one cumulative sum"""
+    starts, ends = bounds
+    csum = np.concatenate(([0.0], np.cumsum(values)))
+    return csum[ends] - csum[starts]
+
+
+def _rolling_std(values, bounds, group_codes):
+    """
+    Sample standard deviation over each row's window, ignoring NaN (as STDDEV_SAMP).
+    Values are centred on their sensor mean first to keep the sum of squares stable.
+    """
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.0)
+    group_n = np.bincount(group_codes, weights=valid)
+    group_mean = np.bincount(group_codes, weights=filled) / np.maximum(group_n, 1)
+    centred = np.where(valid, values - group_mean[group_codes], 0.0)
+
+    n = _rolling_sum(valid.astype('float64'), bounds)
+    s1 = _rolling_sum(centred, bounds)
+    s2 = _rolling_sum(centred * centred, bounds)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (s2 - s1 * s1 / n) / (n - 1)
+    std = np.sqrt(np.clip(var, 0.0, None))
+    std[n < 2] = np.nan
+    return std
+
+
+def _rolling_slope(x, y, bounds):
+    """
+    Least-squares slope of y on x over each window, from rolling sums.
+    Matches the SQL engine: NULL y counts in n and sum_x but adds nothing to the y sums.
+    """
+    y0 = np.nan_to_num(y, nan=0.0)
+    n = _rolling_sum(np.ones_like(x), bounds)
+    sum_x = _rolling_sum(x, bounds)
+    sum_xx = _rolling_sum(x * x, bounds)
+    sum_y = _rolling_sum(y0, bounds)
+    sum_xy = _rolling_sum(x * y0, bounds)
+
+    denom = n * sum_xx - sum_x * sum_x
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n * sum_xy - sum_x * sum_y) / denom
+    slope[denom == 0] = 0.0
+    return slope
+
+
+def compute_sensor_features(df, window_days, window_mode='range'):
+    """
+    NumPy feature engine: the same rolling slopes, deltas and std as the SQL
+    engine's window functions, computed in one pass over contiguous arrays.
+    df must hold the daily sensor rows sorted by (sensor_key, report_date, id): the id
+    orders several reports of one sensor-day the same way as the SQL engine does.
+    window_mode is 'range' (calendar days) or 'rows' (reports), as in the SQL engine.
+    """
+    # Dense non-null keys (dense_keys.py): no NULL handling, cheap to compare
+    sensor = df['sensor_key'].to_numpy(dtype='int64')
+    if len(sensor) and (np.diff(sensor) < 0).any():
+        raise ValueError("compute_sensor_features expects rows sorted by sensor_key, report_date, id")
+
+    # Group boundaries from the sort order, one code per sensor
+    new_group = np.ones(len(sensor), dtype=bool)
+    new_group[1:] = sensor[1:] != sensor[:-1]
+    group_codes = np.cumsum(new_group) - 1
+    group_start = np.flatnonzero(new_group)[group_codes]
+
+    day = _as_float(df['day_num'])
+    temp = _as_float(df['temperature_avg'])
+    cold = _as_float(df['cold_pressure_avg'])
+    hot = _as_float(df['hot_pressure_avg'])
+
+    bounds = _window_bounds(group_start, group_codes, day, window_days, window_mode)
+
+    df['cold_pressure_slope'] = _rolling_slope(day, cold, bounds)
+    df['temperature_slope'] = _rolling_slope(day, temp, bounds)
+    df['std_temp'] = _rolling_std(temp, bounds, group_codes)
+    df['std_cold'] = _rolling_std(cold, bounds, group_codes)
+
+    # Day-over-day changes, only when the previous row is the previous calendar day
+    consecutive = np.zeros(len(day), dtype=bool)
+    consecutive[1:] = ~new_group[1:] & (day[1:] - day[:-1] == 1)
+    for name, values in [('delta_cold', cold), ('delta_temp', temp), ('delta_hot', hot)]:
+        delta = np.full(len(values), np.nan)
+        delta[1:] = values[1:] - values[:-1]
+        delta[~consecutive] = np.nan
+        df[name] = delta
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = df['delta_temp'].to_numpy() / df['delta_hot'].to_numpy()
+    ratio[~(df['delta_hot'].to_numpy() != 0)] = np.nan
+    df['thermal_pressure_ratio'] = ratio
+
+    return df
+
+
+def cross_check_engines(analyzer, start_date, end_date, columns=None, window_mode=None):
+    """
+    Run both feature engines on the same range and report, per feature column,
+    the largest absolute difference plus the wall time of each engine.
+    """
+    from proactive.query_functions_ds import _extract_sensor_features
+
+    columns = columns or ['cold_pressure_slope', 'temperature_slope', 'std_temp', 'std_cold',
+                          'delta_cold', 'delta_temp', 'delta_hot', 'thermal_pressure_ratio']
+    results, timings = {}, {}
+    for engine in ['sql', 'numpy']:
+        start = time.time()
+        results[engine] = _extract_sensor_features(analyzer, start_date, end_date,
+                                                   engine=engine, window_mode=window_mode)
+        timings[engine] = time.time() - start
+
+    sql_df = results['sql'].sort_values('id').reset_index(drop=True)
+    np_df = results['numpy'].sort_values('id').reset_index(drop=True)
+    diffs = {col: float(np.nanmax(np.abs(_as_float(sql_df[col]) - _as_float(np_df[col])), initial=0.0))
+             for col in columns}
+
+    logger.info(f"Feature engines: sql {timings['sql']:.3f}s, numpy {timings['numpy']:.3f}s")
+    return pd.Series(diffs, name='max_abs_diff'), timings
@@ -1,12 +1,23 @@
+import glob
 import logging
+import os
 import pandas as pd
 import numpy as np
 from duckdb import df
+from checkpoints import fingerprint, run_stage, table_fingerprint
+from dense_keys import NULL_KEY
+from exporter import output_files, write_output
+from peer_features import WHEELS_PER_AXLE, peer_features_query
+from proactive.feature_engine import compute_sensor_features
+from proactive.star_schema import export_star_schema
 
 logger = logging.getLogger(__name__)
 
 # -------------------- Configuration Parameters --------------------
 SLOPE_WINDOW_DAYS = 7
+FEATURE_ENGINE = 'sql'                 # 'sql' (DuckDB windows) or 'numpy' (single sorted pass)
+WINDOW_MODE = 'range'                  # 'range': last N calendar days, 'rows': last N reports
+OUTPUT_MODE = 'flat'                   # 'flat': one wide CSV per view, 'star': dimensions + narrow facts
 OVERINFLATION_THRESHOLD = 0.3          # fraction of transmitting time
 SLOW_LEAK_SLOPE_THRESHOLD = -0.5       # psi per day
 TEMP_SLOPE_THRESHOLD = 0.5             # °C per day
@@ -15,6 +26,9 @@ PUNCTURE_LEVEL3_DUR_THRESHOLD = 0.1    # fraction of transmitting time
 THERMAL_RATIO_THRESHOLD = 2.0
 FROZEN_STD_THRESHOLD = 0.001           # effectively zero variation
 HUB_EFFICIENCY_THRESHOLD = 0.3         # 50% connectivity
+PEER_Z_THRESHOLD = 1.0                 # slow leak / thermal stress must also stand out from the other wheels
+# Ingest quality codes (data_types.py) of physically impossible readings: quarantined, reported as Hardware Fail
+HARDWARE_FAIL_REASONS = ['TEMPERATURE_OUT_OF_RANGE', 'PRESSURE_OUT_OF_RANGE']
 # ------------------------------------------------------------------
 
 def generate_mechanical_failure_report(analyzer, start_date, end_date,
@@ -23,6 +37,10 @@ def generate_mechanical_failure_report(analyzer, start_date, end_date,
                                        output_sensor_variables_path='output/sensor_variables.csv',
                                        output_sensor_statistics_path='output/sensor_statistics.csv',
                                        output_device_statistics_path='output/device_statistics.csv',
+                                       output_vehicle_hub_path='output/vehicle_hub_anomalies.csv',
+                                       output_mode=None,
+                                       output_star_folder='output/star/',
+                                       checkpoints=None,
                                        ):
     """
     Generates a daily report classifying sensor and hub issues into five buckets:
@@ -32,6 +50,11 @@ def generate_mechanical_failure_report(analyzer, start_date, end_date,
     - Hardware Fail (sensor/hub malfunction)
     - Thermal Stress
     Also includes 'Normal' for assets without issues.
+    Hubs are additionally rolled up per vehicle-day (best hub, total uptime,
+    redundancy), adding 'Reduced Redundancy' when one of two hubs is down.
+    With output_mode='star' the outputs are written as a star schema for Tableau.
+    With a CheckpointStore the features, classification and export stages are
+    checkpointed, a rerun resumes from the first stage whose inputs changed.
 
     Returns a DataFrame with columns:
         report_date, asset_id, asset_type ('sensor' or 'device'),
@@ -39,55 +62,148 @@ def generate_mechanical_failure_report(analyzer, start_date, end_date,
     """
     logger.info(f"Starting mechanical failure analysis ({start_date} to {end_date})...")
 
-    # Step 1: Extract sensor-level features
-    sensor_anomalies_df = _extract_sensor_features(analyzer, start_date, end_date)
+    output_mode = output_mode or OUTPUT_MODE
+    export_paths = [output_sensor_path, output_device_path, output_sensor_variables_path,
+                    output_sensor_statistics_path, output_device_statistics_path, output_vehicle_hub_path]
+
+    classification_fingerprint = None
+    if checkpoints:
+        classification_fingerprint = fingerprint('mechanical_classification',
+                                                 _features_fingerprint(analyzer, start_date, end_date),
+                                                 sensor_thresholds(), hub_thresholds())
+
+    def build():
+        frames = _build_mechanical_failure_frames(analyzer, start_date, end_date, checkpoints)
+        return dict(zip(['sensor', 'device', 'vehicle_hub'], frames))
+
+    def export():
+        classified = run_stage(checkpoints, 'mechanical_classification', classification_fingerprint, build)
+        sensor_output_df, device_output_df = _export_mechanical_failure_report(
+            classified['sensor'], classified['device'], classified['vehicle_hub'],
+            output_sensor_path=output_sensor_path,
+            output_device_path=output_device_path,
+            output_sensor_variables_path=output_sensor_variables_path,
+            output_sensor_statistics_path=output_sensor_statistics_path,
+            output_device_statistics_path=output_device_statistics_path,
+            output_vehicle_hub_path=output_vehicle_hub_path,
+            output_mode=output_mode,
+            output_star_folder=output_star_folder,
+        )
+        return {'sensor': sensor_output_df, 'device': device_output_df}
+
+    def written_files():
+        if output_mode == 'star':
+            return sorted(glob.glob(os.path.join(output_star_folder, '*.csv')))
+        return [f for path in export_paths for f in output_files(path)]
+
+    export_fingerprint = fingerprint('mechanical_export', classification_fingerprint, output_mode,
+                                     export_paths, output_star_folder)
+    exported = run_stage(checkpoints, 'mechanical_export', export_fingerprint, export, outputs=written_files)
+    return exported['sensor'], exported['device']
+
+
+def _features_fingerprint(analyzer, start_date, end_date):
+    """Checkpoint fingerprint of the feature stage: input tables, range and feature settings"""
+    return table_fingerprint(analyzer, 'mechanical_features', ['time_in_level_sensor', 'time_in_level_device'],
+                             str(start_date), str(end_date), FEATURE_ENGINE, WINDOW_MODE, SLOPE_WINDOW_DAYS, WHEELS_PER_AXLE,
+                             HARDWARE_FAIL_REASONS)
 
-    # Step 2: Extract device-level features
-    device_anomalies_df = _extract_device_features(analyzer, start_date, end_date)
 
-    # Step 3: Classify sensor issues
-    sensor_anomalies_df = _classify_sensor_issues(sensor_anomalies_df)
+def _build_mechanical_failure_frames(analyzer, start_date, end_date, checkpoints=None):
+    """
+    Feature extraction and classification. Every step stays within one vehicle,
+    so the frames of disjoint vehicle slices can simply be concatenated.
+    """
+    def extract():
+        # Step 1: Extract sensor-level features
+        sensor_features_df = _extract_sensor_features(analyzer, start_date, end_date)
+        # Step 2: Extract device-level features (per hub and per vehicle-day)
+        device_features_df, vehicle_hub_features_df = _extract_device_features(analyzer, start_date, end_date)
+        return {'sensor': sensor_features_df, 'device': device_features_df, 'vehicle_hub': vehicle_hub_features_df,
+                'sensor_quarantine': _extract_quarantined_sensor_rows(analyzer, start_date, end_date)}
+
+    features_fingerprint = _features_fingerprint(analyzer, start_date, end_date) if checkpoints else None
+    features = run_stage(checkpoints, 'mechanical_features', features_fingerprint, extract)
+
+    # Step 3: Classify sensor issues, plus the impossible readings held back at ingest
+    sensor_anomalies_df = _add_quarantined_failures(_classify_sensor_issues(features['sensor']),
+                                                    features['sensor_quarantine'])
 
     # Step 4: Classify device issues
-    device_anomalies_df = _classify_device_issues(device_anomalies_df)
+    device_anomalies_df = _classify_device_issues(features['device'])
+    vehicle_hub_df = _classify_vehicle_hub_issues(features['vehicle_hub'])
+
+    return sensor_anomalies_df, device_anomalies_df, vehicle_hub_df
+
+
+def _export_mechanical_failure_report(sensor_anomalies_df, device_anomalies_df, vehicle_hub_df,
+                                      output_sensor_path='output/sensor_anomalies.csv',
+                                      output_device_path='output/hub_anomalies.csv',
+                                      output_sensor_variables_path='output/sensor_variables.csv',
+                                      output_sensor_statistics_path='output/sensor_statistics.csv',
+                                      output_device_statistics_path='output/device_statistics.csv',
+                                      output_vehicle_hub_path='output/vehicle_hub_anomalies.csv',
+                                      output_mode=None,
+                                      output_star_folder='output/star/',
+                                      ):
+    """
+    Combine and format the classified frames into the Tableau outputs.
+    output_mode 'star' writes dimension and fact tables to output_star_folder
+    instead of the flat files (see proactive/star_schema.py). Defaults to OUTPUT_MODE.
+    """
+    output_mode = output_mode or OUTPUT_MODE
+    if output_mode == 'star':
+        export_star_schema(sensor_anomalies_df, device_anomalies_df, vehicle_hub_df, output_star_folder)
+        return (sensor_anomalies_df[['id', 'report_date', 'vehicle_id', 'sensor_id', 'wheel_position', 'wheel_id',
+                                     'issue_category', 'risk_score']],
+                device_anomalies_df[['id', 'report_date', 'vehicle_id', 'device_id',
+                                     'issue_category', 'risk_score']])
+    if output_mode != 'flat':
+        raise ValueError(f"Unknown output mode '{output_mode}', expected 'flat' or 'star'")
 
-    # Step 5: Combine and format output
     output_sensor_anomalies_df = sensor_anomalies_df[['id', 'report_date', 'vehicle_id', 'sensor_id', 'wheel_position', 'wheel_id',
                            'issue_category', 'risk_score']]
-    output_sensor_anomalies_df.to_csv(output_sensor_path, index=False)
+    write_output(output_sensor_anomalies_df, output_sensor_path)
 
     logger.info(f"Report saved to {output_sensor_path}. Total rows: {len(output_sensor_anomalies_df)}")
 
     output_device_anomalies_df = device_anomalies_df[['id', 'report_date', 'vehicle_id', 'device_id',
                                  'issue_category', 'risk_score']]
-    output_device_anomalies_df.to_csv(output_device_path, index=False)
+    write_output(output_device_anomalies_df, output_device_path)
     logger.info(f"Report saved to {output_device_path}. Total rows: {len(output_device_anomalies_df)}")
 
+    output_vehicle_hub_df = vehicle_hub_df[['report_date', 'vehicle_id', 'hub_count', 'healthy_hubs', 'best_hub_id',
+                                            'best_hub_efficiency', 'total_uptime', 'active_sensors',
+                                            'issue_category', 'risk_score']]
+    write_output(output_vehicle_hub_df, output_vehicle_hub_path)
+    logger.info(f"Report saved to {output_vehicle_hub_path}. Total rows: {len(output_vehicle_hub_df)}")
+
     output_sensor_variables_df = sensor_anomalies_df[['id', 'report_date', 'temperature_avg', 'cold_pressure_avg', 'hot_pressure_avg']]
-    output_sensor_variables_df.to_csv(output_sensor_variables_path, index=False)
+    write_output(output_sensor_variables_df, output_sensor_variables_path)
     logger.info(f"Report saved to {output_sensor_variables_path}. Total rows: {len(output_sensor_variables_df)}")
 
     output_sensor_statistics_df = sensor_anomalies_df[['id', 'report_date', 'transmitting_dur']]
-    output_sensor_statistics_df.to_csv(output_sensor_statistics_path, index=False)
+    write_output(output_sensor_statistics_df, output_sensor_statistics_path)
     logger.info(f"Report saved to {output_sensor_statistics_path}. Total rows: {len(output_sensor_statistics_df)}")
 
     output_device_statistics_df = device_anomalies_df[['id', 'report_date', 'transmitting_dur', 'not_transmitting_dur', 'connectivity_efficiency', 'active_sensors']]
-    output_device_statistics_df.to_csv(output_device_statistics_path, index=False)
-    logger.info(f"Report saved to {output_device_statistics_path}. Total rows: {len(output_device_statistics_df)}")a
+    write_output(output_device_statistics_df, output_device_statistics_path)
+    logger.info(f"Report saved to {output_device_statistics_path}. Total rows: {len(output_device_statistics_df)}")
 
     return output_sensor_anomalies_df, output_device_anomalies_df
 
 
-def _extract_sensor_features(analyzer, start_date, end_date):
-    """Query sensor table and compute rolling slopes, deltas, and indices."""
-    query = f"""--sql
-    WITH daily AS (
+def _sensor_daily_query(start_date, end_date):
+    """Row-level sensor columns shared by every feature engine (no window functions)."""
+    return f"""--sql
         SELECT
             id,
             wheel_position,
             wheel_id,
             sensor_id,
             vehicle_id,
+            sensor_key,
+            vehicle_key,
             report_start_at::DATE AS report_date,
             temperature_avg,
             cold_pressure_avg,
@@ -100,10 +216,59 @@ def _extract_sensor_features(analyzer, start_date, end_date):
             level_3_low_cold_pressure_dur,
             level_3_low_cold_pressure_cnt,
             -- global day number for slope calculations
-            report_start_at::DATE - (SELECT MIN(report_start_at::DATE) FROM time_in_level_sensor) AS day_num
+            report_start_at::DATE - (SELECT MIN(report_start_at::DATE) FROM time_in_level_sensor) AS day_num,
+            -- over‑inflation index
+            (level_1_high_cold_pressure_dur + level_2_high_hot_pressure_dur) /
+                NULLIF(transmitting_dur, 0) AS over_inflation_index,
+            -- high temperature duration ratio
+            (level_2_high_temperature_dur + level_3_high_temperature_dur) /
+                NULLIF(transmitting_dur, 0) AS high_temp_dur_ratio
         FROM time_in_level_sensor
         WHERE report_start_at BETWEEN '{start_date}' AND '{end_date}'
-    ),
+    """
+
+
+def _extract_sensor_features(analyzer, start_date, end_date, engine=None, window_mode=None):
+    """
+    Query sensor table and compute rolling slopes, deltas, and indices.
+    engine: 'sql' (DuckDB window functions) or 'numpy' (single sorted pass,
+    see proactive/feature_engine.py). Defaults to FEATURE_ENGINE.
+    window_mode: 'range' keeps only rows from the last SLOPE_WINDOW_DAYS calendar days,
+    'rows' the last SLOPE_WINDOW_DAYS reports however far apart. Defaults to WINDOW_MODE.
+    """
+    engine = engine or FEATURE_ENGINE
+    window_mode = window_mode or WINDOW_MODE
+    if window_mode not in ('range', 'rows'):
+        raise ValueError(f"Unknown window mode '{window_mode}', expected 'range' or 'rows'")
+
+    if engine == 'numpy':
+        daily = f"({_sensor_daily_query(start_date, end_date)})"
+        df = analyzer.query(f"{peer_features_query(daily)} ORDER BY sensor_key, report_date, id;")
+        df = compute_sensor_features(df, SLOPE_WINDOW_DAYS, window_mode)
+    elif engine == 'sql':
+        df = _extract_sensor_features_sql(analyzer, start_date, end_date, window_mode)
+    else:
+        raise ValueError(f"Unknown feature engine '{engine}', expected 'sql' or 'numpy'")
+
+    # Fill NaNs introduced by lag/division. std_temp/std_cold stay NULL when the window holds
+    # fewer than 2 readings (first day, or the first day after a gap): no spread is known,
+    # which is not the zero spread of a frozen sensor.
+    df.fillna({'delta_cold': 0, 'delta_temp': 0, 'delta_hot': 0,
+               'thermal_pressure_ratio': 0, 'over_inflation_index': 0,
+               'high_temp_dur_ratio': 0}, inplace=True)
+    logger.info(f"Sensor features extracted ({engine} engine): {len(df)} rows")
+    return df
+
+
+def _extract_sensor_features_sql(analyzer, start_date, end_date, window_mode):
+    """Rolling features as DuckDB window functions over the daily rows."""
+    # RANGE over day_num bounds the frame by calendar days, so gaps shrink it instead of stretching it.
+    # ROWS frames and LAG order several reports of one sensor-day by id, so both engines agree on them.
+    frame = 'RANGE' if window_mode == 'range' else 'ROWS'
+    order = 'day_num' if window_mode == 'range' else 'day_num, id'
+    query = f"""--sql
+    WITH daily AS ({_sensor_daily_query(start_date, end_date)}),
+    peers AS ({peer_features_query('daily')}),
     rolling AS (
         SELECT
             *,
@@ -118,13 +283,14 @@ def _extract_sensor_features(analyzer, start_date, end_date):
             STDDEV_SAMP(temperature_avg) OVER w AS std_temp,
             STDDEV_SAMP(cold_pressure_avg) OVER w AS std_cold,
             -- lagged values for day‑over‑day changes
-            LAG(cold_pressure_avg) OVER (PARTITION BY sensor_id ORDER BY report_date) AS prev_cold,
-            LAG(temperature_avg)   OVER (PARTITION BY sensor_id ORDER BY report_date) AS prev_temp,
-            LAG(hot_pressure_avg)  OVER (PARTITION BY sensor_id ORDER BY report_date) AS prev_hot,
-            LAG(report_date)        OVER (PARTITION BY sensor_id ORDER BY report_date) AS prev_date
-        FROM daily
-        WINDOW w AS (PARTITION BY sensor_id ORDER BY report_date
-                     ROWS BETWEEN {SLOPE_WINDOW_DAYS-1} PRECEDING AND CURRENT ROW)
+            LAG(cold_pressure_avg) OVER prev AS prev_cold,
+            LAG(temperature_avg)   OVER prev AS prev_temp,
+            LAG(hot_pressure_avg)  OVER prev AS prev_hot,
+            LAG(report_date)        OVER prev AS prev_date
+        FROM peers
+        WINDOW w AS (PARTITION BY sensor_key ORDER BY {order}
+                     {frame} BETWEEN {SLOPE_WINDOW_DAYS-1} PRECEDING AND CURRENT ROW),
+               prev AS (PARTITION BY sensor_key ORDER BY report_date, id)
     )
     SELECT
         *,
@@ -146,34 +312,66 @@ def _extract_sensor_features(analyzer, start_date, end_date):
         CASE WHEN prev_date = report_date - INTERVAL 1 DAY
              THEN hot_pressure_avg - prev_hot   ELSE NULL END AS delta_hot,
         -- thermal/pressure ratio
-        CASE WHEN delta_hot != 0 THEN delta_temp / delta_hot ELSE NULL END AS thermal_pressure_ratio,
-        -- over‑inflation index
-        (level_1_high_cold_pressure_dur + level_2_high_hot_pressure_dur) /
-            NULLIF(transmitting_dur, 0) AS over_inflation_index,
-        -- high temperature duration ratio
-        (level_2_high_temperature_dur + level_3_high_temperature_dur) /
-            NULLIF(transmitting_dur, 0) AS high_temp_dur_ratio
+        CASE WHEN delta_hot != 0 THEN delta_temp / delta_hot ELSE NULL END AS thermal_pressure_ratio
     FROM rolling
-    ORDER BY sensor_id, report_date;
+    ORDER BY sensor_key, report_date, id;
     """
+    return analyzer.query(query)
 
-    df = analyzer.query(query)
-    # Fill NaNs introduced by lag/division
-    df.fillna({'delta_cold': 0, 'delta_temp': 0, 'delta_hot': 0,
-               'thermal_pressure_ratio': 0, 'over_inflation_index': 0,
-               'high_temp_dur_ratio': 0, 'std_temp': 0, 'std_cold': 0}, inplace=True)
-    logger.info(f"Sensor features extracted: {len(df)} rows")
-    return df
+
+def _extract_quarantined_sensor_rows(analyzer, start_date, end_date):
+    """
+    Sensor rows quarantined at ingest for an HARDWARE_FAIL_REASONS code. They stay out of
+    the feature windows (an impossible reading would distort every slope around it), but
+    they are the evidence of failing hardware, so the report gets them back as Hardware Fail.
+    Empty when the table was loaded without quality rules.
+    """
+    quarantine = analyzer.conn.execute("""
+SELECT 1 FROM duckdb_tables() WHERE table_name = 'time_in_level_sensor_quarantine'
+UNION ALL
+SELECT 1 FROM duckdb_views() WHERE view_name = 'time_in_level_sensor_quarantine'
+    """).fetchone()
+    reasons = ', '.join(f"'{reason}'" for reason in HARDWARE_FAIL_REASONS)
+    # Without a quarantine table the same columns come back empty, typed like the sensor table
+    source, condition = (('time_in_level_sensor_quarantine', f"list_has_any(dq_reasons, [{reasons}])") if quarantine
+                         else ('time_in_level_sensor', 'false'))
+    return analyzer.query(f"""--sql
+    SELECT
+        id,
+        wheel_position,
+        wheel_id,
+        sensor_id,
+        vehicle_id,
+        report_start_at::DATE AS report_date,
+        temperature_avg,
+        cold_pressure_avg,
+        hot_pressure_avg,
+        transmitting_dur
+    FROM {source}
+    WHERE {condition}
+      AND sensor_id IS NOT NULL
+      AND report_start_at BETWEEN '{start_date}' AND '{end_date}'
+    ORDER BY sensor_id, report_date, id;
+    """)
 
 
 def _extract_device_features(analyzer, start_date, end_date):
-    """Query device table and join with sensor counts per vehicle."""
+    """
+    Query device table and build hub features at two grains in one grouped pass:
+    - per hub: the device rows plus the vehicle-day context they belong to
+    - per vehicle-day: hub count, best hub, total uptime and hub redundancy
+    Sensor counts are aggregated once per vehicle-day, so they are not
+    multiplied across the 0, 1 or 2 hubs a vehicle may have.
+    """
     query = f"""--sql
+    CREATE OR REPLACE TEMP TABLE vehicle_hub_daily AS
     WITH device_daily AS (
         SELECT
             id,
             vehicle_id,
             device_id,
+            device_key,
+            vehicle_key,
             report_start_at::DATE AS report_date,
             transmitting_dur,
             not_transmitting_dur,
@@ -185,146 +383,276 @@ def _extract_device_features(analyzer, start_date, end_date):
     ),
     sensor_counts AS (
         SELECT
-            vehicle_id,
+            vehicle_key,
             report_start_at::DATE AS report_date,
             COUNT(DISTINCT sensor_id) AS active_sensors
         FROM time_in_level_sensor
         WHERE transmitting_dur > 0
           AND report_start_at BETWEEN '{start_date}' AND '{end_date}'
-        GROUP BY vehicle_id, report_date
+        GROUP BY vehicle_key, report_date
+    ),
+    vehicle_hubs AS (
+        SELECT
+            vehicle_key,
+            ANY_VALUE(vehicle_id) AS vehicle_id,
+            report_date,
+            LIST({{
+                'id': id, 'device_id': device_id,
+                'transmitting_dur': transmitting_dur, 'not_transmitting_dur': not_transmitting_dur,
+                'connectivity_efficiency': connectivity_efficiency,
+                'vehicle_maintenance': vehicle_maintenance, 'vehicle_out_of_service': vehicle_out_of_service
+            }}) AS hubs,
+            -- device_key {NULL_KEY}: vehicle-day row without a hub
+            COUNT(*) FILTER (WHERE device_key <> {NULL_KEY}) AS hub_count,
+            COUNT(*) FILTER (WHERE device_key <> {NULL_KEY}
+                             AND connectivity_efficiency >= {HUB_EFFICIENCY_THRESHOLD}) AS healthy_hubs,
+            ARG_MAX(device_id, COALESCE(connectivity_efficiency, 0)) FILTER (WHERE device_key <> {NULL_KEY}) AS best_hub_id,
+            MAX(connectivity_efficiency) FILTER (WHERE device_key <> {NULL_KEY}) AS best_hub_efficiency,
+            SUM(transmitting_dur) FILTER (WHERE device_key <> {NULL_KEY}) /
+                NULLIF(SUM(transmitting_dur + not_transmitting_dur) FILTER (WHERE device_key <> {NULL_KEY}), 0) AS total_uptime,
+            MAX(vehicle_maintenance) AS vehicle_maintenance,
+            MAX(vehicle_out_of_service) AS vehicle_out_of_service
+        FROM device_daily
+        GROUP BY vehicle_key, report_date
     )
     SELECT
-        d.*,
+        v.*,
         COALESCE(s.active_sensors, 0) AS active_sensors
-    FROM device_daily d
+    FROM vehicle_hubs v
     LEFT JOIN sensor_counts s
-        ON d.vehicle_id = s.vehicle_id AND d.report_date = s.report_date
-    ORDER BY d.vehicle_id, d.report_date;
+        ON v.vehicle_key = s.vehicle_key AND v.report_date = s.report_date;
     """
-    df = analyzer.query(query)
-    df.fillna({'connectivity_efficiency': 0}, inplace=True)
-    logger.info(f"Device features extracted: {len(df)} rows")
-    return df
-
+    analyzer.query(query)
 
-def _classify_sensor_issues(df):
-    """Apply sensor-level classification logic."""
-    # Boolean flags for each condition
-    df['is_slow_leak'] = (
-        (df['cold_pressure_slope'] < SLOW_LEAK_SLOPE_THRESHOLD) &
-        (df['temperature_slope'].abs() < TEMP_SLOPE_THRESHOLD)
-    )
+    # Per-hub rows are unnested from the vehicle-day aggregate, no second join
+    device_df = analyzer.query("""--sql
+    SELECT
+        h.id,
+        vehicle_id,
+        h.device_id,
+        report_date,
+        h.transmitting_dur,
+        h.not_transmitting_dur,
+        h.connectivity_efficiency,
+        h.vehicle_maintenance,
+        h.vehicle_out_of_service,
+        active_sensors,
+        hub_count
+    FROM (SELECT *, UNNEST(hubs) AS h FROM vehicle_hub_daily)
+    -- Total order: a vehicle-day may have several hubs
+    ORDER BY vehicle_id, report_date, h.device_id, h.id;
+    """)
+    device_df.fillna({'connectivity_efficiency': 0}, inplace=True)
+
+    vehicle_df = analyzer.query("""--sql
+    SELECT * EXCLUDE (hubs)
+    FROM vehicle_hub_daily
+    ORDER BY vehicle_id, report_date;
+    """)
+    vehicle_df.fillna({'best_hub_efficiency': 0, 'total_uptime': 0}, inplace=True)
+
+    logger.info(f"Device features extracted: {len(device_df)} hub rows, {len(vehicle_df)} vehicle-day rows")
+    return device_df, vehicle_df
+
+
+SENSOR_CATEGORIES = np.array(['Normal', 'Puncture', 'Over-Inflation', 'Slow Leak', 'Thermal Stress', 'Hardware Fail'])
+HUB_CATEGORIES = np.array(['Normal', 'No Hardware', 'Hardware Fail'])
+
+
+def sensor_thresholds():
+    """Current sensor rule thresholds, keyed by their module constant name."""
+    return {
+        'SLOW_LEAK_SLOPE_THRESHOLD': SLOW_LEAK_SLOPE_THRESHOLD,
+        'TEMP_SLOPE_THRESHOLD': TEMP_SLOPE_THRESHOLD,
+        'PUNCTURE_DROP_THRESHOLD': PUNCTURE_DROP_THRESHOLD,
+        'PUNCTURE_LEVEL3_DUR_THRESHOLD': PUNCTURE_LEVEL3_DUR_THRESHOLD,
+        'OVERINFLATION_THRESHOLD': OVERINFLATION_THRESHOLD,
+        'THERMAL_RATIO_THRESHOLD': THERMAL_RATIO_THRESHOLD,
+        'FROZEN_STD_THRESHOLD': FROZEN_STD_THRESHOLD,
+        'PEER_Z_THRESHOLD': PEER_Z_THRESHOLD,
+    }
+
+
+def hub_thresholds():
+    """Current hub rule thresholds, keyed by their module constant name."""
+    return {'HUB_EFFICIENCY_THRESHOLD': HUB_EFFICIENCY_THRESHOLD}
+
+
+SENSOR_FEATURES = ['cold_pressure_slope', 'temperature_slope', 'delta_cold', 'delta_temp', 'delta_hot',
+                   'level_3_low_cold_pressure_dur', 'level_3_low_cold_pressure_cnt', 'transmitting_dur',
+                   'over_inflation_index', 'high_temp_dur_ratio', 'thermal_pressure_ratio',
+                   'std_temp', 'std_cold', 'temperature_avg', 'cold_pressure_avg', 'cold_peer_z', 'temp_peer_z']
+HUB_FEATURES = ['has_hub', 'connectivity_efficiency', 'active_sensors', 'vehicle_maintenance', 'vehicle_out_of_service']
+
+
+def _feature_arrays(df, columns, shape=(-1,)):
+    """Feature columns as float64 arrays (NULL -> NaN, so every comparison on it is False)"""
+    return {col: df[col].to_numpy(dtype='float64', na_value=np.nan).reshape(shape) for col in columns}
+
+
+def _sensor_issue_kernel(f, t):
+    """
+    Sensor rules on NumPy arrays. Features f and thresholds t broadcast against each
+    other: (n,) features with scalar thresholds classify one configuration, (n, 1)
+    features with (k,) thresholds classify k configurations at once.
+    Returns the flags, the category code (index in SENSOR_CATEGORIES) and the risk score.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        level3_ratio = f['level_3_low_cold_pressure_dur'] / np.where(f['transmitting_dur'] == 0, np.nan, f['transmitting_dur'])
+
+        # A whole-vehicle drift (weather, load) is not a wheel issue: slow leak and thermal stress
+        # also need the wheel to deviate from its peers. No peers (NaN z) keeps the flag.
+        below_peers = ~(f['cold_peer_z'] >= -t['PEER_Z_THRESHOLD'])
+        above_peers = ~(f['temp_peer_z'] <= t['PEER_Z_THRESHOLD'])
+
+        flags = {
+            'is_slow_leak': (f['cold_pressure_slope'] < t['SLOW_LEAK_SLOPE_THRESHOLD']) &
+                            (np.abs(f['temperature_slope']) < t['TEMP_SLOPE_THRESHOLD']) &
+                            below_peers,
+            'is_puncture': (f['delta_cold'] < -t['PUNCTURE_DROP_THRESHOLD']) &
+                           (level3_ratio > t['PUNCTURE_LEVEL3_DUR_THRESHOLD']) &
+                           (f['transmitting_dur'] > 0),
+            'is_over_inflation': (f['over_inflation_index'] > t['OVERINFLATION_THRESHOLD']) &
+                                 (f['high_temp_dur_ratio'] < 0.1),  # low concurrent high temperature
+            'is_thermal_stress': (f['thermal_pressure_ratio'] > t['THERMAL_RATIO_THRESHOLD']) &
+                                 (f['delta_temp'] > 0) &
+                                 (f['delta_hot'] < 1) &  # pressure barely rises
+                                 above_peers,
+        }
+        # A NULL std (window of fewer than 2 readings) is NaN here and never counts as frozen
+        frozen = (f['std_temp'] < t['FROZEN_STD_THRESHOLD']) | (f['std_cold'] < t['FROZEN_STD_THRESHOLD'])
+        # Impossible readings never get here: they are quarantined at ingest (see _add_quarantined_failures)
+        flags['is_sensor_malfunction'] = (f['transmitting_dur'] > 0) & frozen
+
+        # Category by priority (puncture highest): apply from lowest to highest priority
+        shape = np.broadcast_shapes(*(flag.shape for flag in flags.values()))
+        code = np.zeros(shape, dtype='int8')
+        for flag, category_code in [('is_sensor_malfunction', 5), ('is_thermal_stress', 4), ('is_slow_leak', 3),
+                                    ('is_over_inflation', 2), ('is_puncture', 1)]:
+            code = np.where(flags[flag], category_code, code)
+
+        # Risk score (0-100); later rules overwrite earlier ones
+        risk = np.zeros(shape)
+        # Slow Leak: slope magnitude relative to threshold, capped at 100
+        risk = np.where(flags['is_slow_leak'],
+                        np.minimum(100, np.abs(f['cold_pressure_slope']) / np.abs(t['SLOW_LEAK_SLOPE_THRESHOLD']) * 100), risk)
+        # Puncture: combination of duration fraction and count
+        risk = np.where(flags['is_puncture'],
+                        np.minimum(100, level3_ratio * 100 + f['level_3_low_cold_pressure_cnt'] * 5), risk)
+        # Over-Inflation: directly from index
+        risk = np.where(flags['is_over_inflation'], np.minimum(100, f['over_inflation_index'] * 100), risk)
+        # Thermal Stress: ratio relative to threshold
+        risk = np.where(flags['is_thermal_stress'],
+                        np.minimum(100, f['thermal_pressure_ratio'] / t['THERMAL_RATIO_THRESHOLD'] * 100), risk)
+        # Sensor Malfunction: 80 for frozen (100 for the quarantined impossible values)
+        risk = np.where(flags['is_sensor_malfunction'], 80, risk)
 
-    df['is_puncture'] = (
-        (df['delta_cold'] < -PUNCTURE_DROP_THRESHOLD) &
-        (df['level_3_low_cold_pressure_dur'] / df['transmitting_dur'].replace(0, np.nan)
-         > PUNCTURE_LEVEL3_DUR_THRESHOLD) &
-        (df['transmitting_dur'] > 0)
-    ).fillna(False)
+    # Normal assets get risk score 0
+    risk = np.trunc(np.nan_to_num(risk, nan=0.0))
+    return flags, code, risk
+
+
+def _hub_issue_kernel(f, t):
+    """Hub rules on NumPy arrays, broadcasting like _sensor_issue_kernel."""
+    has_hub = f['has_hub'] > 0
+    with np.errstate(invalid='ignore'):
+        zero_sensors = f['active_sensors'] == 0
+        is_hub_malfunction = (
+            has_hub &
+            ((f['connectivity_efficiency'] < t['HUB_EFFICIENCY_THRESHOLD']) | zero_sensors) &
+            (f['vehicle_maintenance'] == 0) &
+            (f['vehicle_out_of_service'] == 0)
+        )
 
-    df['is_over_inflation'] = (
-        (df['over_inflation_index'] > OVERINFLATION_THRESHOLD) &
-        (df['high_temp_dur_ratio'] < 0.1)  # low concurrent high temperature
-    )
+    # No hub installed / hub exists but malfunctioning / hub exists and working properly
+    code = np.where(is_hub_malfunction, 2, np.where(has_hub, 0, 1)).astype('int8')
 
-    df['is_thermal_stress'] = (
-        (df['thermal_pressure_ratio'] > THERMAL_RATIO_THRESHOLD) &
-        (df['delta_temp'] > 0) &
-        (df['delta_hot'] < 1)  # pressure barely rises
-    )
+    # Risk score: 100 - efficiency (if efficiency low) or 100 if zero sensors
+    risk = np.where(is_hub_malfunction & zero_sensors, 100,
+                    np.where(is_hub_malfunction, 100 - f['connectivity_efficiency'] * 100, 0))
+    risk = np.trunc(np.nan_to_num(risk, nan=0.0))
+    return {'is_hub_malfunction': is_hub_malfunction}, code, risk
 
-    df['is_sensor_malfunction'] = (
-        (df['transmitting_dur'] > 0) & (
-            (df['std_temp'] < FROZEN_STD_THRESHOLD) |
-            (df['std_cold'] < FROZEN_STD_THRESHOLD) |
-            (df['temperature_avg'] < -50) | (df['temperature_avg'] > 150) |
-            (df['cold_pressure_avg'] < 0) | (df['cold_pressure_avg'] > 200)
-        )
-    )
 
-    # Assign category based on priority (puncture highest)
-    conditions = [
-        df['is_puncture'],
-        df['is_over_inflation'],
-        df['is_slow_leak'],
-        df['is_thermal_stress'],
-        df['is_sensor_malfunction']
-    ]
-    choices = ['Puncture', 'Over-Inflation', 'Slow Leak', 'Thermal Stress', 'Hardware Fail']
-    df['issue_category'] = np.select(conditions, choices, default='Normal')
+def _classify_sensor_issues(df, thresholds=None):
+    """
+    Apply sensor-level classification logic.
+    thresholds overrides any of sensor_thresholds() (see proactive/threshold_sweep.py for grids).
+    """
+    thresholds = {**sensor_thresholds(), **(thresholds or {})}
+    flags, code, risk = _sensor_issue_kernel(_feature_arrays(df, SENSOR_FEATURES), thresholds)
 
-    # Compute risk score (0-100)
-    risk_score = pd.Series(0.0, index=df.index, dtype='float64')
+    # Boolean flags for each condition
+    for name, flag in flags.items():
+        df[name] = flag
+    df['issue_category'] = SENSOR_CATEGORIES[code]
+    df['risk_score'] = risk.astype(int)
 
-    # Slow Leak: slope magnitude relative to threshold, capped at 100
-    mask = df['is_slow_leak']
-    risk_score[mask] = np.minimum(100, (df.loc[mask, 'cold_pressure_slope'].abs()
-                                        / abs(SLOW_LEAK_SLOPE_THRESHOLD) * 100))
-
-    # Puncture: combination of duration fraction and count
-    mask = df['is_puncture']
-    risk_score[mask] = np.minimum(100,
-        (df.loc[mask, 'level_3_low_cold_pressure_dur'] / df.loc[mask, 'transmitting_dur'] * 100) +
-        df.loc[mask, 'level_3_low_cold_pressure_cnt'] * 5)
-
-    # Over-Inflation: directly from index
-    mask = df['is_over_inflation']
-    risk_score[mask] = np.minimum(100, df.loc[mask, 'over_inflation_index'] * 100)
-
-    # Thermal Stress: ratio relative to threshold
-    mask = df['is_thermal_stress']
-    risk_score[mask] = np.minimum(100, df.loc[mask, 'thermal_pressure_ratio']
-                                   / THERMAL_RATIO_THRESHOLD * 100)
-
-    # Sensor Malfunction: 80 for frozen, 100 for impossible values
-    mask = df['is_sensor_malfunction']
-    frozen_mask = mask & ((df['std_temp'] < FROZEN_STD_THRESHOLD) |
-                          (df['std_cold'] < FROZEN_STD_THRESHOLD))
-    impossible_mask = mask & ((df['temperature_avg'] < -50) | (df['temperature_avg'] > 150) |
-                              (df['cold_pressure_avg'] < 0) | (df['cold_pressure_avg'] > 200))
-    risk_score[frozen_mask] = 80
-    risk_score[impossible_mask] = 100
+    return df
 
-    # Normal assets get risk score 0
-    df['risk_score'] = risk_score.fillna(0).astype(int)
 
-    return df
+def _add_quarantined_failures(sensor_df, quarantined_df):
+    """
+    Append the quarantined impossible readings (_extract_quarantined_sensor_rows) to the
+    classified sensor rows as Hardware Fail with risk 100, so a sensor reporting nothing
+    but impossible values is still reported, and at the top of the risk ranking.
+    """
+    if quarantined_df.empty:
+        return sensor_df
+    failures = quarantined_df.assign(
+        **{flag: False for flag in ['is_slow_leak', 'is_puncture', 'is_over_inflation', 'is_thermal_stress']},
+        is_sensor_malfunction=True, issue_category='Hardware Fail', risk_score=100)
+    df = pd.concat([sensor_df, failures], ignore_index=True)
+    return df.sort_values(['sensor_id', 'report_date', 'id'], kind='stable').reset_index(drop=True)
 
 
-def _classify_device_issues(df):
+def _classify_device_issues(df, thresholds=None):
     """Apply device-level classification (hub malfunction)."""
+    thresholds = {**hub_thresholds(), **(thresholds or {})}
     df['has_hub'] = df['device_id'].notna()
+    flags, code, risk = _hub_issue_kernel(_feature_arrays(df, HUB_FEATURES), thresholds)
+
+    df['is_hub_malfunction'] = flags['is_hub_malfunction']
+    df['issue_category'] = HUB_CATEGORIES[code]
+    df['risk_score'] = risk.astype(int)
+
+    return df
 
-    df['is_hub_malfunction'] = (
-        df['has_hub'] &
-        (
-            (df['connectivity_efficiency'] < HUB_EFFICIENCY_THRESHOLD) |
-            (df['active_sensors'] == 0)
-        ) &
-        (df['vehicle_maintenance'] == 0) &
-        (df['vehicle_out_of_service'] == 0)
-    )
+
+def _classify_vehicle_hub_issues(df):
+    """
+    Apply vehicle-level hub classification from the per vehicle-day aggregates.
+    A vehicle only fails when none of its hubs is healthy; losing one of two
+    hubs is reported as reduced redundancy.
+    """
+    operational = (df['vehicle_maintenance'] == 0) & (df['vehicle_out_of_service'] == 0)
+    no_hub = df['hub_count'] == 0
+    all_hubs_down = ~no_hub & ((df['healthy_hubs'] == 0) | (df['active_sensors'] == 0))
+    reduced_redundancy = (df['hub_count'] > 1) & (df['healthy_hubs'] < df['hub_count'])
+
+    df['is_hub_malfunction'] = all_hubs_down & operational
+    df['is_reduced_redundancy'] = reduced_redundancy & ~all_hubs_down & operational
 
     conditions = [
-        ~df['has_hub'],  # No hub installed
-        df['is_hub_malfunction'],  # Hub exists but malfunctioning
+        no_hub,
+        df['is_hub_malfunction'],
+        df['is_reduced_redundancy'],
     ]
-    choices = ['No Hardware', 'Hardware Fail']
-    
-    df['issue_category'] = np.select(
-        conditions, 
-        choices, 
-        default='Normal'  # Hub exists and working properly
-    )
+    choices = ['No Hardware', 'Hardware Fail', 'Reduced Redundancy']
+    df['issue_category'] = np.select(conditions, choices, default='Normal')
 
-    # Risk score: 100 - efficiency (if efficiency low) or 100 if zero sensors
+    # Risk score: same scale as the per-hub score, driven by the best hub;
+    # reduced redundancy scores by the share of hubs that are down
     risk_score = pd.Series(0.0, index=df.index, dtype='float64')
     mask = df['is_hub_malfunction']
     zero_sensors_mask = mask & (df['active_sensors'] == 0)
     low_eff_mask = mask & ~zero_sensors_mask
 
     risk_score[zero_sensors_mask] = 100
-    risk_score[low_eff_mask] = 100 - df.loc[low_eff_mask, 'connectivity_efficiency'] * 100
+    risk_score[low_eff_mask] = 100 - df.loc[low_eff_mask, 'best_hub_efficiency'] * 100
+
+    mask = df['is_reduced_redundancy']
+    risk_score[mask] = (df.loc[mask, 'hub_count'] - df.loc[mask, 'healthy_hubs']) / df.loc[mask, 'hub_count'] * 50
     df['risk_score'] = risk_score.fillna(0).astype(int)
 
-    return df
\ No newline at end of file
+    return df
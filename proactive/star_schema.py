@@ -0,0 +1,117 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def _dimension(frames, natural_keys, key_name):
+    """Deduplicated dimension over the natural keys, with a dense int32 surrogate key (1..n)"""
+    dim = pd.concat([df[natural_keys] for df in frames], ignore_index=True)
+    dim = dim.drop_duplicates().sort_values(natural_keys, na_position='first').reset_index(drop=True)
+    dim.insert(0, key_name, np.arange(1, len(dim) + 1, dtype='int32'))
+    return dim
+
+
+def _attach_key(df, dim, natural_keys, key_name):
+    """Replace the natural key columns of a fact by the dimension's surrogate key"""
+    return df[natural_keys].merge(dim, on=natural_keys, how='left')[key_name].to_numpy()
+
+
+def build_star_schema(sensor_df, device_df, vehicle_hub_df):
+    """
+    Split the classified frames into deduplicated dimensions and narrow fact tables.
+    Facts only hold surrogate integer keys and measures; ids, wheel data and the
+    category strings live once in their dimension.
+    """
+    dim_date = _dimension([sensor_df, device_df, vehicle_hub_df], ['report_date'], 'date_key')
+    dim_date['date_key'] = dim_date['report_date'].dt.strftime('%Y%m%d').astype('int32')
+    dim_date['month_year'] = dim_date['report_date'].dt.strftime('%Y-%m')
+    dim_date['year'] = dim_date['report_date'].dt.year
+    dim_date['month'] = dim_date['report_date'].dt.month
+    dim_date['weekday'] = dim_date['report_date'].dt.day_name()
+
+    dim_vehicle = _dimension([sensor_df, device_df, vehicle_hub_df], ['vehicle_id'], 'vehicle_key')
+
+    sensor_keys = ['sensor_id', 'wheel_position', 'wheel_id', 'vehicle_id']
+    dim_sensor = _dimension([sensor_df], sensor_keys, 'sensor_key')
+    dim_sensor['vehicle_key'] = _attach_key(dim_sensor, dim_vehicle, ['vehicle_id'], 'vehicle_key')
+
+    device_keys = ['device_id', 'vehicle_id']
+    dim_device = _dimension([device_df], device_keys, 'device_key')
+    dim_device['vehicle_key'] = _attach_key(dim_device, dim_vehicle, ['vehicle_id'], 'vehicle_key')
+
+    categories = pd.concat([
+        sensor_df[['issue_category']].assign(asset_type='sensor'),
+        device_df[['issue_category']].assign(asset_type='hub'),
+        vehicle_hub_df[['issue_category']].assign(asset_type='vehicle'),
+    ], ignore_index=True)
+    dim_category = _dimension([categories], ['asset_type', 'issue_category'], 'category_key')
+
+    def date_key(df):
+        return df['report_date'].dt.strftime('%Y%m%d').astype('int32').to_numpy()
+
+    def category_key(df, asset_type):
+        return _attach_key(df[['issue_category']].assign(asset_type=asset_type), dim_category,
+                           ['asset_type', 'issue_category'], 'category_key')
+
+    fact_sensor_daily = pd.DataFrame({
+        'id': sensor_df['id'].to_numpy(),
+        'date_key': date_key(sensor_df),
+        'sensor_key': _attach_key(sensor_df, dim_sensor, sensor_keys, 'sensor_key'),
+        'category_key': category_key(sensor_df, 'sensor'),
+        'risk_score': sensor_df['risk_score'].to_numpy(),
+        'temperature_avg': sensor_df['temperature_avg'].to_numpy(),
+        'cold_pressure_avg': sensor_df['cold_pressure_avg'].to_numpy(),
+        'hot_pressure_avg': sensor_df['hot_pressure_avg'].to_numpy(),
+        'transmitting_dur': sensor_df['transmitting_dur'].to_numpy(),
+    })
+
+    fact_hub_daily = pd.DataFrame({
+        'id': device_df['id'].to_numpy(),
+        'date_key': date_key(device_df),
+        'device_key': _attach_key(device_df, dim_device, device_keys, 'device_key'),
+        'category_key': category_key(device_df, 'hub'),
+        'risk_score': device_df['risk_score'].to_numpy(),
+        'transmitting_dur': device_df['transmitting_dur'].to_numpy(),
+        'not_transmitting_dur': device_df['not_transmitting_dur'].to_numpy(),
+        'connectivity_efficiency': device_df['connectivity_efficiency'].to_numpy(),
+        'active_sensors': device_df['active_sensors'].to_numpy(),
+    })
+
+    fact_vehicle_hub_daily = pd.DataFrame({
+        'date_key': date_key(vehicle_hub_df),
+        'vehicle_key': _attach_key(vehicle_hub_df, dim_vehicle, ['vehicle_id'], 'vehicle_key'),
+        'category_key': category_key(vehicle_hub_df, 'vehicle'),
+        'risk_score': vehicle_hub_df['risk_score'].to_numpy(),
+        'hub_count': vehicle_hub_df['hub_count'].to_numpy(),
+        'healthy_hubs': vehicle_hub_df['healthy_hubs'].to_numpy(),
+        'best_hub_id': vehicle_hub_df['best_hub_id'].to_numpy(),
+        'best_hub_efficiency': vehicle_hub_df['best_hub_efficiency'].to_numpy(),
+        'total_uptime': vehicle_hub_df['total_uptime'].to_numpy(),
+        'active_sensors': vehicle_hub_df['active_sensors'].to_numpy(),
+    })
+
+    return {
+        'dim_date': dim_date,
+        'dim_vehicle': dim_vehicle,
+        'dim_sensor': dim_sensor,
+        'dim_device': dim_device,
+        'dim_category': dim_category,
+        'fact_sensor_daily': fact_sensor_daily,
+        'fact_hub_daily': fact_hub_daily,
+        'fact_vehicle_hub_daily': fact_vehicle_hub_daily,
+    }
+
+
+def export_star_schema(sensor_df, device_df, vehicle_hub_df, output_folder='output/star/'):
+    """Write every dimension and fact table of the star schema as <name>.csv in output_folder"""
+    os.makedirs(output_folder, exist_ok=True)
+    tables = build_star_schema(sensor_df, device_df, vehicle_hub_df)
+    for name, table in tables.items():
+        path = os.path.join(output_folder, f"{name}.csv")
+        table.to_csv(path, index=False)
+        logger.info(f"Report saved to {path}. Total rows: {len(table)}")
+    return tables
@@ -0,0 +1,98 @@
+import itertools
+import logging
+
+import numpy as np
+import pandas as pd
+
+from logging_decorator import log_function
+from proactive.query_functions_ds import (HUB_CATEGORIES, HUB_FEATURES, SENSOR_CATEGORIES, SENSOR_FEATURES,
+                                          _feature_arrays, _hub_issue_kernel, _sensor_issue_kernel,
+                                          hub_thresholds, sensor_thresholds)
+
+logger = logging.getLogger(__name__)
+
+RISK_BINS = [0, 1, 26, 51, 76, 101]
+RISK_BIN_LABELS = ['risk_0', 'risk_1_25', 'risk_26_50', 'risk_51_75', 'risk_76_100']
+
+# Cells (rows x configurations) per chunk: the kernel's intermediates hold about 40 bytes per
+# cell, so peak memory stays near 200 MB whatever the number of configurations
+DEFAULT_CHUNK_CELLS = 5_000_000
+
+
+def expand_grid(grid):
+    """
+    Threshold configurations from a grid: either a list of {name: value} dicts,
+    or a {name: [values]} dict expanded to its cartesian product.
+    """
+    if isinstance(grid, dict):
+        names = list(grid)
+        return pd.DataFrame([dict(zip(names, values)) for values in itertools.product(*grid.values())])
+    return pd.DataFrame(list(grid))
+
+
+def _sweep(df, configs, defaults, features, kernel, categories, chunk_cells):
+    """
+    Evaluate every configuration against the feature rows in one broadcast pass per chunk,
+    chunk_cells / n_configs rows at a time
+    """
+    configs = configs.reset_index(drop=True)
+    thresholds = {name: configs[name].to_numpy(dtype='float64') if name in configs else value
+                  for name, value in defaults.items()}
+    unknown = set(configs.columns) - set(defaults)
+    if unknown:
+        raise ValueError(f"Unknown thresholds: {sorted(unknown)}")
+
+    k = len(configs)
+    chunk_rows = max(1, chunk_cells // max(k, 1))
+    category_counts = np.zeros((k, len(categories)), dtype='int64')
+    risk_hist = np.zeros((k, len(RISK_BIN_LABELS)), dtype='int64')
+    risk_sum = np.zeros(k)
+
+    for start in range(0, len(df), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        f = _feature_arrays(chunk, features, shape=(-1, 1))
+        _, code, risk = kernel(f, thresholds)
+        code = np.broadcast_to(code, (len(chunk), k))
+        risk = np.broadcast_to(risk, (len(chunk), k))
+
+        for c in range(len(categories)):
+            category_counts[:, c] += (code == c).sum(axis=0)
+        bins = np.digitize(risk, RISK_BINS[1:-1])
+        for b in range(len(RISK_BIN_LABELS)):
+            risk_hist[:, b] += (bins == b).sum(axis=0)
+        risk_sum += risk.sum(axis=0)
+
+    result = configs.copy()
+    for c, category in enumerate(categories):
+        result[category] = category_counts[:, c]
+    result['mean_risk'] = risk_sum / max(len(df), 1)
+    for b, label in enumerate(RISK_BIN_LABELS):
+        result[label] = risk_hist[:, b]
+    return result
+
+
+@log_function
+def sweep_sensor_thresholds(sensor_features_df, grid, chunk_cells=DEFAULT_CHUNK_CELLS):
+    """
+    What-if for the sensor rules: evaluate every threshold configuration of grid
+    against one computed feature table (output of _extract_sensor_features).
+    Thresholds missing from the grid keep their current value.
+    Returns one row per configuration with category counts and the risk distribution.
+    Memory is bounded by chunk_cells (rows x configurations evaluated at once).
+    """
+    configs = expand_grid(grid)
+    result = _sweep(sensor_features_df, configs, sensor_thresholds(), SENSOR_FEATURES,
+                    _sensor_issue_kernel, SENSOR_CATEGORIES, chunk_cells)
+    logger.info(f"Evaluated {len(configs)} sensor threshold configurations over {len(sensor_features_df)} rows")
+    return result
+
+
+@log_function
+def sweep_hub_thresholds(device_features_df, grid, chunk_cells=DEFAULT_CHUNK_CELLS):
+    """What-if for the per-hub rules, same contract as sweep_sensor_thresholds."""
+    df = device_features_df.assign(has_hub=device_features_df['device_id'].notna())
+    configs = expand_grid(grid)
+    result = _sweep(df, configs, hub_thresholds(), HUB_FEATURES,
+                    _hub_issue_kernel, HUB_CATEGORIES, chunk_cells)
+    logger.info(f"Evaluated {len(configs)} hub threshold configurations over {len(df)} rows")
+    return result
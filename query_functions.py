@@ -1,27 +1,92 @@
 import logging
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
 from duckdb import df
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 
+from checkpoints import fingerprint, run_stage, table_fingerprint
+from exporter import output_files, write_output
+from iforest_attribution import explain_anomalies
+from peer_features import WHEELS_PER_AXLE, peer_features_query
+from roster import installed_assets
+from shared_data import SharedData, attach
+
 logger = logging.getLogger(__name__)
 
-def sensor_anomaly_detection(analyzer, start_date, end_date, output_path='output/anomalies_from_sensors.csv'):
+# Rolling z-score window: 'range' covers the last 7 calendar days, 'rows' the last 7 reports
+WINDOW_MODE = 'range'
+
+# Isolation Forest inputs: a mix of averages, critical durations and z-scores
+ML_FEATURES = [
+    'temperature_avg', 'cold_pressure_avg', 'hot_pressure_avg',
+    'crit_temp_dur', 'crit_cold_dur', 'crit_hot_dur',
+    'z_temp', 'z_cold', 'z_hot',  # Feeding z-scores helps the model understand trend deviation
+    'temp_peer_z', 'cold_peer_z'  # ... and peer z-scores tell a failing wheel from a whole-vehicle drift
+]
+IFOREST_PARAMS = {'n_estimators': 100, 'contamination': 0.04, 'random_state': 42}
+# The scaler and forest are fit on a stratified sample (vehicle, wheel position, month)
+# of at most this many rows, then every row is scored in chunks on ML_SCORE_JOBS workers
+ML_TRAIN_SAMPLE_SIZE = 50_000            # None fits on every row
+ML_SCORE_CHUNK_ROWS = 200_000
+ML_SCORE_JOBS = -1                       # joblib n_jobs, -1 = all cores
+ML_STRATA = ['vehicle_id', 'wheel_position', 'month']
+# ML-flagged rows are explained by the features that shortened their isolation paths the most
+ML_ATTRIBUTION_TOP_K = 3
+
+def sensor_anomaly_detection(analyzer, start_date, end_date, output_path='output/anomalies_from_sensors.csv',
+                             window_mode=WINDOW_MODE, checkpoints=None):
     """
     Performs a Hybrid Anomaly Detection (Statistical + Machine Learning).
     
     Strategies:
     1. Statistical (DuckDB): Calculates Z-Scores for Temperature, Cold Pressure, and Hot Pressure
-       based on a 7-day moving window per sensor.
+       based on a 7-day moving window per sensor (calendar days by default, see WINDOW_MODE),
+       and peer z-scores against the vehicle's other wheels the same day.
     2. ML (Isolation Forest): Detects multivariate anomalies (e.g., mismatch between 
        temperature and pressure, or abnormal duration patterns).
+    With a CheckpointStore the z-scores, model scores and export are checkpointed stages.
     """
     
     logger.info(f"Starting Comprehensive Anomaly Detection ({start_date} to {end_date})...")
 
+    zscores_fingerprint = table_fingerprint(analyzer, 'anomaly_zscores', ['time_in_level_sensor'],
+                                            str(start_date), str(end_date), window_mode, WHEELS_PER_AXLE) if checkpoints else None
+    scores_fingerprint = fingerprint('anomaly_model_scores', zscores_fingerprint, ML_FEATURES, IFOREST_PARAMS,
+                                     ML_TRAIN_SAMPLE_SIZE, ML_STRATA, ML_ATTRIBUTION_TOP_K)
+    export_fingerprint = fingerprint('anomaly_export', scores_fingerprint, output_path)
+
+    def zscores():
+        return {'zscores': _compute_sensor_zscores(analyzer, start_date, end_date, window_mode)}
+
+    def model_scores():
+        df = run_stage(checkpoints, 'anomaly_zscores', zscores_fingerprint, zscores)['zscores']
+        return {'scores': _fit_isolation_forest(df)}
+
+    def export():
+        df = run_stage(checkpoints, 'anomaly_model_scores', scores_fingerprint, model_scores)['scores']
+        return {'anomalies': _interpret_sensor_anomalies(df, output_path)}
+
+    return run_stage(checkpoints, 'anomaly_export', export_fingerprint, export,
+                     outputs=lambda: output_files(output_path))['anomalies']
+
+
+def _compute_sensor_zscores(analyzer, start_date, end_date, window_mode=WINDOW_MODE):
+    """
+    Statistical step: rolling z-scores per sensor in DuckDB.
+    Only looks at one sensor's history, so it can run on any slice of vehicles.
+    """
     # -------------------------------------------------------------------------
     # STEP 1: Statistical Analysis
     # -------------------------------------------------------------------------
     # We calculate Z-Scores for 3 variables: Temp, Cold Press, Hot Press
+    # RANGE frames skip missing days instead of reaching further back in time
+    if window_mode == 'range':
+        frame = "RANGE BETWEEN INTERVAL 6 DAYS PRECEDING AND CURRENT ROW"
+    else:
+        frame = "ROWS BETWEEN 6 PRECEDING AND CURRENT ROW"
+
     query_stats = f"""--sql
 WITH daily_metrics AS (
     SELECT 
@@ -30,6 +95,8 @@ WITH daily_metrics AS (
         sensor_id,
         vehicle_id,
         wheel_position,
+        sensor_key,
+        vehicle_key,
         
         -- Key Metrics
         temperature_avg,
@@ -45,6 +112,9 @@ WITH daily_metrics AS (
     WHERE report_start_at BETWEEN '{start_date}' AND '{end_date}'
 ),
 
+-- Deviation from the vehicle's other wheels the same day (see peer_features.py)
+peer_metrics AS ({peer_features_query('daily_metrics')}),
+
 rolling_window AS (
     SELECT 
         *,
@@ -63,8 +133,8 @@ rolling_window AS (
         AVG(crit_temp_dur) OVER w AS ma_dur_temp,
         STDDEV(crit_temp_dur) OVER w AS sd_dur_temp
 
-    FROM daily_metrics
-    WINDOW w AS (PARTITION BY sensor_id ORDER BY report_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW)
+    FROM peer_metrics
+    WINDOW w AS (PARTITION BY sensor_key ORDER BY report_date {frame})
 )
 
 SELECT 
@@ -84,37 +154,94 @@ ORDER BY report_date, sensor_id;
     df.fillna(0, inplace=True) # Handle basic NaNs
     
     logger.info(f"Statistical features extracted. Rows: {len(df)}")
+    return df
+
+
+def _stratified_sample(df, sample_size, seed=None):
+    """
+    Row positions of a stratified random sample (by ML_STRATA) of exactly sample_size rows.
+    Each stratum keeps a share proportional to its size, rounded by largest remainder
+    (ties drawn at random), so with more strata than sample_size rows the small strata
+    are sampled rather than all kept and the fit cost stays fixed whatever the fleet size.
+    Rows are picked as the smallest random keys of the stratum (same draw as a reservoir).
+    Positions come back sorted; with sample_size None or >= len(df) every row is kept.
+    """
+    n = len(df)
+    if sample_size is None or sample_size >= n:
+        return np.arange(n)
+
+    strata = df.assign(month=pd.to_datetime(df['report_date']).dt.to_period('M'))[ML_STRATA]
+    codes = strata.groupby(ML_STRATA, dropna=False, sort=False).ngroup().to_numpy()
+    sizes = np.bincount(codes)
+    rng = np.random.default_rng(seed)
+    exact = sizes * (sample_size / n)
+    quota = np.floor(exact).astype('int64')
+    remainder_order = np.lexsort((rng.random(len(sizes)), -(exact - quota)))
+    quota[remainder_order[:sample_size - quota.sum()]] += 1
+
+    keys = rng.random(n)
+    order = np.lexsort((keys, codes))
+    first = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    rank = np.arange(n) - first[codes[order]]
+    return np.sort(order[rank < quota[codes[order]]])
+
+
+def _score_chunk(scaler, iso_forest, X, start, stop):
+    """Scores of rows start:stop of X (an array or a SharedData handle)"""
+    return iso_forest.decision_function(scaler.transform(attach(X)[start:stop]))
+
 
+def _fit_isolation_forest(df, sample_size=ML_TRAIN_SAMPLE_SIZE, chunk_rows=ML_SCORE_CHUNK_ROWS,
+                          n_jobs=ML_SCORE_JOBS):
+    """
+    Fit the Isolation Forest on a stratified sample of the z-score rows, then score
+    every row in chunks (in parallel when there are several) and add its prediction and score.
+    Fit cost is fixed by sample_size and scoring memory by chunk_rows, whatever the range.
+    Flagged rows also get their top ML_ATTRIBUTION_TOP_K features (see iforest_attribution.py).
+    """
     # -------------------------------------------------------------------------
     # STEP 2: Machine Learning (Isolation Forest)
     # -------------------------------------------------------------------------
     # We use this to find weird COMBINATIONS of data that Z-Score misses.
     # e.g., High Temp + Low Hot Pressure (Physically unlikely)
     
-    logger.info("Training Isolation Forest Model...")
-    
-    # Features for the model: A mix of averages and critical durations
-    features = [
-        'temperature_avg', 'cold_pressure_avg', 'hot_pressure_avg',
-        'crit_temp_dur', 'crit_cold_dur', 'crit_hot_dur',
-        'z_temp', 'z_cold', 'z_hot' # Feeding z-scores helps the model understand trend deviation
-    ]
-    
-    X = df[features]
+    X = df[ML_FEATURES].to_numpy(dtype='float64')
+    train = _stratified_sample(df, sample_size, IFOREST_PARAMS.get('random_state'))
+    logger.info(f"Training Isolation Forest Model on {len(train)} of {len(X)} rows...")
     
     # Scale data (Important for ML models)
     scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X)
+    X_train = scaler.fit_transform(X[train])
     
     # Isolation Forest: contamination='auto' lets it decide the % of outliers
-    iso_forest = IsolationForest(n_estimators=100, contamination=0.04, random_state=42)
+    iso_forest = IsolationForest(**IFOREST_PARAMS).fit(X_train)
     
+    # Anomaly Score (Lower is more anomalous), negative scores are the outliers
+    bounds = [(start, min(start + chunk_rows, len(X))) for start in range(0, len(X), chunk_rows)]
+    if len(bounds) > 1:
+        # Workers attach to one shared copy of X instead of each receiving pickled chunks
+        with SharedData() as shared:
+            X_shared = shared.publish('ml_features', X)
+            scores = Parallel(n_jobs=n_jobs)(delayed(_score_chunk)(scaler, iso_forest, X_shared, start, stop)
+                                             for start, stop in bounds)
+    else:
+        scores = [_score_chunk(scaler, iso_forest, X, start, stop) for start, stop in bounds]
+    scores = np.concatenate(scores) if scores else np.empty(0)
+
     # Predict: -1 is Anomaly, 1 is Normal
-    df['ml_anomaly_pred'] = iso_forest.fit_predict(X_scaled)
-    
-    # Anomaly Score (Lower is more anomalous)
-    df['ml_anomaly_score'] = iso_forest.decision_function(X_scaled)
+    df['ml_anomaly_pred'] = np.where(scores < 0, -1, 1)
+    df['ml_anomaly_score'] = scores
+
+    flagged = np.flatnonzero(scores < 0)
+    attribution = explain_anomalies(iso_forest, scaler.transform(X[flagged]), ML_FEATURES, ML_ATTRIBUTION_TOP_K,
+                                    chunk_rows, n_jobs)
+    attribution.index = df.index[flagged]
+    df[attribution.columns] = attribution
+    return df
+
 
+def _interpret_sensor_anomalies(df, output_path):
+    """Flag, explain and export the scored rows"""
     # -------------------------------------------------------------------------
     # STEP 3: Combine & Interpret Results
     # -------------------------------------------------------------------------
@@ -142,24 +269,10 @@ ORDER BY report_date, sensor_id;
         
         # If ML triggered but NO statistical failure occurred (The "Hidden" Anomaly)
         if row['is_ml_anomaly'] == 1 and not reasons:
-            # We investigate "Near Misses" (Z-scores between 2 and 3, or unbalanced relations)
-            ml_reasons = []
-            
-            # Check for moderate deviations that look suspicious together
-            if abs(row['z_temp']) > 2: ml_reasons.append("Unusual Temp Trend")
-            if abs(row['z_cold']) > 2: ml_reasons.append("Unusual Pressure Trend")
-            if abs(row['z_dur_temp']) > 2: ml_reasons.append("Abnormal Time in Risk State")
-            
-            # Check for Physics Mismatch (Example logic)
-            # High Temp but Low Pressure is weird
-            if row['z_temp'] > 1.5 and row['z_cold'] < -1.5:
-                ml_reasons.append("Physics Mismatch (High T / Low P)")
-            
-            if ml_reasons:
-                reasons.append(f"Pattern: {' & '.join(ml_reasons)}")
-            else:
-                # If we still can't explain it easily, it's a complex multivariate outlier
-                reasons.append("Complex Multivariate Pattern")
+            # Explained by the model itself: the features that isolated the row fastest
+            ml_reasons = [row[f'ml_top_feature_{i}'] for i in range(1, ML_ATTRIBUTION_TOP_K + 1)
+                          if row[f'ml_top_contribution_{i}'] > 0]
+            reasons.append(f"Model Drivers: {' & '.join(ml_reasons) or 'Complex Multivariate Pattern'}")
         
         # Fallback for ML combined with Stats
         elif row['is_ml_anomaly'] == 1:
@@ -184,11 +297,12 @@ ORDER BY report_date, sensor_id;
         'id', 'report_date', 'sensor_id', 'vehicle_id', 'wheel_position',
         'temperature_avg', 'cold_pressure_avg', 'hot_pressure_avg',
         'is_anomaly_global', 'anomaly_category', 'anomaly_detail_text',
-        'z_temp', 'z_cold', 'z_hot' # Keep Zs for tooltips
-    ]
+        'z_temp', 'z_cold', 'z_hot', # Keep Zs for tooltips
+        'ml_anomaly_score' # Ranked by the risk leaderboard (lower is more anomalous)
+    ] + [f'ml_top_{kind}_{i}' for i in range(1, ML_ATTRIBUTION_TOP_K + 1) for kind in ('feature', 'contribution')]
     
     df_final = df[final_cols]
-    df_final.to_csv(output_path, index=False)
+    write_output(df_final, output_path)
     
     logger.info(f"Analysis Complete. Global Anomalies Detected: {df['is_anomaly_global'].sum()}")
     return df_final
@@ -204,44 +318,53 @@ def generate_fleet_health_report(analyzer, start_date, end_date, output_folder='
     # SENSOR AVAILABILITY (% Transmitting)
     # =========================================================================
     # Logic: 
-    # - Daily: Count unique sensors sending data vs Total unique sensors known.
+    # - Daily: Count unique sensors sending data vs sensors installed that day (roster.py).
     # - "Transmitting" implies transmitting_dur > 0
     
+    df_daily = _query_sensor_availability(analyzer, start_date, end_date)
+    return _export_sensor_availability(df_daily, output_folder)
+
+
+def _query_sensor_availability(analyzer, start_date, end_date):
+    """
+    Daily active sensor counts next to the baseline of sensors installed that day
+    (first seen on or before it, last seen on or after it), for every day of the range.
+    Both counts are additive across vehicle shards.
+    """
     query_availability = f"""--sql
-WITH total_fleet AS (
-    -- Get the total distinct sensors that SHOULD exist (baseline)
-    SELECT COUNT(DISTINCT sensor_id) as total_fleet_count 
-    FROM time_in_level_sensor
-),
-daily_stats AS (
-    SELECT 
-        report_start_at::DATE as report_date,
-        COUNT(DISTINCT sensor_id) as active_sensors,
-        (SELECT total_fleet_count FROM total_fleet) as total_sensors
-    FROM time_in_level_sensor
-    WHERE transmitting_dur > 0 -- Only count if they actually transmitted
-      AND report_start_at BETWEEN '{start_date}' AND '{end_date}'
-    GROUP BY 1
-)
 SELECT 
-    *,
-    ROUND((active_sensors::FLOAT / total_sensors) * 100, 2) as availability_pct,
-    STRFTIME(report_date, '%Y-%m') as month_year
-FROM daily_stats
+    report_start_at::DATE as report_date,
+    COUNT(DISTINCT sensor_id) as active_sensors
+FROM time_in_level_sensor
+WHERE transmitting_dur > 0 -- Only count if they actually transmitted
+  AND report_start_at BETWEEN '{start_date}' AND '{end_date}'
+GROUP BY 1
 ORDER BY report_date;
     """
-    
-    df_avail = analyzer.query(query_availability)
-    
-    df_avail['availability_pct'] = df_avail['availability_pct'] / 100
+    # The baseline comes from the roster's lifetimes, not a distinct scan of the report rows
+    installed = installed_assets(analyzer, 'sensor', start_date, end_date)
+    df = installed.merge(analyzer.query(query_availability), on='report_date', how='left')
+    df['active_sensors'] = df['active_sensors'].fillna(0).astype('int64')
+    return df.rename(columns={'installed': 'total_sensors'})[['report_date', 'active_sensors', 'total_sensors']]
+
+
+def _export_sensor_availability(df_avail, output_folder='output/'):
+    """Availability % per day and month from the daily active and installed counts."""
+    # Days before the first or after the last sensor of the range have no baseline
+    df_avail = df_avail[df_avail['total_sensors'] > 0].reset_index(drop=True)
+    # Rounded half up to 2 decimals of percent, as SQL ROUND does
+    df_avail['availability_pct'] = np.floor(df_avail['active_sensors'] * 10000 / df_avail['total_sensors'] + 0.5) / 10000
+    df_avail['month_year'] = df_avail['report_date'].dt.strftime('%Y-%m')
+
     # Calculate Aggregates for the executive summary
     overall_availability = df_avail['availability_pct'].mean() if not df_avail.empty else 0
     monthly_availability = df_avail.groupby('month_year')['availability_pct'].mean().reset_index()
     
     logger.info(f"Overall Sensor Availability: {overall_availability * 100:.2f}%")
 
-    df_avail.to_csv(f"{output_folder}report_sensor_availability_daily.csv", index=False)
-    monthly_availability.to_csv(f"{output_folder}report_sensor_availability_monthly.csv", index=False)
+    write_output(df_avail, f"{output_folder}report_sensor_availability_daily.csv")
+    write_output(monthly_availability, f"{output_folder}report_sensor_availability_monthly.csv", 'month_year')
+    return df_avail
 
 def generate_device_health_report(analyzer, start_date, end_date, output_folder='output/'):
     """
@@ -290,6 +413,19 @@ def generate_device_health_report(analyzer, start_date, end_date, output_folder=
     # - vehicles_in_maintenance: Downtime due to mechanics.
     # - vehicles_out_of_service: Downtime due to decommission/other.
     
+    df_status = _query_fleet_status(analyzer, start_date, end_date)
+    write_output(df_status, f"{output_folder}fleet_status.csv")
+    
+    logger.info("Device (Hub) Stats generated.")
+    
+    # return {
+    #     "worst_device_id": df_connectivity.iloc[0]['device_id'] if not df_connectivity.empty else None,
+    #     "worst_device_efficiency": df_connectivity.iloc[0]['connectivity_efficiency_pct'] if not df_connectivity.empty else 0
+    # }
+
+
+def _query_fleet_status(analyzer, start_date, end_date):
+    """Daily hub count and vehicle status breakdown (additive across vehicle shards)."""
     query_fleet_status = f"""--sql
 SELECT
     report_start_at::DATE as report_date,
@@ -309,13 +445,107 @@ WHERE report_start_at BETWEEN '{start_date}' AND '{end_date}'
 GROUP BY 1
 ORDER BY report_date;
     """
-    
-    df_status = analyzer.query(query_fleet_status)
-    df_status.to_csv(f"{output_folder}fleet_status.csv", index=False)
-    
-    logger.info("Device (Hub) Stats generated.")
-    
-    # return {
-    #     "worst_device_id": df_connectivity.iloc[0]['device_id'] if not df_connectivity.empty else None,
-    #     "worst_device_efficiency": df_connectivity.iloc[0]['connectivity_efficiency_pct'] if not df_connectivity.empty else 0
-    # }
\ No newline at end of file
+    return analyzer.query(query_fleet_status)
+
+
+LEVEL_METRICS = ['temperature', 'cold_pressure', 'hot_pressure']
+LEVELS = ['optimal'] + [f'{side}_{n}' for side in ('low', 'high') for n in (1, 2, 3)]
+EXTREME_LEVELS = ['low_3', 'high_3']
+
+
+def _level_columns(metric, level):
+    """Source (_dur, _cnt) columns of one metric level; optimal has no count column"""
+    if level == 'optimal':
+        return f"optimal_{metric}_dur", None
+    side, n = level.split('_')
+    return f"level_{n}_{side}_{metric}_dur", f"level_{n}_{side}_{metric}_cnt"
+
+
+def _level_struct_list():
+    """Every (metric, level) of a row as a list of structs, plus the 'no_data' remainder of the day"""
+    entries = []
+    for metric in LEVEL_METRICS:
+        durs = []
+        for level in LEVELS:
+            dur_col, cnt_col = _level_columns(metric, level)
+            durs.append(f"COALESCE({dur_col}, 0)")
+            entries.append(f"{{'metric': '{metric}', 'level': '{level}', "
+                           f"'dur': COALESCE({dur_col}, 0), 'cnt': {f'COALESCE({cnt_col}, 0)' if cnt_col else '0'}}}")
+        entries.append(f"{{'metric': '{metric}', 'level': 'no_data', "
+                       f"'dur': GREATEST(86400 - ({' + '.join(durs)}), 0), 'cnt': 0}}")
+    return "[\n        " + ",\n        ".join(entries) + "\n    ]"
+
+
+def generate_level_kpi_report(analyzer, start_date, end_date, output_folder='output/'):
+    """
+    Level-distribution KPIs (KEY_INFO.md) for temperature, cold pressure and hot pressure:
+    share of time at OPTIMAL, each LOW/HIGH level and with no data, plus the number of
+    sensors at extreme levels (LOW 3 / HIGH 3), per vehicle by day and by month.
+    The 21 _dur and 18 _cnt columns are unpivoted in a single scan of the sensor table;
+    every rollup then reads the narrow long table instead of the wide source.
+    """
+    logger.info(f"Generating level distribution KPIs ({start_date} to {end_date})...")
+
+    analyzer.query(f"""--sql
+CREATE OR REPLACE TEMP TABLE sensor_level_long AS
+SELECT
+    vehicle_id,
+    sensor_id,
+    report_date,
+    lv.metric,
+    lv.level,
+    lv.dur,
+    lv.cnt
+FROM (
+    SELECT
+        vehicle_id,
+        sensor_id,
+        report_start_at::DATE AS report_date,
+        UNNEST({_level_struct_list()}) AS lv
+    FROM time_in_level_sensor
+    WHERE report_start_at BETWEEN '{start_date}' AND '{end_date}'
+);
+    """)
+
+    extreme_list = ', '.join(f"'{level}'" for level in EXTREME_LEVELS)
+
+    def rollup(period_expr, period_name):
+        distribution = analyzer.query(f"""--sql
+SELECT
+    vehicle_id,
+    {period_expr} AS {period_name},
+    metric,
+    level,
+    SUM(dur) AS level_dur,
+    ROUND(SUM(dur) / NULLIF(SUM(SUM(dur)) OVER (PARTITION BY vehicle_id, {period_expr}, metric), 0), 4) AS level_share,
+    SUM(cnt) AS level_cnt,
+    COUNT(DISTINCT sensor_id) FILTER (WHERE dur > 0) AS sensors_in_level
+FROM sensor_level_long
+GROUP BY vehicle_id, {period_expr}, metric, level
+ORDER BY vehicle_id, {period_name}, metric, level;
+        """)
+        extremes = analyzer.query(f"""--sql
+SELECT
+    vehicle_id,
+    {period_expr} AS {period_name},
+    metric,
+    COUNT(DISTINCT sensor_id) AS total_sensors,
+    COUNT(DISTINCT sensor_id) FILTER (WHERE level IN ({extreme_list}) AND (dur > 0 OR cnt > 0)) AS sensors_at_extreme,
+    SUM(cnt) FILTER (WHERE level IN ({extreme_list})) AS extreme_events
+FROM sensor_level_long
+GROUP BY vehicle_id, {period_expr}, metric
+ORDER BY vehicle_id, {period_name}, metric;
+        """)
+        return distribution, extremes
+
+    daily_distribution, daily_extremes = rollup("report_date", "report_date")
+    monthly_distribution, monthly_extremes = rollup("STRFTIME(report_date, '%Y-%m')", "month_year")
+
+    write_output(daily_distribution, f"{output_folder}kpi_level_distribution_daily.csv")
+    write_output(monthly_distribution, f"{output_folder}kpi_level_distribution_monthly.csv", 'month_year')
+    write_output(daily_extremes, f"{output_folder}kpi_extreme_levels_daily.csv")
+    write_output(monthly_extremes, f"{output_folder}kpi_extreme_levels_monthly.csv", 'month_year')
+
+    analyzer.query("DROP TABLE sensor_level_long;")
+    logger.info(f"Level KPIs generated: {len(daily_distribution)} daily and {len(monthly_distribution)} monthly rows")
+    return daily_distribution, daily_extremes
@@ -0,0 +1,96 @@
+import logging
+
+from logging_decorator import log_function
+
+logger = logging.getLogger(__name__)
+
+# Asset -> (source table, roster table, assignment columns; the first one is the asset id)
+ROSTERS = {
+    'sensor': ('time_in_level_sensor', 'roster_sensor', ['sensor_id', 'vehicle_id', 'wheel_position', 'wheel_id']),
+    'device': ('time_in_level_device', 'roster_device', ['device_id', 'vehicle_id']),
+}
+ROSTER_SOURCES = 'roster_sources'
+DATE_COLUMN = 'report_start_at'
+
+
+def _roster_of(name):
+    return next(((asset, table, columns) for asset, (source, table, columns) in ROSTERS.items() if source == name),
+                (None, None, None))
+
+
+@log_function
+def update_roster(analyzer, name, source=None, source_fingerprint=None):
+    """
+    Merge a freshly registered table into its roster: one row per assignment (sensor on a
+    vehicle/wheel, hub on a vehicle) with the first and last day it reported, widened as
+    new data arrives (slowly changing dimension, a move to another wheel opens a new row).
+    Inputs already merged (same analyzer.fingerprints entry) are skipped, so with an
+    on-disk database only new loads are scanned, and only once, by a single GROUP BY.
+    source is the relation scanned instead of name when name only holds part of the
+    history (a store view pruned to the report range), with its own source_fingerprint.
+    """
+    asset, table, columns = _roster_of(name)
+    if asset is None:
+        return
+    analyzer.conn.execute(f"CREATE TABLE IF NOT EXISTS {ROSTER_SOURCES} (source_fingerprint VARCHAR PRIMARY KEY)")
+    source = source or name
+    source_fingerprint = source_fingerprint or analyzer.fingerprints.get(name)
+    if source_fingerprint is not None and analyzer.conn.execute(
+            f"SELECT 1 FROM {ROSTER_SOURCES} WHERE source_fingerprint = ?", [source_fingerprint]).fetchone():
+        return
+
+    keys = ', '.join(columns)
+    analyzer.conn.execute(f"""--sql
+CREATE TABLE IF NOT EXISTS {table} AS
+SELECT {keys}, NULL::DATE AS first_seen, NULL::DATE AS last_seen FROM {source} LIMIT 0
+    """)
+    analyzer.replace_relation(table, f"""--sql
+SELECT {keys}, MIN(first_seen) AS first_seen, MAX(last_seen) AS last_seen
+FROM (
+    SELECT * FROM {table}
+    UNION ALL
+    SELECT {keys}, MIN({DATE_COLUMN})::DATE, MAX({DATE_COLUMN})::DATE
+    FROM {source}
+    WHERE {columns[0]} IS NOT NULL
+    GROUP BY ALL
+)
+GROUP BY ALL
+    """)
+    if source_fingerprint is not None:
+        analyzer.conn.execute(f"INSERT INTO {ROSTER_SOURCES} VALUES (?)", [source_fingerprint])
+    logger.info(f"Roster '{table}' updated from '{name}'")
+
+
+def installed_assets(analyzer, asset, start_date, end_date):
+    """
+    Assets installed on every day of [start_date, end_date]: first seen on or before the
+    day and last seen on or after it. Sweep line over the roster's lifetimes (+1 on the
+    first day, -1 the day after the last) with an as-of lookup per calendar day,
+    O(assets) instead of a distinct count over the report rows.
+    """
+    _, table, columns = ROSTERS[asset]
+    return analyzer.query(f"""--sql
+WITH lifetimes AS (
+    SELECT {columns[0]}, MIN(first_seen) AS first_seen, MAX(last_seen) AS last_seen
+    FROM {table}
+    GROUP BY 1
+),
+events AS (
+    SELECT first_seen AS day, 1 AS delta FROM lifetimes
+    UNION ALL
+    SELECT last_seen + 1 AS day, -1 AS delta FROM lifetimes
+),
+steps AS (
+    SELECT day, SUM(SUM(delta)) OVER (ORDER BY day) AS installed
+    FROM events
+    GROUP BY day
+),
+calendar AS (
+    SELECT range::DATE AS report_date
+    FROM range('{start_date}'::TIMESTAMP::DATE, '{end_date}'::TIMESTAMP::DATE + INTERVAL 1 DAY, INTERVAL 1 DAY)
+)
+SELECT c.report_date, COALESCE(s.installed, 0)::BIGINT AS installed
+FROM calendar c
+ASOF LEFT JOIN steps s ON c.report_date >= s.day
+ORDER BY c.report_date
+    """)
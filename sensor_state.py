@@ -0,0 +1,199 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from logging_decorator import log_function
+
+logger = logging.getLogger(__name__)
+
+WINDOW_DAYS = 7
+METRICS = ['temperature_avg', 'cold_pressure_avg', 'hot_pressure_avg']
+Z_COLUMNS = ['z_temp', 'z_cold', 'z_hot']
+SLOPE_COLUMNS = ['temperature_slope', 'cold_pressure_slope', 'hot_pressure_slope']
+EMPTY_DAY = np.iinfo('int64').min
+
+
+def _epoch_days(dates):
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype('int64')
+
+
+class SensorStateStore:
+    """
+    Per-sensor rolling state for streaming daily scoring.
+    Each sensor owns one row of fixed-size arrays: a ring buffer of its last
+    WINDOW_DAYS days of temperature / cold / hot pressure (slot = day % WINDOW_DAYS)
+    plus the window sums needed for z-scores and slopes. Scoring a new day only
+    touches the rows of the sensors reporting that day: O(sensors), whatever the history length.
+    Z-scores follow sensor_anomaly_detection with the calendar-day (RANGE) window.
+    """
+
+    def __init__(self, window_days=WINDOW_DAYS):
+        self.window_days = window_days
+        self.sensor_ids = np.empty(0, dtype='int64')
+        self._index = pd.Index(self.sensor_ids)
+        self.last_day = EMPTY_DAY
+        # Ring buffer
+        self.days = np.empty((0, window_days), dtype='int64')
+        self.values = np.empty((0, window_days, len(METRICS)), dtype='float64')
+        # Window sums per sensor and metric
+        self.count = np.empty((0, len(METRICS)), dtype='float64')
+        self.sum = np.empty((0, len(METRICS)), dtype='float64')
+        self.sum_sq = np.empty((0, len(METRICS)), dtype='float64')
+        self.sum_xy = np.empty((0, len(METRICS)), dtype='float64')
+        self.n_rows = np.empty(0, dtype='float64')
+        self.sum_x = np.empty(0, dtype='float64')
+        self.sum_xx = np.empty(0, dtype='float64')
+
+    def __len__(self):
+        return len(self.sensor_ids)
+
+    def _rows_for(self, sensor_ids):
+        """Array row per sensor id, appending rows for sensors never seen before"""
+        rows = self._index.get_indexer(sensor_ids)
+        new_ids = np.unique(sensor_ids[rows < 0])
+        if len(new_ids):
+            grow = len(new_ids)
+            self.sensor_ids = np.concatenate([self.sensor_ids, new_ids])
+            self._index = pd.Index(self.sensor_ids)
+            self.days = np.concatenate([self.days, np.full((grow, self.window_days), EMPTY_DAY)])
+            self.values = np.concatenate([self.values, np.full((grow, self.window_days, len(METRICS)), np.nan)])
+            for name in ['count', 'sum', 'sum_sq', 'sum_xy']:
+                setattr(self, name, np.concatenate([getattr(self, name), np.zeros((grow, len(METRICS)))]))
+            for name in ['n_rows', 'sum_x', 'sum_xx']:
+                setattr(self, name, np.concatenate([getattr(self, name), np.zeros(grow)]))
+            rows = self._index.get_indexer(sensor_ids)
+        return rows
+
+    def _refresh_sums(self, rows, day):
+        """Drop ring slots older than the window and recompute the sums of the given rows"""
+        stale = self.days[rows] < day - (self.window_days - 1)
+        self.days[rows] = np.where(stale, EMPTY_DAY, self.days[rows])
+        self.values[rows] = np.where(stale[:, :, None], np.nan, self.values[rows])
+
+        days = self.days[rows]
+        present = days != EMPTY_DAY
+        x = (np.where(present, days, day) - day).astype('float64')  # relative day keeps sums small
+        values = self.values[rows]
+        valid = ~np.isnan(values)
+        y = np.where(valid, values, 0.0)
+
+        self.count[rows] = valid.sum(axis=1)
+        self.sum[rows] = y.sum(axis=1)
+        self.sum_sq[rows] = (y * y).sum(axis=1)
+        self.sum_xy[rows] = (x[:, :, None] * y).sum(axis=1)
+        self.n_rows[rows] = present.sum(axis=1)
+        self.sum_x[rows] = x.sum(axis=1)
+        self.sum_xx[rows] = (x * x).sum(axis=1)
+
+    def update(self, day_df):
+        """
+        Push one or more days of sensor rows (sensor_id, report_date and METRICS)
+        into the state and return them scored with z-scores and slopes.
+        Days must arrive in order; re-pushing the last day replaces its values.
+        """
+        scored = []
+        for report_date, rows_df in day_df.groupby('report_date', sort=True):
+            day = int(_epoch_days([report_date])[0])
+            if self.last_day != EMPTY_DAY and day < self.last_day:
+                raise ValueError(f"Day {report_date} is older than the state ({self.last_day}), rebuild instead")
+
+            rows_df = rows_df.drop_duplicates('sensor_id', keep='last')
+            rows = self._rows_for(rows_df['sensor_id'].to_numpy(dtype='int64'))
+            slot = day % self.window_days
+            x = rows_df[METRICS].to_numpy(dtype='float64', na_value=np.nan)
+
+            self.days[rows, slot] = day
+            self.values[rows, slot] = x
+            self._refresh_sums(rows, day)
+            self.last_day = day
+
+            count, total, sum_sq = self.count[rows], self.sum[rows], self.sum_sq[rows]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = total / count
+                sd = np.sqrt(np.clip((sum_sq - total * mean) / (count - 1), 0.0, None))
+                z = (x - mean) / sd
+                n, sum_x, sum_xx = self.n_rows[rows, None], self.sum_x[rows, None], self.sum_xx[rows, None]
+                denom = n * sum_xx - sum_x * sum_x
+                slope = (n * self.sum_xy[rows] - sum_x * total) / denom
+            z[~np.isfinite(z) | (sd == 0)] = 0.0
+            slope[denom[:, 0] == 0] = 0.0
+
+            result = rows_df.copy()
+            result[Z_COLUMNS] = z
+            result[SLOPE_COLUMNS] = slope
+            scored.append(result)
+
+        if not scored:
+            return day_df.assign(**{col: pd.Series(dtype='float64') for col in Z_COLUMNS + SLOPE_COLUMNS})
+        return pd.concat(scored, ignore_index=True)
+
+    def save(self, path):
+        """Persist the state as a single compressed .npz file (written atomically)"""
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, window_days=self.window_days, last_day=self.last_day,
+                            sensor_ids=self.sensor_ids, days=self.days, values=self.values)
+        os.replace(tmp_path, path)
+        logger.info(f"Sensor state saved to {path} ({len(self)} sensors)")
+
+    @classmethod
+    def load(cls, path):
+        """Load a saved state; the window sums are recomputed from the ring buffer"""
+        with np.load(path) as data:
+            store = cls(int(data['window_days']))
+            store._rows_for(data['sensor_ids'])
+            # New sensor rows are allocated in sorted id order, align the saved buffers to them
+            rows = store._index.get_indexer(data['sensor_ids'])
+            store.days[rows] = data['days']
+            store.values[rows] = data['values']
+            store.last_day = int(data['last_day'])
+        if len(store):
+            store._refresh_sums(np.arange(len(store)), store.last_day)
+        return store
+
+    @classmethod
+    @log_function
+    def rebuild(cls, analyzer, end_date, window_days=WINDOW_DAYS):
+        """
+        Rebuild the state as of end_date from the history table (only the last window is read).
+        The state then covers every day up to end_date, reported or not.
+        """
+        end = pd.Timestamp(end_date).normalize()
+        start = end - pd.Timedelta(days=window_days - 1)
+        history = analyzer.query(f"""--sql
+SELECT sensor_id, report_start_at::DATE AS report_date, {', '.join(METRICS)}
+FROM time_in_level_sensor
+WHERE report_start_at >= '{start.date()}' AND report_start_at < '{(end + pd.Timedelta(days=1)).date()}'
+ORDER BY report_date, sensor_id
+        """)
+        store = cls(window_days)
+        store.update(history)
+        store.last_day = int(_epoch_days([end])[0])
+        return store
+
+
+@log_function
+def score_sensor_day(analyzer, report_date, state_path='output/sensor_state.npz'):
+    """
+    Streaming daily scoring: load (or rebuild) the per-sensor state, push the
+    sensors reporting on report_date, persist the state and return their scores.
+    The saved state is only used when it ends the day before report_date.
+    """
+    day = pd.Timestamp(report_date).normalize()
+    previous_day = day - pd.Timedelta(days=1)
+    store = SensorStateStore.load(state_path) if os.path.exists(state_path) else None
+    if store is None or store.last_day != int(_epoch_days([previous_day])[0]):
+        # No state, a re-scored day or skipped days: rebuild the window up to the day before
+        store = SensorStateStore.rebuild(analyzer, previous_day, store.window_days if store else WINDOW_DAYS)
+
+    day_df = analyzer.query(f"""--sql
+SELECT id, sensor_id, vehicle_id, wheel_position, report_start_at::DATE AS report_date, {', '.join(METRICS)}
+FROM time_in_level_sensor
+WHERE report_start_at >= '{day.date()}' AND report_start_at < '{(day + pd.Timedelta(days=1)).date()}'
+    """)
+    scored = store.update(day_df)
+    store.save(state_path)
+
+    logger.info(f"Scored {len(scored)} sensors for {day.date()}")
+    return scored
@@ -0,0 +1,133 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from duck import DuckDBAnalyzer
+from exporter import write_output
+from logging_decorator import log_function
+from partitions import QUARANTINE_FILE
+from query_functions import (WINDOW_MODE, _compute_sensor_zscores, _export_sensor_availability, _fit_isolation_forest,
+                             _interpret_sensor_anomalies, _query_fleet_status, _query_sensor_availability)
+from proactive.query_functions_ds import _build_mechanical_failure_frames, _export_mechanical_failure_report
+
+logger = logging.getLogger(__name__)
+
+TABLES = ['time_in_level_device', 'time_in_level_sensor']
+
+# One DuckDB thread per worker process: the shards are the parallelism
+SHARD_ANALYZER_SETTINGS = {'threads': 1, 'preserve_insertion_order': False}
+
+
+def shard_root(store_root, table, n_shards):
+    """
+    Store of a table split into n_shards vehicle buckets. It has its own root, next to the
+    month-only store of app.py, as the two Hive layouts cannot be read as one dataset.
+    """
+    return f"{store_root}shards_{n_shards}/{table}"
+
+
+def _run_shard(shard, store_root, start_date, end_date, n_shards, window_mode, analyzer_settings,
+               fleet_health, anomaly_detection):
+    """
+    Worker: open a private DuckDB connection on one vehicle bucket and run every
+    per-vehicle stage. Fleet-wide steps (Isolation Forest fit, totals) are left to the parent.
+    """
+    started = time.time()
+    analyzer = DuckDBAnalyzer(**analyzer_settings)
+    for table in TABLES:
+        root = shard_root(store_root, table, n_shards)
+        analyzer.register_partitioned(table, root, start_date, end_date, vehicle_bucket=shard, allow_empty=True)
+        # Quarantined rows of the bucket, for the Hardware Fail rows of the mechanical report
+        quarantine = os.path.join(root, QUARANTINE_FILE)
+        if os.path.exists(quarantine):
+            analyzer.conn.execute(f"""--sql
+CREATE VIEW {table}_quarantine AS
+SELECT * FROM read_parquet('{quarantine}') WHERE vehicle_id % {n_shards} = {shard}
+            """)
+
+    results = {
+        'fleet_status': _query_fleet_status(analyzer, start_date, end_date),
+        'mechanical': _build_mechanical_failure_frames(analyzer, start_date, end_date),
+    }
+    if fleet_health:
+        results['availability'] = _query_sensor_availability(analyzer, start_date, end_date)
+    if anomaly_detection:
+        results['zscores'] = _compute_sensor_zscores(analyzer, start_date, end_date, window_mode)
+    analyzer.close()
+    results['seconds'] = time.time() - started
+    return results
+
+
+def _merge_shard_results(shard_results, output_folder, output_mode=None):
+    """
+    Concatenate the per-vehicle frames, recompute fleet-level aggregates and export.
+    Returns the mechanical report's sensor and hub outputs and the scored anomalies
+    (None when anomaly detection did not run), as the single-process reports do.
+    """
+    if 'availability' in shard_results[0]:
+        # Sensor availability: active and installed counts of every day both add up across shards
+        daily = pd.concat([r['availability'] for r in shard_results], ignore_index=True)
+        daily = daily.groupby('report_date', as_index=False)[['active_sensors', 'total_sensors']].sum()
+        _export_sensor_availability(daily.sort_values('report_date').reset_index(drop=True), output_folder)
+
+    fleet_status = pd.concat([r['fleet_status'] for r in shard_results], ignore_index=True)
+    fleet_status = fleet_status.groupby('report_date', as_index=False).sum().sort_values('report_date')
+    write_output(fleet_status, f"{output_folder}fleet_status.csv")
+
+    anomalies = None
+    if 'zscores' in shard_results[0]:
+        # Isolation Forest is fit once over the whole fleet, in the same row order as a single run
+        zscores = pd.concat([r['zscores'] for r in shard_results], ignore_index=True)
+        zscores = zscores.sort_values(['report_date', 'sensor_id'], kind='stable').reset_index(drop=True)
+        anomalies = _interpret_sensor_anomalies(_fit_isolation_forest(zscores),
+                                                f"{output_folder}anomalies_from_sensors.csv")
+
+    sensor_df, device_df, vehicle_hub_df = [
+        pd.concat([r['mechanical'][i] for r in shard_results], ignore_index=True) for i in range(3)]
+    sensor_output_df, device_output_df = _export_mechanical_failure_report(
+        sensor_df.sort_values(['sensor_id', 'report_date'], kind='stable'),
+        device_df.sort_values(['vehicle_id', 'report_date', 'device_id', 'id'], kind='stable'),
+        vehicle_hub_df.sort_values(['vehicle_id', 'report_date'], kind='stable'),
+        output_sensor_path=f"{output_folder}sensor_anomalies.csv",
+        output_device_path=f"{output_folder}hub_anomalies.csv",
+        output_sensor_variables_path=f"{output_folder}sensor_variables.csv",
+        output_sensor_statistics_path=f"{output_folder}sensor_statistics.csv",
+        output_device_statistics_path=f"{output_folder}device_statistics.csv",
+        output_vehicle_hub_path=f"{output_folder}vehicle_hub_anomalies.csv",
+        output_mode=output_mode,
+        output_star_folder=f"{output_folder}star/",
+    )
+    return sensor_output_df, device_output_df, anomalies
+
+
+@log_function
+def run_sharded_pipeline(store_root, start_date, end_date, n_shards, output_folder='output/',
+                         max_workers=None, window_mode=WINDOW_MODE, analyzer_settings=None,
+                         fleet_health=False, anomaly_detection=False, output_mode=None):
+    """
+    Sharded execution of the per-vehicle reports over the stores at shard_root (written
+    by DuckDBAnalyzer.register_stored with vehicle_buckets=n_shards): one worker process
+    per vehicle bucket, each with its own DuckDB connection on its own slice, then a merge
+    step for the fleet-wide parts. Always writes fleet status and the mechanical report
+    (flat or star, see output_mode); availability and anomaly detection when asked.
+    The report stages are not checkpointed: every run recomputes them from the store.
+    Returns the mechanical sensor and hub outputs and the anomalies (or None).
+    """
+    analyzer_settings = analyzer_settings or SHARD_ANALYZER_SETTINGS
+    max_workers = max_workers or min(n_shards, os.cpu_count() or 1)
+
+    # spawn: never fork a process that holds DuckDB threads
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(_run_shard, shard, store_root, start_date, end_date, n_shards, window_mode,
+                               analyzer_settings, fleet_health, anomaly_detection)
+                   for shard in range(n_shards)]
+        shard_results = [future.result() for future in futures]
+
+    for shard, result in enumerate(shard_results):
+        logger.info(f"Shard {shard}/{n_shards}: {len(result['mechanical'][0])} sensor rows in {result['seconds']:.2f}s")
+
+    return _merge_shard_results(shard_results, output_folder, output_mode)
@@ -0,0 +1,68 @@
+import logging
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Memory-backed filesystem when there is one: published data never touches the disk
+SHARED_DATA_ROOT = '/dev/shm' if os.path.isdir('/dev/shm') else None
+# Arrays of Python objects cannot be mapped, they are pickled under this suffix instead
+OBJECT_SUFFIX = '.object.npy'
+
+
+class SharedData:
+    """
+    Data plane for parallel stages: arrays are published once as .npy files on shared
+    memory and workers attach to them by handle (their path) as read-only memory maps.
+    Every worker of the host reads the same pages, nothing is pickled or copied per task.
+    Numeric, bool and datetime arrays are zero-copy; object arrays are pickled and loaded
+    whole by each worker. Used by the chunked Isolation Forest scoring and attribution
+    whenever they dispatch to joblib workers (more than one chunk), in-process runs keep
+    the array as it is.
+    Use as a context manager: the published data is removed on exit, and at the
+    latest when the object is garbage collected.
+    """
+
+    def __init__(self, root=SHARED_DATA_ROOT):
+        self.folder = tempfile.mkdtemp(prefix='atms_shared_', dir=root)
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self.folder, True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _path(self, name):
+        if os.sep in name or name.startswith('.'):
+            raise ValueError(f"Invalid shared data name '{name}'")
+        return os.path.join(self.folder, name)
+
+    def publish(self, name, array):
+        """Copy an array into shared memory once, returns its handle"""
+        return _save(self._path(name), array)
+
+    def close(self):
+        """Remove everything published; workers still attached keep their maps until they drop them"""
+        self._cleanup()
+
+
+def _save(path, array):
+    array = np.asarray(array)
+    path = f"{path}{OBJECT_SUFFIX}" if array.dtype.hasobject else f"{path}.npy"
+    np.save(path, array, allow_pickle=array.dtype.hasobject)
+    return path
+
+
+def attach(handle):
+    """Read-only array of a handle from SharedData.publish (an array is returned unchanged)"""
+    if isinstance(handle, np.ndarray):
+        return handle
+    if handle.endswith(OBJECT_SUFFIX):
+        return np.load(handle, allow_pickle=True)
+    return np.load(handle, mmap_mode='r')
+
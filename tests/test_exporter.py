@@ -0,0 +1,32 @@
+import os
+
+import pandas as pd
+
+from exporter import output_files, write_output
+
+
+def _report(*days):
+    return pd.DataFrame({'report_date': pd.to_datetime(list(days)), 'value': range(len(days))})
+
+
+def test_switching_mode_removes_the_other_output(tmp_path):
+    path = str(tmp_path / 'report.csv')
+    write_output(_report('2023-01-05', '2023-02-05'), path)
+    write_output(_report('2023-01-05', '2023-02-05'), path, partition='month')
+    assert not os.path.exists(path)
+    assert sorted(map(os.path.basename, output_files(path))) == [
+        'manifest.json', 'report_2023-01.csv', 'report_2023-02.csv']
+
+    write_output(_report('2023-01-05'), path)
+    assert not os.path.exists(tmp_path / 'report')
+    assert output_files(path) == [path]
+
+
+def test_periods_missing_from_the_recomputed_range_are_removed(tmp_path):
+    path = str(tmp_path / 'report.csv')
+    write_output(_report('2023-01-05', '2023-02-05', '2023-03-05', '2023-04-05'), path, partition='month')
+    # Recompute February to April: March has no rows anymore, January is outside the range
+    write_output(_report('2023-02-06', '2023-04-06'), path, partition='month')
+    assert sorted(map(os.path.basename, output_files(path))) == [
+        'manifest.json', 'report_2023-01.csv', 'report_2023-02.csv', 'report_2023-04.csv']
+    assert not os.path.exists(tmp_path / 'report' / 'report_2023-03.csv')
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from duck import DuckDBAnalyzer
+from proactive.feature_engine import cross_check_engines
+
+START_DATE, END_DATE = '2023-01-01', '2023-02-28'
+LEVEL_COLUMNS = ['level_1_high_cold_pressure_dur', 'level_2_high_hot_pressure_dur', 'level_2_high_temperature_dur',
+                 'level_3_high_temperature_dur', 'level_3_low_cold_pressure_dur', 'level_3_low_cold_pressure_cnt']
+
+
+def _sensor_rows(seed=7):
+    """
+    Daily reports of 2 vehicles x 4 wheels with random gaps (some longer than the
+    window), a few NULL readings and a second report on some sensor-days.
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(START_DATE, END_DATE)
+    rows = []
+    for vehicle in (1, 2):
+        for wheel in range(1, 5):
+            sensor = vehicle * 10 + wheel
+            reported = days[rng.random(len(days)) > 0.25]
+            reported = reported[(reported < '2023-01-20') | (reported > '2023-01-29')]
+            duplicated = reported[rng.random(len(reported)) < 0.1]
+            for day in reported.append(duplicated):
+                rows.append({
+                    'sensor_id': sensor, 'vehicle_id': vehicle, 'wheel_position': wheel, 'wheel_id': sensor + 100,
+                    'sensor_key': sensor, 'vehicle_key': vehicle,
+                    'report_start_at': day + pd.Timedelta(hours=int(rng.integers(0, 24))),
+                    'temperature_avg': np.nan if rng.random() < 0.05 else 40 + rng.normal(0, 3),
+                    'cold_pressure_avg': 100 + rng.normal(0, 4),
+                    'hot_pressure_avg': 110 + rng.normal(0, 4),
+                    'transmitting_dur': int(rng.integers(1, 86400)),
+                    **{column: int(rng.integers(0, 3600)) for column in LEVEL_COLUMNS},
+                })
+    df = pd.DataFrame(rows).sample(frac=1, random_state=seed).reset_index(drop=True)
+    df.insert(0, 'id', np.arange(1, len(df) + 1))
+    return df
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    analyzer = DuckDBAnalyzer()
+    rows = _sensor_rows()
+    analyzer.conn.register('sensor_rows', rows)
+    analyzer.conn.execute("CREATE TABLE time_in_level_sensor AS SELECT * FROM sensor_rows")
+    yield analyzer
+    analyzer.close()
+
+
+def test_fixture_has_gaps_and_duplicate_days(analyzer):
+    duplicates, longest_gap = analyzer.conn.execute("""
+SELECT
+    (SELECT COUNT(*) FROM (SELECT sensor_key, report_start_at::DATE FROM time_in_level_sensor GROUP BY ALL
+                           HAVING COUNT(*) > 1)),
+    (SELECT MAX(gap) FROM (SELECT report_start_at::DATE - LAG(report_start_at::DATE)
+                               OVER (PARTITION BY sensor_key ORDER BY report_start_at) AS gap
+                           FROM time_in_level_sensor))
+    """).fetchone()
+    assert duplicates > 0
+    assert longest_gap > 7
+
+
+@pytest.mark.parametrize('window_mode', ['range', 'rows'])
+def test_numpy_engine_matches_sql(analyzer, window_mode):
+    diffs, _ = cross_check_engines(analyzer, START_DATE, END_DATE, window_mode=window_mode)
+    assert (diffs < 1e-9).all(), diffs[diffs >= 1e-9].to_dict()
@@ -0,0 +1,17 @@
+import pandas as pd
+
+from leaderboard import RiskLeaderboard
+
+
+def test_duplicate_asset_days_take_one_slot():
+    # Sensor 1 reported three times on the same day, all worse than sensors 2 and 3
+    df = pd.DataFrame({
+        'report_date': pd.Timestamp('2023-02-01'),
+        'sensor_id': [1, 1, 1, 2, 3],
+        'vehicle_id': [10, 10, 10, 10, 20],
+        'risk_score': [90.0, 95.0, 99.0, 80.0, 70.0],
+    })
+    board = RiskLeaderboard(capacity=2).update(df, 'sensor', 'sensor_id', ['risk_score'])
+    top = board.top_k(2)
+    assert top['asset_id'].tolist() == [1, 2]
+    assert top['score'].tolist() == [99.0, 80.0]
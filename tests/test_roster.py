@@ -0,0 +1,41 @@
+import pandas as pd
+
+from duck import DuckDBAnalyzer
+from roster import installed_assets
+
+# sensor -> days it reported: 1 every month, 2 January only, 3 March only,
+# 4 January and March with no report in February (still installed in between)
+REPORTS = {
+    1: ['2023-01-10', '2023-02-10', '2023-03-10'],
+    2: ['2023-01-10'],
+    3: ['2023-03-10'],
+    4: ['2023-01-10', '2023-03-10'],
+}
+
+
+def _store(tmp_path):
+    root = str(tmp_path / 'store')
+    rows = [{'sensor_id': sensor, 'vehicle_id': 1, 'wheel_position': sensor, 'wheel_id': sensor + 100,
+             'report_start_at': pd.Timestamp(day)}
+            for sensor, days in REPORTS.items() for day in days]
+    analyzer = DuckDBAnalyzer()
+    analyzer.conn.register('reports', pd.DataFrame(rows))
+    analyzer.conn.execute("CREATE TABLE time_in_level_sensor AS SELECT * FROM reports")
+    analyzer.export_partitioned('time_in_level_sensor', root)
+    analyzer.close()
+    return root
+
+
+def _installed_on(root, day, start_date, end_date):
+    analyzer = DuckDBAnalyzer()
+    analyzer.register_partitioned('time_in_level_sensor', root, start_date, end_date)
+    installed = installed_assets(analyzer, 'sensor', day, day)['installed'].iloc[0]
+    analyzer.close()
+    return installed
+
+
+def test_installed_baseline_does_not_depend_on_the_range(tmp_path):
+    root = _store(tmp_path)
+    february = _installed_on(root, '2023-02-01', '2023-02-01', '2023-02-28')
+    first_quarter = _installed_on(root, '2023-02-01', '2023-01-01', '2023-03-31')
+    assert february == first_quarter == 2
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from data_quality import apply_quality_gate
+from data_types import quality_rules_sensor
+from duck import DuckDBAnalyzer
+from proactive.query_functions_ds import (SENSOR_FEATURES, _add_quarantined_failures, _classify_sensor_issues,
+                                          _extract_quarantined_sensor_rows)
+from proactive.threshold_sweep import sweep_sensor_thresholds
+
+
+def _features(**columns):
+    """Healthy sensor feature rows, with the given columns overridden (one value per row)"""
+    n = len(next(iter(columns.values())))
+    df = pd.DataFrame({feature: np.zeros(n) for feature in SENSOR_FEATURES})
+    df['transmitting_dur'] = 86400.0
+    df['temperature_avg'] = 40.0
+    df['cold_pressure_avg'] = 100.0
+    df['std_temp'] = df['std_cold'] = 1.0
+    for column, values in columns.items():
+        df[column] = values
+    return df
+
+
+def test_window_without_spread_is_not_frozen():
+    # NULL std: a single reading in the window (first day, or the first day after a gap)
+    df = _features(std_temp=[np.nan, 0.0, 1.0], std_cold=[np.nan, 0.0, 1.0])
+    assert _classify_sensor_issues(df)['issue_category'].tolist() == ['Normal', 'Hardware Fail', 'Normal']
+
+
+def test_sweep_ignores_windows_without_spread():
+    df = _features(std_temp=[np.nan, 0.0, 1.0], std_cold=[np.nan, 0.0, 1.0])
+    result = sweep_sensor_thresholds(df, {'FROZEN_STD_THRESHOLD': [0.001, 2.0]})
+    assert result['Hardware Fail'].tolist() == [1, 2]
+
+
+def test_impossible_readings_are_reported_as_hardware_fail():
+    # Sensor 2 only ever reports an impossible temperature: every row of it is quarantined at ingest
+    analyzer = DuckDBAnalyzer()
+    analyzer.conn.execute("""
+CREATE TABLE time_in_level_sensor AS
+SELECT
+    i AS id, 1 + i % 2 AS sensor_id, 1 AS vehicle_id, 1 + i % 2 AS wheel_position, 100 + i % 2 AS wheel_id,
+    TIMESTAMP '2023-01-01' + to_days((i // 2)::INTEGER) AS report_start_at,
+    CASE WHEN i % 2 = 1 THEN 999 ELSE 40 END AS temperature_avg,
+    100 AS cold_pressure_avg, 110 AS hot_pressure_avg,
+    86400 AS transmitting_dur, 0 AS not_transmitting_dur
+FROM range(10) t(i)
+    """)
+    rules = [(code, condition) for code, condition in quality_rules_sensor
+             if code in ('MISSING_KEY', 'TEMPERATURE_OUT_OF_RANGE')]
+    apply_quality_gate(analyzer, 'time_in_level_sensor', rules)
+
+    quarantined = _extract_quarantined_sensor_rows(analyzer, '2023-01-01', '2023-01-31')
+    assert quarantined['sensor_id'].unique().tolist() == [2]
+
+    clean = _classify_sensor_issues(_features(std_temp=[1.0] * 5, std_cold=[1.0] * 5).assign(
+        id=[0, 2, 4, 6, 8], sensor_id=1, report_date=quarantined['report_date'].to_numpy()))
+    report = _add_quarantined_failures(clean, quarantined)
+    failures = report[report['issue_category'] == 'Hardware Fail']
+    assert failures['sensor_id'].unique().tolist() == [2]
+    assert len(failures) == 5 and (failures['risk_score'] == 100).all()
+    analyzer.close()
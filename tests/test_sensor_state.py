@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from duck import DuckDBAnalyzer
+from query_functions import _compute_sensor_zscores
+from sensor_state import Z_COLUMNS, score_sensor_day
+
+START_DATE, END_DATE = '2023-01-01', '2023-02-28'
+LEVEL_COLUMNS = [f"level_3_{side}_{metric}_dur" for side in ('high', 'low')
+                 for metric in ('temperature', 'cold_pressure', 'hot_pressure')]
+
+
+def _sensor_rows(seed=3):
+    """One daily report per sensor of 2 vehicles x 4 wheels, with random missing days"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for vehicle in (1, 2):
+        for wheel in range(1, 5):
+            sensor = vehicle * 10 + wheel
+            for day in pd.date_range(START_DATE, END_DATE):
+                if rng.random() < 0.3:
+                    continue
+                rows.append({
+                    'sensor_id': sensor, 'vehicle_id': vehicle, 'wheel_position': wheel,
+                    'sensor_key': sensor, 'vehicle_key': vehicle,
+                    'report_start_at': day + pd.Timedelta(hours=int(rng.integers(0, 24))),
+                    'temperature_avg': 40 + rng.normal(0, 3),
+                    'cold_pressure_avg': 100 + rng.normal(0, 4),
+                    'hot_pressure_avg': 110 + rng.normal(0, 4),
+                    **{column: int(rng.integers(0, 3600)) for column in LEVEL_COLUMNS},
+                })
+    df = pd.DataFrame(rows)
+    df.insert(0, 'id', np.arange(1, len(df) + 1))
+    return df
+
+
+@pytest.fixture(scope='module')
+def analyzer():
+    analyzer = DuckDBAnalyzer()
+    analyzer.conn.register('sensor_rows', _sensor_rows())
+    analyzer.conn.execute("CREATE TABLE time_in_level_sensor AS SELECT * FROM sensor_rows")
+    yield analyzer
+    analyzer.close()
+
+
+def _scores(df):
+    return df.sort_values('id').set_index('id')[Z_COLUMNS]
+
+
+def test_skipped_days_are_not_ignored(analyzer, tmp_path):
+    state_path = str(tmp_path / 'sensor_state.npz')
+    score_sensor_day(analyzer, '2023-02-01', state_path)
+    after_gap = score_sensor_day(analyzer, '2023-02-04', state_path)
+    fresh = score_sensor_day(analyzer, '2023-02-04', str(tmp_path / 'fresh_state.npz'))
+    pd.testing.assert_frame_equal(_scores(after_gap), _scores(fresh))
+
+
+def test_streaming_matches_the_range_window(analyzer, tmp_path):
+    state_path = str(tmp_path / 'sensor_state.npz')
+    days = pd.date_range('2023-02-01', END_DATE)
+    streamed = pd.concat([score_sensor_day(analyzer, day, state_path) for day in days])
+    batch = _compute_sensor_zscores(analyzer, START_DATE, f"{END_DATE} 23:59:59", window_mode='range')
+    batch = batch[pd.to_datetime(batch['report_date']) >= days[0]]
+    assert len(streamed) == len(batch)
+    np.testing.assert_allclose(_scores(streamed).to_numpy(), _scores(batch).to_numpy(), atol=1e-9)
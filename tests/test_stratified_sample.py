@@ -0,0 +1,30 @@
+import numpy as np
+import pandas as pd
+
+from query_functions import _stratified_sample
+
+
+def _reports(n, vehicles, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'vehicle_id': rng.integers(0, vehicles, n),
+        'wheel_position': rng.integers(0, 4, n),
+        'report_date': pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 365, n), unit='D'),
+    })
+
+
+def test_sample_size_is_capped_with_more_strata_than_rows_requested():
+    # ~4,800 (vehicle, wheel, month) strata for a sample of 1,000 rows
+    df = _reports(20_000, vehicles=100)
+    sample = _stratified_sample(df, 1_000, seed=0)
+    assert len(sample) <= 1_000
+    assert len(np.unique(sample)) == len(sample)
+
+
+def test_big_strata_keep_their_share():
+    df = pd.concat([_reports(9_000, vehicles=1).assign(report_date=pd.Timestamp('2023-01-01')),
+                    _reports(1_000, vehicles=1).assign(vehicle_id=1, report_date=pd.Timestamp('2023-01-01'))],
+                   ignore_index=True)
+    sample = _stratified_sample(df, 1_000, seed=0)
+    assert len(sample) == 1_000
+    assert (df['vehicle_id'].to_numpy()[sample] == 1).sum() in range(95, 106)